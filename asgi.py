@@ -0,0 +1,310 @@
+# Async (ASGI) serving mode for the SecureBank API
+# Same API as main.py, but a waiting request (database, password check) no
+# longer ties up a worker, so one process holds many more connections.
+# Run with any ASGI server, e.g. `gunicorn -k uvicorn.workers.UvicornWorker asgi:app`
+# (or `uvicorn asgi:app` for a single process). Handlers are
+# coroutines; database work runs on a small dedicated thread pool (one pooled
+# connection per thread) and password hashing in the verifier process pool.
+# Everything else is shared with the Flask app rather than redone here:
+# requests are matched against main.py's URL map, parsed and answered with
+# werkzeug's Request/Response, sessions go through the app's
+# ServerSessionInterface, and the business rules are the ones in services.py.
+# A cookie issued by either server therefore works on both.
+import asyncio
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import g
+from werkzeug.exceptions import HTTPException, MethodNotAllowed
+from werkzeug.wrappers import Request, Response
+import database
+import metrics
+import passwords
+import services
+from main import app as flask_app
+
+# Threads that run database work; more than the two connection pools only queues
+DB_THREADS = int(os.environ.get('SECUREBANK_ASGI_DB_THREADS', str(database.POOL_SIZE + database.READ_POOL_SIZE)))
+MAX_BODY_SIZE = 1024 * 1024
+
+_db_executor = None
+
+def get_db_executor():
+    global _db_executor
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix='securebank-db')
+    return _db_executor
+
+def _call_in_app_context(request, fn, args):
+    # An app context per call gives the thread the same pooled connection
+    # handling as a Flask request
+    with flask_app.app_context():
+        try:
+            return fn(*args)
+        finally:
+            request.queries += g.get('_query_count', 0)
+
+def _call_with_connection(service, args, readonly, shard):
+    conn = database.get_read_connection(shard) if readonly else database.get_db_connection(shard)
+    try:
+        return service(conn, *args)
+    finally:
+        conn.close()
+
+async def run_in_app_context(request, fn, *args):
+    """Await fn(*args) on a database thread inside a Flask app context"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_db_executor(), _call_in_app_context, request, fn, args)
+
+async def run_db(request, service, *args, shard=0):
+    """Await service(conn, *args) on a database thread with a read-write connection to shard"""
+    return await run_in_app_context(request, _call_with_connection, service, args, False, shard)
+
+async def run_read(request, service, *args, shard=0):
+    """Like run_db, with a read-only connection"""
+    return await run_in_app_context(request, _call_with_connection, service, args, True, shard)
+
+def make_request(scope, body):
+    """A werkzeug Request (what Flask's request is built on) for an ASGI HTTP scope"""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = name if name == 'CONTENT_TYPE' else f'HTTP_{name}'
+        if key in environ:
+            value = environ[key] + ('; ' if name == 'COOKIE' else ',') + value
+        environ[key] = value
+    request = Request(environ)
+    request.queries = 0
+    request.session = None
+    request.shard = 0
+    return request
+
+# --- Sessions ---
+
+def _open_session(request):
+    return flask_app.session_interface.open_session(flask_app, request)
+
+def _save_session(session, response):
+    flask_app.session_interface.save_session(flask_app, session, response)
+
+async def open_session(request):
+    """The request's server-side session, as Flask would open it"""
+    request.session = await run_in_app_context(request, _open_session, request)
+    return request.session
+
+async def require_session(request):
+    """The logged-in session, or ServiceError(401)"""
+    session = await open_session(request)
+    if 'user_id' not in session:
+        raise services.ServiceError('Not authenticated', 401)
+    request.shard = database.shard_for_user(session['user_id'])
+    return session
+
+# --- Handlers ---
+
+async def login(request):
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data, dict):
+        return 400, {'success': False, 'message': 'Invalid request'}
+
+    account_number = data.get('account_number')
+    password = data.get('password')
+    if not account_number or not password:
+        return 400, {'success': False, 'message': 'Account number and password required'}
+
+    shard = await run_in_app_context(request, database.find_user_shard, account_number)
+
+    async def call_db(service, *args):
+        return await run_db(request, service, *args, shard=shard)
+
+    try:
+        user = await services.authenticate_async(call_db, account_number, password)
+    except services.ServiceError as e:
+        return e.status, {'success': False, 'message': e.message}
+    if not user:
+        return 401, {'success': False, 'message': 'Invalid account number or password'}
+
+    session = await open_session(request)
+    # New session id on login, as in main.login
+    session.rotate()
+    session['user_id'] = user['id']
+    session['account_number'] = user['account_number']
+    session['full_name'] = user['full_name']
+    return 200, {'success': True, 'message': 'Login successful!'}
+
+async def account_info(request):
+    session = await require_session(request)
+    return 200, await run_read(request, services.account_info, session['user_id'], shard=request.shard)
+
+async def dashboard(request):
+    session = await require_session(request)
+    return 200, await run_read(request, services.dashboard, session['user_id'], shard=request.shard)
+
+async def transactions(request):
+    session = await require_session(request)
+    page, next_cursor = await run_read(request, services.transactions_page, session['user_id'],
+                                     request.args.get('limit'), request.args.get('before'), shard=request.shard)
+    return 200, page, [('X-Next-Cursor', next_cursor)] if next_cursor else []
+
+async def deposit(request):
+    session = await require_session(request)
+    return 200, await run_db(request, services.deposit, session['user_id'],
+                             request.get_json(silent=True), shard=request.shard)
+
+async def withdraw(request):
+    session = await require_session(request)
+    return 200, await run_db(request, services.withdraw, session['user_id'],
+                             request.get_json(silent=True), shard=request.shard)
+
+async def transfer(request):
+    session = await require_session(request)
+    return 200, await run_db(request, services.transfer, session['user_id'],
+                             session['account_number'], request.get_json(silent=True), shard=request.shard)
+
+async def calculate_account_interest(request, account_id):
+    session = await require_session(request)
+    return 200, await run_db(request, services.calculate_account_interest,
+                             session['user_id'], account_id, shard=request.shard)
+
+async def interest_projection(request, account_id):
+    session = await require_session(request)
+    return 200, await run_read(request, services.interest_projection, session['user_id'], account_id,
+                               request.args.get('years'), request.args.get('compounding'),
+                               request.args.get('rate_schedule'), shard=request.shard)
+
+async def balance_history(request, account_id):
+    session = await require_session(request)
+    return 200, await run_read(request, services.balance_history, session['user_id'], account_id,
+                               request.args.get('from'), request.args.get('to'), shard=request.shard)
+
+# Flask endpoint (main.py view name) -> (method served here, handler). Paths
+# and their converters come from main.py's URL map; endpoints missing here
+# (pages, exports, batch transfers, /metrics) stay on the Flask app.
+HANDLERS = {
+    'login': ('POST', login),
+    'get_account_info': ('GET', account_info),
+    'get_dashboard': ('GET', dashboard),
+    'get_transactions': ('GET', transactions),
+    'deposit': ('POST', deposit),
+    'withdraw': ('POST', withdraw),
+    'transfer': ('POST', transfer),
+    'calculate_account_interest': ('POST', calculate_account_interest),
+    'get_interest_projection': ('GET', interest_projection),
+    'get_balance_history': ('GET', balance_history),
+}
+
+_urls = flask_app.url_map.bind('localhost')
+
+def match_route(method, path):
+    """(route label, handler, path arguments), or a status code for 404/405"""
+    try:
+        rule, arguments = _urls.match(path, method=method, return_rule=True)
+    except MethodNotAllowed:
+        return 405
+    except HTTPException:
+        return 404
+    if rule.endpoint not in HANDLERS:
+        return 404
+    handler_method, handler = HANDLERS[rule.endpoint]
+    if handler_method != method:
+        return 405
+    return rule.rule, handler, arguments
+
+# --- ASGI plumbing ---
+
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY_SIZE:
+            raise services.ServiceError('Request body too large', 413)
+        if not message.get('more_body'):
+            return bytes(body)
+
+def json_response(status, payload, headers=()):
+    return Response(flask_app.json.dumps(payload), status=status, headers=list(headers),
+                    mimetype='application/json')
+
+async def send_response(send, response):
+    body = response.get_data()
+    response.headers['Content-Length'] = str(len(body))
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in response.headers.items()],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Helpers for this worker process (the ASGI server may have forked)
+            passwords.get_verifier()
+            get_db_executor()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _db_executor is not None:
+                _db_executor.shutdown(wait=True)
+            database.get_pool().close_all()
+            database.get_read_pool().close_all()
+            passwords.get_verifier().shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    """The ASGI application"""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    started = time.perf_counter()
+    route = match_route(scope['method'], scope['path'])
+    if isinstance(route, int):
+        await send_response(send, json_response(route, {'error': 'Not found' if route == 404 else 'Method not allowed'}))
+        return
+    label, handler, path_args = route
+
+    request = None
+    try:
+        body = await read_body(receive)
+        if body is None:
+            return
+        request = make_request(scope, body)
+        response = json_response(*await handler(request, **path_args))
+    except services.ServiceError as e:
+        response = json_response(e.status, {'error': e.message})
+
+    if request is not None and request.session is not None:
+        # Sets, refreshes or deletes the cookie exactly as the Flask app does
+        await run_in_app_context(request, _save_session, request.session, response)
+    await send_response(send, response)
+    metrics.registry.record_request(label, scope['method'], response.status_code, time.perf_counter() - started,
+                                    request.queries if request is not None else 0)
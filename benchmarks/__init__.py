@@ -0,0 +1,2 @@
+# Benchmarks for SecureBank
+# Run from the repository root, e.g. `python -m benchmarks.interest_accrual`
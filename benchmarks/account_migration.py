@@ -0,0 +1,66 @@
+# Benchmark: migrate_accounts on a large old-schema accounts table.
+# Builds an accounts table in the pre-account_types layout with --rows rows,
+# runs the migrations and reports time, rows/s and peak memory.
+#
+#   python -m benchmarks.account_migration --rows 5000000
+#
+# Pages of the memory-mapped database file count towards RSS; run with
+# SECUREBANK_MMAP_SIZE=0 to see only the process's own memory growth.
+import argparse
+import resource
+import sqlite3
+import time
+
+import database
+from benchmarks import synthetic
+
+def build_old_schema(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE accounts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            account_type TEXT,
+            balance REAL DEFAULT 0.0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+        INSERT INTO accounts (id, user_id, account_type, balance, created_at)
+        SELECT i, (i + 1) / 2,
+               CASE i % 4 WHEN 0 THEN 'Checking' WHEN 1 THEN 'Savings' WHEN 2 THEN 'Fixed Deposit' ELSE 'Legacy' END,
+               (i % 100000) / 3.0, '2024-01-01 00:00:00'
+        FROM n
+    ''', (rows,))
+    conn.commit()
+    conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Large accounts table migration')
+    parser.add_argument('--rows', type=int, default=5000000)
+    parser.add_argument('--chunk-size', type=int, default=database.MIGRATION_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    path, cleanup = synthetic.temp_database()
+    try:
+        build_old_schema(path, args.rows)
+        synthetic.use_database(path)
+        database.MIGRATION_CHUNK_SIZE = args.chunk_size
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        started = time.perf_counter()
+        database.init_db()
+        elapsed = time.perf_counter() - started
+
+        conn = database.get_db_connection()
+        migrated = conn.execute('SELECT COUNT(*) FROM accounts').fetchone()[0]
+        conn.close()
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print(f"migrated {migrated} accounts in {elapsed:.1f}s ({migrated / elapsed:,.0f} rows/s), "
+              f"peak RSS grew by {(rss_after - rss_before) / 1024:.1f} MB")
+    finally:
+        cleanup()
+
+if __name__ == '__main__':
+    main()
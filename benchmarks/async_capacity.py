@@ -0,0 +1,207 @@
+# Benchmark: concurrent-connection capacity of the sync and async serving modes.
+# Starts SecureBank under gunicorn with sync or gthread workers (main:app) and
+# with uvicorn workers (asgi:app) on the same synthetic bank, then holds N keep-alive
+# connections open at once for each level in --connections. Every connection
+# is a logged-in user repeatedly reading /api/account-info and
+# /api/transactions. Reports, per level, how many connections were served,
+# throughput, p50/p99 latency and requests that failed or timed out.
+# Needs gunicorn and/or uvicorn installed; modes whose server is missing are skipped.
+#
+#   python -m benchmarks.async_capacity --connections 50,200,1000 --workers 2
+#   python -m benchmarks.async_capacity --modes sync,asgi --duration 20 --output capacity.json
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import secrets
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+
+from benchmarks import synthetic
+
+# mode -> (modules it needs, server command line)
+MODES = {
+    'sync': (('gunicorn',), lambda a: ['gunicorn', '--workers', str(a.workers), '--worker-class', 'sync',
+                                       '--bind', f'127.0.0.1:{a.port}', 'main:app']),
+    'gthread': (('gunicorn',), lambda a: ['gunicorn', '--workers', str(a.workers), '--worker-class', 'gthread',
+                                          '--threads', str(a.threads), '--bind', f'127.0.0.1:{a.port}', 'main:app']),
+    # gunicorn managing uvicorn workers; `uvicorn --workers N` re-creates the
+    # listening socket in each worker without TCP_NODELAY, which adds ~40 ms of
+    # Nagle/delayed-ACK latency to every keep-alive request
+    'asgi': (('gunicorn', 'uvicorn'), lambda a: ['gunicorn', '--workers', str(a.workers),
+                                                 '--worker-class', 'uvicorn.workers.UvicornWorker',
+                                                 '--bind', f'127.0.0.1:{a.port}', 'asgi:app']),
+}
+PATHS = ['/api/account-info', '/api/transactions']
+
+def create_sessions(path, count):
+    """Session ids for `count` synthetic users, written straight to the store
+
+    Logging in every connection would make the password hashing pool the
+    bottleneck in both modes, which is not what this benchmark measures.
+    """
+    conn = sqlite3.connect(path)
+    users = conn.execute('SELECT id, account_number, full_name FROM users ORDER BY id LIMIT ?', (count,)).fetchall()
+    expires_at = time.time() + 24 * 3600
+    sids = []
+    for user_id, account_number, full_name in users:
+        sid = secrets.token_urlsafe(32)
+        data = {'user_id': user_id, 'account_number': account_number, 'full_name': full_name}
+        conn.execute('INSERT INTO sessions (id, data, expires_at) VALUES (?, ?, ?)',
+                     (sid, json.dumps(data), expires_at))
+        sids.append(sid)
+    conn.commit()
+    conn.close()
+    return sids
+
+def start_server(mode, args, path):
+    _, command = MODES[mode]
+    env = dict(os.environ, SECUREBANK_DATABASE=path)
+    process = subprocess.Popen([sys.executable, '-m', *command(args)], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', args.port), timeout=1).close()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f'{mode} server exited during startup')
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'{mode} server did not start within 30 seconds')
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+async def http_get(reader, writer, path, cookie):
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nCookie: session={cookie}\r\n\r\n'.encode())
+    await writer.drain()
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed')
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+async def connection(sid, port, stop_at, timeout, samples, failures):
+    """One keep-alive connection issuing requests back to back until stop_at"""
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        failures['connect'] += 1
+        return False
+    served = False
+    i = 0
+    try:
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            try:
+                status = await asyncio.wait_for(http_get(reader, writer, PATHS[i % len(PATHS)], sid), timeout)
+            except asyncio.TimeoutError:
+                failures['timeout'] += 1
+                return served
+            except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+                # Reconnect once if the server closed an idle keep-alive connection
+                writer.close()
+                try:
+                    reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+                except (OSError, asyncio.TimeoutError):
+                    failures['connect'] += 1
+                    return served
+                continue
+            if status != 200:
+                failures['status'] += 1
+            else:
+                samples.append(time.perf_counter() - started)
+                served = True
+            i += 1
+    finally:
+        writer.close()
+    return served
+
+async def run_level(sids, port, connections, duration, timeout):
+    samples = []
+    failures = {'connect': 0, 'timeout': 0, 'status': 0}
+    stop_at = time.perf_counter() + duration
+    served = await asyncio.gather(*[
+        connection(sids[i % len(sids)], port, stop_at, timeout, samples, failures)
+        for i in range(connections)
+    ])
+    samples.sort()
+    pct = lambda p: samples[min(len(samples) - 1, int(len(samples) * p / 100))] * 1000 if samples else None
+    return {
+        'connections': connections,
+        'served_connections': sum(served),
+        'requests': len(samples),
+        'throughput': len(samples) / duration,
+        'p50_ms': pct(50),
+        'p99_ms': pct(99),
+        **failures,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Sync vs async concurrent-connection capacity')
+    parser.add_argument('--modes', default='sync,gthread,asgi', help=f'comma separated, from {",".join(MODES)}')
+    parser.add_argument('--connections', default='10,50,200,500', help='comma separated levels')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per level')
+    parser.add_argument('--timeout', type=float, default=5, help='per-request timeout in seconds')
+    parser.add_argument('--workers', type=int, default=2, help='server worker processes')
+    parser.add_argument('--threads', type=int, default=8, help='threads per gthread worker')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--transactions', type=int, default=50000)
+    parser.add_argument('--port', type=int, default=5097)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+    levels = [int(n) for n in args.connections.split(',')]
+
+    path, cleanup = synthetic.temp_database()
+    results = {}
+    try:
+        synthetic.make_bank(path, args.users, transactions=args.transactions)
+        sids = create_sessions(path, args.users)
+        for mode in args.modes.split(','):
+            missing = [m for m in MODES[mode][0] if importlib.util.find_spec(m) is None]
+            if missing:
+                print(f'{mode}: skipped, {", ".join(missing)} not installed')
+                continue
+            process = start_server(mode, args, path)
+            try:
+                results[mode] = [asyncio.run(run_level(sids, args.port, n, args.duration, args.timeout))
+                                 for n in levels]
+            finally:
+                stop_server(process)
+    finally:
+        cleanup()
+
+    print(f"{'mode':>8} {'conns':>6} {'served':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'timeout':>8} {'connect':>8} {'non-200':>8}")
+    for mode, rows in results.items():
+        for r in rows:
+            p50 = f"{r['p50_ms']:8.1f}" if r['p50_ms'] is not None else f"{'-':>8}"
+            p99 = f"{r['p99_ms']:8.1f}" if r['p99_ms'] is not None else f"{'-':>8}"
+            print(f"{mode:>8} {r['connections']:>6} {r['served_connections']:>7} {r['throughput']:>8.0f} "
+                  f"{p50} {p99} {r['timeout']:>8} {r['connect']:>8} {r['status']:>8}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'params': vars(args), 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# Benchmark: balance-history queries answered from daily snapshots
+# (snapshots.py) vs replaying the transactions backwards from the current
+# balance.
+#
+#   python -m benchmarks.balance_history --users 2000 --transactions 1000000
+#
+# Both run on copies of the same database; the snapshot job only runs on one
+# of them, so the other falls back to a full replay. Results are compared.
+import argparse
+import random
+import time
+from datetime import timedelta
+
+import database
+import services
+import snapshots
+from benchmarks import synthetic
+
+def query(path, account, start, end):
+    conn = database.connect(path, readonly=True)
+    try:
+        started = time.perf_counter()
+        result = services.balance_history(conn, account['user_id'], account['id'], start, end)
+        return result, time.perf_counter() - started
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Balance history from snapshots vs full replay")
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--transactions', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--days', type=int, default=30, help='days per query')
+    args = parser.parse_args()
+
+    path, cleanup = synthetic.temp_database()
+    try:
+        synthetic.make_bank(path, args.users, accounts_per_user=2, transactions=args.transactions)
+        replay_path = synthetic.copy_database(path, path + '.replay')
+        synthetic.use_database(path)
+        job = snapshots.run_snapshot_job()
+        print(f"snapshot job: {job['snapshots']} snapshots through {job['through_day']} in {job['elapsed']:.2f}s")
+
+        conn = database.connect(path)
+        accounts = conn.execute('SELECT id, user_id FROM accounts').fetchall()
+        conn.close()
+        rng = random.Random(7)
+        today = snapshots.utc_today()
+        timings = {'snapshots': [], 'replay': []}
+        mismatches = 0
+        for _ in range(args.queries):
+            account = rng.choice(accounts)
+            end = today - timedelta(days=rng.randint(0, 365))
+            start = (end - timedelta(days=args.days - 1)).isoformat()
+            fast, fast_elapsed = query(path, account, start, end.isoformat())
+            slow, slow_elapsed = query(replay_path, account, start, end.isoformat())
+            timings['snapshots'].append(fast_elapsed)
+            timings['replay'].append(slow_elapsed)
+            mismatches += fast != slow
+
+        print(f"{'path':>10} {'mean ms':>9} {'p99 ms':>9}")
+        for name, values in timings.items():
+            values.sort()
+            print(f"{name:>10} {1000 * sum(values) / len(values):>9.2f} "
+                  f"{1000 * values[int(len(values) * 0.99) - 1]:>9.2f}")
+        print(f"mismatches: {mismatches}")
+    finally:
+        cleanup()
+
+if __name__ == '__main__':
+    main()
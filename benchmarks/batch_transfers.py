@@ -0,0 +1,60 @@
+# Benchmark: N calls to POST /api/transfer vs one POST /api/transfers/batch.
+#
+#   python -m benchmarks.batch_transfers --transfers 1000 5000
+import argparse
+import random
+import time
+
+from benchmarks import synthetic
+
+def transfer_items(count, recipients, seed=1):
+    rng = random.Random(seed)
+    return [{
+        'amount': 1.0,
+        'transferType': 'external',
+        'fromAccountType': 'Checking',
+        'to_account': synthetic.account_number(rng.randrange(1, recipients)),
+    } for _ in range(count)]
+
+def login(client):
+    response = client.post('/login', json={'account_number': synthetic.account_number(0),
+                                           'password': synthetic.DEMO_PASSWORD})
+    assert response.status_code == 200, response.json
+
+def run(count, recipients):
+    path, cleanup = synthetic.temp_database()
+    try:
+        synthetic.make_bank(path, users=recipients, accounts_per_user=2)
+        import main  # imported after the database is pointed at the synthetic bank
+        client = main.app.test_client()
+        login(client)
+        items = transfer_items(count, recipients)
+
+        started = time.perf_counter()
+        for item in items:
+            assert client.post('/api/transfer', json=item).status_code == 200
+        single = time.perf_counter() - started
+
+        started = time.perf_counter()
+        response = client.post('/api/transfers/batch', json={'transfers': items})
+        batch = time.perf_counter() - started
+        assert response.status_code == 200 and response.json['applied'] == count, response.json
+
+        return {'transfers': count, 'single_seconds': single, 'batch_seconds': batch}
+    finally:
+        cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description='Single vs batch transfer throughput')
+    parser.add_argument('--transfers', type=int, nargs='+', default=[1000, 5000])
+    parser.add_argument('--recipients', type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'transfers':>10} {'single/s':>10} {'batch/s':>10} {'speedup':>9}")
+    for count in args.transfers:
+        r = run(count, args.recipients)
+        print(f"{r['transfers']:>10} {count / r['single_seconds']:>10.0f} {count / r['batch_seconds']:>10.0f} "
+              f"{r['single_seconds'] / r['batch_seconds']:>8.1f}x")
+
+if __name__ == '__main__':
+    main()
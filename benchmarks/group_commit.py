@@ -0,0 +1,162 @@
+# Benchmark: ledger writes per second with per-request commits vs group commit.
+# Request threads in one process run a mix of deposits, withdrawals and
+# transfers through ledger.py, first with every operation committing on its
+# own and then with the group-commit writer thread. Balances are checked
+# against the transactions table after each run (see transfer_contention).
+# The gap is largest with synchronous=FULL, where every commit is an fsync;
+# with the default NORMAL in WAL mode commits only fsync at checkpoints.
+# Run it with TMPDIR on the disk the database will use; on tmpfs fsync is free.
+# Before the runs it checks that a caller whose operation the writer never
+# picked up gets DatabaseBusy and that the operation is dropped, not applied.
+#
+#   python -m benchmarks.group_commit --threads 1 8 32 --synchronous FULL
+#   python -m benchmarks.group_commit --threads 32 --delay-ms 1 5 --max-batch 128
+import argparse
+import logging
+import random
+import threading
+import time
+
+import database
+import ledger
+from benchmarks import synthetic
+from benchmarks.transfer_contention import verify
+
+def worker(seed, stop_at, account_ids, minimums, counts, lock):
+    rng = random.Random(seed)
+    conn = database.connect()
+    done = rejected = 0
+    try:
+        while time.perf_counter() < stop_at:
+            kind = rng.random()
+            try:
+                if kind < 0.3:
+                    ledger.deposit(conn, rng.choice(account_ids), float(rng.randint(1, 200)), 'Benchmark deposit')
+                elif kind < 0.5:
+                    account = rng.choice(account_ids)
+                    ledger.withdraw(conn, account, float(rng.randint(1, 100)), minimums[account], 'Benchmark withdrawal')
+                else:
+                    source, target = rng.sample(account_ids, 2)
+                    ledger.transfer(conn, source, target, float(rng.randint(1, 300)), minimums[source], 'Benchmark transfer')
+                done += 1
+            except ledger.InsufficientFunds:
+                rejected += 1
+    finally:
+        conn.close()
+    with lock:
+        counts[0] += done
+        counts[1] += rejected
+
+def run(mode, threads, duration, accounts, delay, max_batch):
+    path, cleanup = synthetic.temp_database()
+    try:
+        synthetic.make_bank(path, users=max(accounts // 2, 1), accounts_per_user=2)
+        conn = database.connect()
+        rows = conn.execute('''
+            SELECT a.id, a.balance, at.minimum_balance
+            FROM accounts a JOIN account_types at ON a.account_type_id = at.id
+        ''').fetchall()
+        conn.close()
+        initial = {r['id']: r['balance'] for r in rows}
+        minimums = {r['id']: r['minimum_balance'] for r in rows}
+
+        ledger.GROUP_COMMIT = mode == 'group'
+        committer = None
+        if ledger.GROUP_COMMIT:
+            committer = ledger._committers[0] = ledger.GroupCommitter(delay, max_batch)
+
+        counts = [0, 0]
+        lock = threading.Lock()
+        stop_at = time.perf_counter() + duration
+        workers = [threading.Thread(target=worker, args=(seed, stop_at, list(initial), minimums, counts, lock))
+                   for seed in range(threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+
+        return {
+            'mode': mode,
+            'threads': threads,
+            'operations': counts[0],
+            'rejected': counts[1],
+            'per_second': (counts[0] + counts[1]) / duration,
+            'batch_size_avg': committer.stats()['batch_size_avg'] if committer else 1.0,
+            'errors': verify(path, initial),
+        }
+    finally:
+        ledger.GROUP_COMMIT = False
+        ledger._committers.clear()
+        cleanup()
+
+def _stall(conn, seconds):
+    time.sleep(seconds)
+
+def check_timeout():
+    """Force a group-commit timeout; returns a list of errors"""
+    path, cleanup = synthetic.temp_database()
+    saved = ledger.GROUP_COMMIT, ledger.GROUP_COMMIT_TIMEOUT
+    try:
+        synthetic.make_bank(path, users=1, accounts_per_user=1)
+        conn = database.connect()
+        account_id, before = conn.execute('SELECT id, balance FROM accounts').fetchone()
+        ledger.GROUP_COMMIT = True
+        ledger.GROUP_COMMIT_TIMEOUT = 0.2
+        committer = ledger._committers[0] = ledger.GroupCommitter()
+        # Keep the writer busy with one operation while a deposit queues behind it
+        staller = threading.Thread(target=committer.submit, args=(_stall, 1.0))
+        staller.start()
+        time.sleep(0.05)
+        errors = []
+        try:
+            ledger.deposit(conn, account_id, 100.0, 'Timed out deposit')
+            errors.append('deposit behind a stalled writer did not time out')
+        except ledger.DatabaseBusy:
+            pass
+        staller.join()
+        # The writer is free again; a later deposit must not carry the cancelled one along
+        ledger.deposit(conn, account_id, 1.0, 'Deposit after timeout')
+        after = conn.execute('SELECT balance FROM accounts WHERE id = ?', (account_id,)).fetchone()[0]
+        if after != before + 1.0:
+            errors.append(f'balance {after}, expected {before + 1.0}: the cancelled deposit was applied')
+        conn.close()
+        return errors
+    finally:
+        ledger.GROUP_COMMIT, ledger.GROUP_COMMIT_TIMEOUT = saved
+        ledger._committers.clear()
+        cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-request commit vs group commit')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--duration', type=float, default=5, help='seconds per run')
+    parser.add_argument('--accounts', type=int, default=200)
+    parser.add_argument('--synchronous', default='FULL', help='SQLite synchronous setting for the runs')
+    parser.add_argument('--delay-ms', type=float, nargs='+', default=[ledger.GROUP_COMMIT_DELAY * 1000])
+    parser.add_argument('--max-batch', type=int, default=ledger.GROUP_COMMIT_MAX_BATCH)
+    args = parser.parse_args()
+
+    # Lock waits in per-request mode would flood the slow query log
+    logging.getLogger('securebank.sql').setLevel(logging.ERROR)
+    database.CONNECTION_PRAGMAS = [(name, args.synchronous if name == 'synchronous' else value)
+                                   for name, value in database.CONNECTION_PRAGMAS]
+
+    errors = check_timeout()
+    print(f"timeout check: {'OK' if not errors else 'FAILED: ' + '; '.join(errors)}")
+    failed = bool(errors)
+
+    print(f"synchronous={args.synchronous}")
+    print(f"{'mode':>14} {'threads':>8} {'ops':>8} {'rejected':>9} {'ops/s':>9} {'batch':>6}  result")
+    for threads in args.threads:
+        runs = [('per-request', None)] + [('group', delay) for delay in args.delay_ms]
+        for mode, delay in runs:
+            r = run(mode, threads, args.duration, args.accounts, (delay or 0) / 1000, args.max_batch)
+            label = f'group {delay:g}ms' if delay is not None else mode
+            status = 'OK' if not r['errors'] else f"FAILED: {'; '.join(r['errors'][:3])}"
+            failed = failed or bool(r['errors'])
+            print(f"{label:>14} {threads:>8} {r['operations']:>8} {r['rejected']:>9} {r['per_second']:>9.0f} "
+                  f"{r['batch_size_avg']:>6.1f}  {status}")
+    raise SystemExit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# Benchmark: per-account interest.calculate_interest vs the bulk
+# interest.accrue_all_interest engine.
+#
+#   python -m benchmarks.interest_accrual --sizes 10000 100000 1000000
+#
+# The per-account path commits once per account, so on large sizes it is run
+# on a sample (--per-account-limit) and extrapolated. Both paths run on
+# copies of the same database and the resulting balances are compared.
+import argparse
+import time
+
+import database
+import interest
+from benchmarks import synthetic
+
+def balances(path):
+    synthetic.use_database(path)
+    conn = database.get_db_connection()
+    try:
+        return dict(conn.execute('SELECT id, balance FROM accounts').fetchall())
+    finally:
+        conn.close()
+
+def run(size, per_account_limit):
+    path, cleanup = synthetic.temp_database()
+    try:
+        users = max(size // 2, 1)
+        accounts = synthetic.make_bank(path, users, accounts_per_user=2)
+        bulk_path = synthetic.copy_database(path, path + '.bulk')
+
+        # Per-account path (possibly sampled)
+        synthetic.use_database(path)
+        conn = database.get_db_connection()
+        ids = [row[0] for row in conn.execute('SELECT id FROM accounts ORDER BY id LIMIT ?', (per_account_limit,))]
+        conn.close()
+        started = time.perf_counter()
+        for account_id in ids:
+            interest.calculate_interest(account_id)
+        per_account_elapsed = time.perf_counter() - started
+        per_account_total = per_account_elapsed * accounts / len(ids)
+
+        # Bulk path on an identical copy
+        synthetic.use_database(bulk_path)
+        summary = interest.accrue_all_interest()
+
+        # The sampled accounts must have identical balances in both databases
+        expected = balances(path)
+        actual = balances(bulk_path)
+        mismatches = [i for i in ids if abs(expected[i] - actual[i]) > 1e-9]
+
+        return {
+            'accounts': accounts,
+            'per_account_sampled': len(ids),
+            'per_account_seconds': per_account_total,
+            'bulk_seconds': summary['elapsed'],
+            'bulk_accounts_credited': summary['accounts'],
+            'bulk_total_credited': summary['total_credited'],
+            'speedup': per_account_total / summary['elapsed'] if summary['elapsed'] else float('inf'),
+            'mismatches': len(mismatches),
+        }
+    finally:
+        cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-account vs bulk interest accrual")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--per-account-limit', type=int, default=20000,
+                        help='max accounts to run through calculate_interest (rest is extrapolated)')
+    args = parser.parse_args()
+
+    print(f"{'accounts':>10} {'per-account s':>14} {'bulk s':>10} {'speedup':>9} {'mismatches':>10}")
+    for size in args.sizes:
+        r = run(size, args.per_account_limit)
+        sampled = '' if r['per_account_sampled'] == r['accounts'] else f" (extrapolated from {r['per_account_sampled']})"
+        print(f"{r['accounts']:>10} {r['per_account_seconds']:>14.2f} {r['bulk_seconds']:>10.2f} "
+              f"{r['speedup']:>8.1f}x {r['mismatches']:>10}{sampled}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# Benchmark: the NumPy projection engine (projection.py) vs a pure-Python
+# loop that compounds every account period by period.
+#
+#   python -m benchmarks.interest_projection --sizes 10000 100000 1000000 --years 30
+#
+# The Python loop is run on a sample (--python-limit) and extrapolated. The
+# sampled accounts' projected balances are compared between the two.
+import argparse
+import os
+import time
+
+import database
+import projection
+from benchmarks import synthetic
+
+def project_python(balances, rates, years, compounding, rate_schedule):
+    """The straightforward version: every account, every year, every period"""
+    periods = projection.COMPOUNDING_PERIODS[compounding]
+    results = []
+    for balance, rate in zip(balances, rates):
+        row = []
+        for year in range(years):
+            year_rate = rate
+            if rate_schedule and rate > 0:
+                year_rate = max(rate + rate_schedule[min(year, len(rate_schedule) - 1)], 0.0)
+            for _ in range(periods):
+                balance += balance * year_rate / 100 / periods
+            row.append(balance)
+        results.append(row)
+    return results
+
+def run(size, years, compounding, rate_schedule, python_limit):
+    path, cleanup = synthetic.temp_database()
+    try:
+        accounts = synthetic.make_bank(path, max(size // 2, 1), accounts_per_user=2)
+        conn = database.connect()
+        rows = conn.execute('''
+            SELECT a.balance, at.interest_rate FROM accounts a
+            JOIN account_types at ON a.account_type_id = at.id
+            ORDER BY a.id LIMIT ?
+        ''', (python_limit,)).fetchall()
+        conn.close()
+        balances = [row['balance'] for row in rows]
+        rates = [row['interest_rate'] for row in rows]
+
+        started = time.perf_counter()
+        expected = project_python(balances, rates, years, compounding, rate_schedule)
+        python_elapsed = time.perf_counter() - started
+        python_total = python_elapsed * accounts / len(rows)
+
+        summary = projection.project_all(os.path.join(os.path.dirname(path), 'projection'), years,
+                                         compounding, rate_schedule, output_format='columns')
+        actual = projection.project(balances, rates, years, compounding, rate_schedule)
+        mismatches = sum(1 for want, got in zip(expected, actual.tolist())
+                         if any(abs(w - g) > 1e-6 * max(abs(w), 1.0) for w, g in zip(want, got)))
+
+        return {
+            'accounts': accounts,
+            'python_sampled': len(rows),
+            'python_seconds': python_total,
+            'numpy_seconds': summary['elapsed'],
+            'speedup': python_total / summary['elapsed'] if summary['elapsed'] else float('inf'),
+            'mismatches': mismatches,
+        }
+    finally:
+        cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description="NumPy vs pure-Python interest projection")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--years', type=int, default=30)
+    parser.add_argument('--compounding', choices=list(projection.COMPOUNDING_PERIODS), default='daily')
+    parser.add_argument('--rate-schedule', type=float, nargs='+')
+    parser.add_argument('--python-limit', type=int, default=2000,
+                        help='max accounts to run through the Python loop (rest is extrapolated)')
+    args = parser.parse_args()
+
+    print(f"{'accounts':>10} {'python s':>10} {'numpy s':>10} {'speedup':>9} {'mismatches':>10}")
+    for size in args.sizes:
+        r = run(size, args.years, args.compounding, args.rate_schedule, args.python_limit)
+        sampled = '' if r['python_sampled'] == r['accounts'] else f" (extrapolated from {r['python_sampled']})"
+        print(f"{r['accounts']:>10} {r['python_seconds']:>10.2f} {r['numpy_seconds']:>10.2f} "
+              f"{r['speedup']:>8.1f}x {r['mismatches']:>10}{sampled}")
+
+if __name__ == '__main__':
+    main()
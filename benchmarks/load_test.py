@@ -0,0 +1,250 @@
+# Load test: replay a realistic API mix against SecureBank.
+# Generates a synthetic bank, then virtual users replay a weighted mix of
+# login, /api/account-info, /api/transactions, deposit, withdraw and transfer
+# either in-process (Flask test client) or over HTTP against a locally
+# started gunicorn. Reports throughput and p50/p95/p99 per endpoint and
+# writes the results as JSON so runs can be compared.
+#
+#   python -m benchmarks.load_test --users 1000 --transactions 100000 --output run.json
+#   python -m benchmarks.load_test --target gunicorn --gunicorn-workers 4 --compare run.json
+#   python -m benchmarks.load_test --record workload.jsonl      # save the generated workload
+#   python -m benchmarks.load_test --workload workload.jsonl    # replay a saved one
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+from benchmarks import synthetic
+
+# Endpoint name -> relative weight in the generated mix
+DEFAULT_MIX = {
+    'login': 5,
+    'account-info': 30,
+    'transactions': 30,
+    'deposit': 10,
+    'withdraw': 10,
+    'transfer': 15,
+}
+
+def make_request(endpoint, user, users, rng):
+    """(endpoint, method, path, json body) for one generated call"""
+    if endpoint == 'login':
+        return endpoint, 'POST', '/login', {'account_number': synthetic.account_number(user),
+                                            'password': synthetic.DEMO_PASSWORD}
+    if endpoint == 'account-info':
+        return endpoint, 'GET', '/api/account-info', None
+    if endpoint == 'transactions':
+        return endpoint, 'GET', '/api/transactions', None
+    if endpoint == 'deposit':
+        return endpoint, 'POST', '/api/deposit', {'amount': rng.randint(1, 200)}
+    if endpoint == 'withdraw':
+        return endpoint, 'POST', '/api/withdraw', {'amount': rng.randint(1, 100)}
+    recipient = rng.randrange(users)
+    if recipient == user:
+        recipient = (recipient + 1) % users
+    return endpoint, 'POST', '/api/transfer', {'amount': rng.randint(1, 100), 'transferType': 'external',
+                                               'fromAccountType': 'Checking',
+                                               'to_account': synthetic.account_number(recipient)}
+
+def generate_workload(clients, requests_per_client, users, mix, seed):
+    """One list of calls per virtual user; every list starts with a login"""
+    rng = random.Random(seed)
+    names, weights = zip(*mix.items())
+    workload = []
+    for client in range(clients):
+        user = rng.randrange(users)
+        calls = [make_request('login', user, users, rng)]
+        calls += [make_request(rng.choices(names, weights)[0], user, users, rng)
+                  for _ in range(requests_per_client - 1)]
+        workload.append(calls)
+    return workload
+
+def save_workload(path, workload):
+    with open(path, 'w') as f:
+        for client, calls in enumerate(workload):
+            for endpoint, method, url, body in calls:
+                f.write(json.dumps({'client': client, 'endpoint': endpoint, 'method': method,
+                                    'path': url, 'json': body}) + '\n')
+
+def load_workload(path):
+    workload = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                call = json.loads(line)
+                workload.setdefault(call['client'], []).append(
+                    (call['endpoint'], call['method'], call['path'], call.get('json')))
+    return [workload[client] for client in sorted(workload)]
+
+class InProcessClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def call(self, method, path, body):
+        return self.client.open(path, method=method, json=body).status_code
+
+class HttpClient:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def call(self, method, path, body):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                         headers={'Content-Type': 'application/json'} if data else {})
+        try:
+            with self.opener.open(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+def replay(make_client, workload):
+    """Run every virtual user in its own thread; returns per-endpoint samples and wall time"""
+    samples = {}
+    lock = threading.Lock()
+
+    def run_client(calls):
+        client = make_client()
+        local = []
+        for endpoint, method, path, body in calls:
+            started = time.perf_counter()
+            status = client.call(method, path, body)
+            local.append((endpoint, time.perf_counter() - started, status))
+        with lock:
+            for endpoint, elapsed, status in local:
+                samples.setdefault(endpoint, []).append((elapsed, status))
+
+    threads = [threading.Thread(target=run_client, args=(calls,)) for calls in workload]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples, time.perf_counter() - started
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else None
+
+def summarize(samples, wall):
+    endpoints = {}
+    for endpoint, results in sorted(samples.items()):
+        latencies = [elapsed for elapsed, _ in results]
+        endpoints[endpoint] = {
+            'requests': len(results),
+            'errors': sum(1 for _, status in results if status >= 500),
+            'rejected': sum(1 for _, status in results if 400 <= status < 500),
+            'throughput': len(results) / wall,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+        }
+    total = sum(e['requests'] for e in endpoints.values())
+    return {'wall_seconds': wall, 'requests': total, 'throughput': total / wall, 'endpoints': endpoints}
+
+def start_gunicorn(path, port, workers, threads):
+    env = dict(os.environ, SECUREBANK_DATABASE=path)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--worker-class', 'gthread',
+         '--threads', str(threads), '--bind', f'127.0.0.1:{port}', 'main:app'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/login').read()
+            return process
+        except (urllib.error.URLError, ConnectionError):
+            if process.poll() is not None:
+                raise RuntimeError('gunicorn exited during startup (is it installed?)')
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start within 30 seconds')
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_report(result, baseline=None):
+    print(f"{'endpoint':>14} {'requests':>9} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'5xx':>5}"
+          + ('   p99 vs baseline' if baseline else ''))
+    for endpoint, e in result['endpoints'].items():
+        line = (f"{endpoint:>14} {e['requests']:>9} {e['throughput']:>9.0f} {e['p50_ms']:>8.2f} "
+                f"{e['p95_ms']:>8.2f} {e['p99_ms']:>8.2f} {e['errors']:>5}")
+        previous = (baseline or {}).get('endpoints', {}).get(endpoint)
+        if previous:
+            line += f"   {(e['p99_ms'] / previous['p99_ms'] - 1) * 100:+7.1f}%"
+        print(line)
+    print(f"{'total':>14} {result['requests']:>9} {result['throughput']:>9.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='SecureBank workload replay')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--accounts-per-user', type=int, default=2)
+    parser.add_argument('--transactions', type=int, default=50000)
+    parser.add_argument('--clients', type=int, default=16, help='concurrent virtual users')
+    parser.add_argument('--requests', type=int, default=200, help='requests per virtual user')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--target', choices=['inprocess', 'gunicorn'], default='inprocess')
+    parser.add_argument('--gunicorn-workers', type=int, default=4)
+    parser.add_argument('--gunicorn-threads', type=int, default=8)
+    parser.add_argument('--port', type=int, default=5098)
+    parser.add_argument('--workload', help='replay calls from a JSONL workload file')
+    parser.add_argument('--record', help='write the generated workload to a JSONL file')
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--compare', help='baseline results JSON to compare p99 against')
+    args = parser.parse_args()
+
+    workload = (load_workload(args.workload) if args.workload else
+                generate_workload(args.clients, args.requests, args.users, DEFAULT_MIX, args.seed))
+    if args.record:
+        save_workload(args.record, workload)
+
+    path, cleanup = synthetic.temp_database()
+    process = None
+    try:
+        synthetic.make_bank(path, args.users, args.accounts_per_user, args.transactions, seed=args.seed)
+        if args.target == 'gunicorn':
+            process = start_gunicorn(path, args.port, args.gunicorn_workers, args.gunicorn_threads)
+            base_url = f'http://127.0.0.1:{args.port}'
+            samples, wall = replay(lambda: HttpClient(base_url), workload)
+        else:
+            import main as securebank
+            samples, wall = replay(lambda: InProcessClient(securebank.app), workload)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        cleanup()
+
+    result = summarize(samples, wall)
+    result['meta'] = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'target': args.target,
+        'params': {k: v for k, v in vars(args).items() if k not in ('output', 'compare', 'record')},
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == '__main__':
+    main()
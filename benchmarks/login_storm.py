@@ -0,0 +1,120 @@
+# Benchmark: a burst of logins and its effect on other endpoints.
+# Runs main.app on a threaded local server, fires concurrent logins for a few
+# seconds while a probe keeps calling /api/account-info, and reports login and
+# probe latency percentiles. Compare inline hashing with the verifier pool:
+#
+#   python -m benchmarks.login_storm --verify-workers 0 2 --clients 16
+import argparse
+import http.cookiejar
+import json
+import logging
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from benchmarks import synthetic
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def post_json(opener, url, payload):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with opener.open(request) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def login_client(base, user, stop, latencies, statuses):
+    opener = urllib.request.build_opener()
+    payload = {'account_number': synthetic.account_number(user), 'password': synthetic.DEMO_PASSWORD}
+    while not stop.is_set():
+        started = time.perf_counter()
+        status = post_json(opener, base + '/login', payload)
+        latencies.append(time.perf_counter() - started)
+        statuses.append(status)
+
+def probe(base, stop, latencies):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    post_json(opener, base + '/login', {'account_number': synthetic.account_number(0),
+                                        'password': synthetic.DEMO_PASSWORD})
+    while not stop.is_set():
+        started = time.perf_counter()
+        with opener.open(base + '/api/account-info') as response:
+            response.read()
+        latencies.append(time.perf_counter() - started)
+        time.sleep(0.01)
+
+def run(app, verify_workers, clients, seconds, port):
+    import passwords
+    from werkzeug.serving import make_server
+
+    passwords.VERIFY_WORKERS = verify_workers
+    passwords._verifier = None
+    passwords.get_verifier()
+
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{port}'
+
+    stop = threading.Event()
+    probe_latencies, login_latencies, statuses = [], [], []
+    probe_thread = threading.Thread(target=probe, args=(base, stop, probe_latencies))
+    probe_thread.start()
+    time.sleep(0.5)
+    baseline = list(probe_latencies)
+
+    threads = [threading.Thread(target=login_client, args=(base, i % 50, stop, login_latencies, statuses))
+               for i in range(clients)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads + [probe_thread]:
+        t.join()
+    server.shutdown()
+
+    storm = probe_latencies[len(baseline):]
+    return {
+        'verify_workers': verify_workers,
+        'logins': statuses.count(200),
+        'rejected_503': statuses.count(503),
+        'login_p50': percentile(login_latencies, 50),
+        'login_p99': percentile(login_latencies, 99),
+        'probe_idle_p50': statistics.median(baseline) if baseline else float('nan'),
+        'probe_storm_p50': percentile(storm, 50),
+        'probe_storm_p99': percentile(storm, 99),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Login storm benchmark')
+    parser.add_argument('--verify-workers', type=int, nargs='+', default=[0, 2])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--port', type=int, default=5099)
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    path, cleanup = synthetic.temp_database()
+    try:
+        synthetic.make_bank(path, users=50, accounts_per_user=2)
+        import main as securebank
+        print(f"{'verify workers':>14} {'logins':>7} {'503s':>5} {'login p50':>10} {'login p99':>10} "
+              f"{'probe idle':>11} {'probe p50':>10} {'probe p99':>10}")
+        for i, workers in enumerate(args.verify_workers):
+            r = run(securebank.app, workers, args.clients, args.seconds, args.port + i)
+            print(f"{r['verify_workers']:>14} {r['logins']:>7} {r['rejected_503']:>5} "
+                  f"{r['login_p50'] * 1000:>8.1f}ms {r['login_p99'] * 1000:>8.1f}ms "
+                  f"{r['probe_idle_p50'] * 1000:>9.1f}ms {r['probe_storm_p50'] * 1000:>8.1f}ms "
+                  f"{r['probe_storm_p99'] * 1000:>8.1f}ms")
+    finally:
+        cleanup()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# Benchmark: resolving a recipient account number (recipients.py) as the
+# users table grows, uncached (index seeks) and through the per-worker LRU.
+#
+#   python -m benchmarks.recipient_lookup --sizes 10000 100000 1000000
+#
+# Each size gets its own synthetic bank; lookups pick random existing
+# account numbers, so the warm run mostly hits the cache.
+import argparse
+import random
+import time
+
+import database
+from benchmarks import synthetic
+from recipients import RecipientDirectory
+
+def time_lookups(conn, directory, numbers, cached):
+    timings = []
+    for number in numbers:
+        if not cached:
+            directory.invalidate()
+        started = time.perf_counter()
+        directory.resolve(conn, [number])
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return 1e6 * sum(timings) / len(timings), 1e6 * timings[int(len(timings) * 0.99) - 1]
+
+def main():
+    parser = argparse.ArgumentParser(description="Recipient lookup latency by users table size")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--lookups', type=int, default=5000)
+    parser.add_argument('--payees', type=int, default=1000, help='distinct recipients looked up')
+    args = parser.parse_args()
+
+    print(f"{'users':>9} {'cold mean us':>13} {'cold p99 us':>12} {'warm mean us':>13} {'warm p99 us':>12}")
+    for size in args.sizes:
+        path, cleanup = synthetic.temp_database()
+        try:
+            synthetic.make_bank(path, size, accounts_per_user=2)
+            rng = random.Random(size)
+            payees = [synthetic.account_number(rng.randrange(size)) for _ in range(args.payees)]
+            numbers = [rng.choice(payees) for _ in range(args.lookups)]
+            conn = database.get_db_connection()
+            try:
+                directory = RecipientDirectory()
+                cold = time_lookups(conn, directory, numbers, cached=False)
+                warm = time_lookups(conn, directory, numbers, cached=True)
+            finally:
+                conn.close()
+            print(f"{size:>9} {cold[0]:>13.1f} {cold[1]:>12.1f} {warm[0]:>13.1f} {warm[1]:>12.1f}")
+        finally:
+            cleanup()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# Benchmark: per-request cost of the server-side session lookup.
+# Measures open_session + save_session for cached sessions (LRU hit) and
+# uncached ones (SQLite read) and fails if p99 goes over the budget.
+#
+#   python -m benchmarks.session_overhead --sessions 10000 --budget-ms 0.5
+import argparse
+import time
+
+from benchmarks import synthetic
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def measure(app, interface, sids, clear_cache):
+    from flask import Response, request
+    timings = []
+    cookie = app.config['SESSION_COOKIE_NAME']
+    for sid in sids:
+        if clear_cache:
+            interface.store._entries.clear()
+        with app.test_request_context('/api/account-info', headers={'Cookie': f'{cookie}={sid}'}):
+            started = time.perf_counter()
+            session = interface.open_session(app, request)
+            interface.save_session(app, session, Response())
+            timings.append(time.perf_counter() - started)
+            assert session.get('user_id') is not None
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description='Session lookup overhead')
+    parser.add_argument('--sessions', type=int, default=10000)
+    parser.add_argument('--budget-ms', type=float, default=0.5)
+    args = parser.parse_args()
+
+    path, cleanup = synthetic.temp_database()
+    try:
+        synthetic.make_bank(path, users=10, accounts_per_user=1)
+        import main as securebank
+        app = securebank.app
+        interface = app.session_interface
+        expires_at = time.time() + 3600
+        sids = [f'bench-session-{i}' for i in range(args.sessions)]
+        with app.app_context():
+            for sid in sids:
+                interface.store.backend.save(sid, {'user_id': 1, 'account_number': 'ACC001'}, expires_at)
+
+        hot = sids[:interface.store.size]
+        measure(app, interface, hot, clear_cache=False)  # warm the LRU
+        results = {
+            'cache hit': measure(app, interface, hot, clear_cache=False),
+            'cache miss': measure(app, interface, sids, clear_cache=True),
+        }
+
+        failed = False
+        print(f"{'path':>12} {'p50 ms':>8} {'p99 ms':>8}  budget {args.budget_ms}ms")
+        for name, timings in results.items():
+            p50, p99 = percentile(timings, 50) * 1000, percentile(timings, 99) * 1000
+            over = p99 > args.budget_ms
+            failed = failed or over
+            print(f"{name:>12} {p50:>8.3f} {p99:>8.3f}  {'OVER BUDGET' if over else 'ok'}")
+        raise SystemExit(1 if failed else 0)
+    finally:
+        cleanup()
+
+if __name__ == '__main__':
+    main()
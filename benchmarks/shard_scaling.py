@@ -0,0 +1,150 @@
+# Benchmark: write throughput with the database split into 1, 2, 4, ... shards
+# (SECUREBANK_SHARDS). Worker processes run transfers through services.py
+# for a fixed time: internal transfers between a user's own accounts, which
+# stay on one shard, and a share of external transfers to random users,
+# which cross shards through the outbox. Afterwards the outbox relay drains
+# what is left and the total money across all shards is checked.
+# With one shard every commit waits for the same write lock; with N shards
+# up to N commits run at once, so throughput grows with the shard count
+# until the cores (or the disk's fsyncs) run out. Run it on a multi-core box
+# with TMPDIR on the disk the database will use; on tmpfs fsync is free.
+# On a single core it cannot scale: a transfer costs the same with any number
+# of shards, and the extra shards only add context switches and the outbox.
+#
+#   python -m benchmarks.shard_scaling --shards 1 2 4 8 --workers 16 --seconds 10
+import argparse
+import logging
+import multiprocessing
+import random
+import time
+
+import database
+import outbox
+import services
+from benchmarks import synthetic
+
+BALANCE = 1000000.0
+
+def configure(path, shards, synchronous):
+    database.DATABASE = path
+    database.SHARDS = shards
+    database.CONNECTION_PRAGMAS = [(name, synchronous if name == 'synchronous' else value)
+                                   for name, value in database.CONNECTION_PRAGMAS]
+
+def make_bank(users):
+    """Users with a Checking and a Savings account each, placed on their shards"""
+    conn = database.get_db_connection()
+    types = {row['type_name']: row['id'] for row in conn.execute('SELECT id, type_name FROM account_types')}
+    conn.close()
+    by_shard = {}
+    for i in range(users):
+        number = synthetic.account_number(i)
+        by_shard.setdefault(database.place_user(number), []).append(number)
+    created = []
+    for shard, numbers in by_shard.items():
+        conn = database.get_db_connection(shard)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for number in numbers:
+                user_id = database.create_user(conn, number, f'User {number}', f'{number}@example.com', 'x',
+                                               [(types['Checking'], BALANCE), (types['Savings'], BALANCE)])
+                created.append((user_id, number))
+            conn.commit()
+        finally:
+            conn.close()
+    return created
+
+def total_money():
+    total = 0.0
+    for shard in database.shard_ids():
+        conn = database.get_db_connection(shard)
+        try:
+            total += conn.execute('SELECT COALESCE(SUM(balance), 0) FROM accounts').fetchone()[0]
+        finally:
+            conn.close()
+    return total
+
+def worker(path, shards, synchronous, seed, stop_at, users, cross_shard, results):
+    configure(path, shards, synchronous)
+    rng = random.Random(seed)
+    done = failed = 0
+    while time.perf_counter() < stop_at:
+        user_id, number = rng.choice(users)
+        if rng.random() < cross_shard:
+            data = {'amount': 1.0, 'transferType': 'external', 'fromAccountType': 'Checking',
+                    'to_account': rng.choice(users)[1]}
+        else:
+            data = {'amount': 1.0, 'transferType': 'internal', 'fromAccountType': 'Checking',
+                    'toAccountType': 'Savings'}
+        conn = database.get_db_connection(database.shard_for_user(user_id))
+        try:
+            services.transfer(conn, user_id, number, data)
+            done += 1
+        except services.ServiceError:
+            failed += 1
+        finally:
+            conn.close()
+    results.put((done, failed))
+
+def run(shards, workers, seconds, users, cross_shard, synchronous):
+    path, cleanup = synthetic.temp_database()
+    try:
+        configure(path, shards, synchronous)
+        database.init_db()
+        bank = make_bank(users)
+        before = total_money()
+
+        results = multiprocessing.Queue()
+        stop_at = time.perf_counter() + seconds
+        processes = [
+            multiprocessing.Process(target=worker, args=(path, shards, synchronous, seed, stop_at, bank,
+                                                         cross_shard, results))
+            for seed in range(workers)
+        ]
+        started = time.perf_counter()
+        for p in processes:
+            p.start()
+        totals = [results.get() for _ in processes]
+        for p in processes:
+            p.join()
+        elapsed = time.perf_counter() - started
+
+        outbox.run_relay(once=True)
+        pending = sum(outbox.pending(shard) for shard in database.shard_ids())
+        done = sum(t[0] for t in totals)
+        return {
+            'transfers': done,
+            'failed': sum(t[1] for t in totals),
+            'per_second': done / elapsed,
+            'ok': abs(total_money() - before) < 1e-6 and pending == 0,
+        }
+    finally:
+        cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description='Transfer throughput by shard count')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--workers', type=int, default=max(4, 2 * (multiprocessing.cpu_count() or 1)))
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--cross-shard', type=float, default=0.1, help='share of external transfers')
+    parser.add_argument('--synchronous', default='FULL', help='SQLite synchronous setting for the runs')
+    args = parser.parse_args()
+    # Waiting for the write lock is what this measures; keep the slow query log quiet
+    logging.getLogger('securebank.sql').setLevel(logging.ERROR)
+
+    print(f"{args.workers} worker processes on {multiprocessing.cpu_count()} cores, "
+          f"{args.cross_shard:.0%} external transfers, synchronous={args.synchronous}")
+    print(f"{'shards':>7} {'transfers':>10} {'failed':>7} {'per sec':>9} {'speedup':>8}  result")
+    baseline = None
+    failed = False
+    for shards in args.shards:
+        r = run(shards, args.workers, args.seconds, args.users, args.cross_shard, args.synchronous)
+        baseline = baseline or r['per_second']
+        failed = failed or not r['ok']
+        print(f"{shards:>7} {r['transfers']:>10} {r['failed']:>7} {r['per_second']:>9.0f} "
+              f"{r['per_second'] / baseline:>7.2f}x  {'OK' if r['ok'] else 'FAILED: money or outbox mismatch'}")
+    raise SystemExit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# Benchmark: monthly statement batch job (statements.py) at several worker
+# counts, against building the same data with one account-info call and a
+# paged transaction history per user, as a client of the API would.
+#
+#   python -m benchmarks.statement_generation --users 20000 --workers 1 2 4
+#
+# The per-user path only fetches the data (no rendering, no files) and is run
+# on a sample (--per-user-limit) and extrapolated. Creating one file per
+# statement is a large part of the batch job's time on slow filesystems.
+import argparse
+import os
+import time
+from datetime import datetime
+
+import database
+import services
+import statements
+from benchmarks import synthetic
+
+def per_user(users, limit):
+    """Seconds to fetch every sampled user's accounts and full history"""
+    conn = database.get_db_connection()
+    try:
+        user_ids = [row[0] for row in conn.execute('SELECT id FROM users ORDER BY id LIMIT ?', (limit,))]
+        started = time.perf_counter()
+        for user_id in user_ids:
+            services.account_info(conn, user_id)
+            page, cursor = services.transactions_page(conn, user_id, services.TRANSACTIONS_MAX_PAGE_SIZE)
+            while cursor:
+                page, cursor = services.transactions_page(conn, user_id, services.TRANSACTIONS_MAX_PAGE_SIZE, cursor)
+        return (time.perf_counter() - started) * users / len(user_ids)
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Statement batch job throughput")
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--transactions', type=int, default=400000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--format', choices=list(statements.STATEMENT_FORMATS), default='html')
+    parser.add_argument('--per-user-limit', type=int, default=500)
+    args = parser.parse_args()
+
+    path, cleanup = synthetic.temp_database()
+    try:
+        synthetic.make_bank(path, args.users, accounts_per_user=2, transactions=args.transactions)
+        period = datetime.now().strftime('%Y-%m')
+        baseline = per_user(args.users, args.per_user_limit)
+        print(f"per-user API calls: {baseline:.2f}s for {args.users} users "
+              f"(extrapolated from {min(args.users, args.per_user_limit)})")
+
+        print(f"{'workers':>8} {'seconds':>9} {'stmts/s':>9} {'per core':>9} {'speedup':>9}")
+        for workers in args.workers:
+            output = os.path.join(os.path.dirname(path), f'statements-{workers}')
+            r = statements.generate_statements(period, output, args.format, workers)
+            print(f"{workers:>8} {r['elapsed']:>9.2f} {r['statements_per_second']:>9.0f} "
+                  f"{r['statements_per_second_per_core']:>9.0f} {baseline / r['elapsed']:>8.1f}x")
+    finally:
+        cleanup()
+
+if __name__ == '__main__':
+    main()
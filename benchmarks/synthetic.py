@@ -0,0 +1,90 @@
+# Synthetic bank generator used by the benchmarks.
+# Builds a throwaway SQLite database through database.py and fills it with
+# N users, their accounts and optionally a transaction history.
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+
+import database
+
+ACCOUNT_TYPES = ['Checking', 'Savings', 'Fixed Deposit', 'Premium Checking']
+DEMO_PASSWORD = 'password123'
+
+def use_database(path):
+    """Point database.py (and its connection pool) at another file"""
+    database.DATABASE = path
+    return path
+
+def temp_database(name='bench.db'):
+    """Create an empty temporary database path; returns (path, cleanup)"""
+    directory = tempfile.mkdtemp(prefix='securebank-bench-')
+    return os.path.join(directory, name), lambda: shutil.rmtree(directory, ignore_errors=True)
+
+def account_number(user_index):
+    return f'SYN{user_index:08d}'
+
+def make_bank(path, users, accounts_per_user=2, transactions=0, seed=42, max_age_days=400):
+    """Create a synthetic bank at `path` and return the number of accounts"""
+    use_database(path)
+    database.init_db()
+    rng = random.Random(seed)
+    now = datetime.now().replace(microsecond=0)
+    password_hash = database.hash_password(DEMO_PASSWORD)
+
+    conn = database.get_db_connection()
+    try:
+        type_ids = {row['type_name']: row['id'] for row in conn.execute('SELECT id, type_name FROM account_types')}
+        first_user = conn.execute('SELECT COALESCE(MAX(id), 0) FROM users').fetchone()[0] + 1
+
+        conn.executemany(
+            'INSERT INTO users (id, account_number, full_name, email, password_hash) VALUES (?, ?, ?, ?, ?)',
+            ((first_user + i, account_number(i), f'User {i}', f'user{i}@example.com', password_hash)
+             for i in range(users))
+        )
+
+        def account_rows():
+            for i in range(users):
+                # Every synthetic user has a Checking account first
+                for j in range(accounts_per_user):
+                    type_name = 'Checking' if j == 0 else ACCOUNT_TYPES[rng.randrange(1, len(ACCOUNT_TYPES))]
+                    created = now - timedelta(days=rng.randint(1, max_age_days), hours=1)
+                    yield (first_user + i, type_ids[type_name], round(rng.uniform(5000, 50000), 2),
+                           created.strftime('%Y-%m-%d %H:%M:%S'))
+
+        conn.executemany(
+            'INSERT INTO accounts (user_id, account_type_id, balance, created_at) VALUES (?, ?, ?, ?)',
+            account_rows()
+        )
+        account_ids = [row[0] for row in conn.execute('SELECT id FROM accounts')]
+
+        def transaction_rows():
+            for _ in range(transactions):
+                kind = rng.choice(('DEPOSIT', 'WITHDRAWAL', 'TRANSFER'))
+                source = rng.choice(account_ids) if kind != 'DEPOSIT' else None
+                target = rng.choice(account_ids) if kind != 'WITHDRAWAL' else None
+                created = now - timedelta(seconds=rng.randint(60, max_age_days * 86400))
+                yield (source, target, kind, round(rng.uniform(1, 500), 2), f'Synthetic {kind.lower()}',
+                       created.strftime('%Y-%m-%d %H:%M:%S'))
+
+        conn.executemany('''
+            INSERT INTO transactions (from_account_id, to_account_id, transaction_type, amount, description, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', transaction_rows())
+        conn.commit()
+        return len(account_ids)
+    finally:
+        conn.close()
+
+def copy_database(source, target):
+    """Copy a database with the SQLite backup API for A/B runs"""
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+    return target
@@ -0,0 +1,104 @@
+# Benchmark: keyset paging of /api/transactions (services.transactions_page)
+# through a burst of history written within one second, e.g. a batch job.
+# Checks that walking the pages returns every transaction exactly once, in
+# the same order as one unpaged query, then reports the per-page latency.
+#
+#   python -m benchmarks.transaction_paging --users 2000 --transactions 200000 --burst 20000
+#
+# Every row of the burst has the same created_at, so the pages can only be
+# told apart by id and the cursor's tie-break decides the result.
+import argparse
+import random
+import sys
+import time
+
+import database
+import services
+from benchmarks import synthetic
+
+def add_burst(conn, user_id, count, seed):
+    """Give user_id `count` transactions stamped with the same second"""
+    rng = random.Random(seed)
+    own = [row[0] for row in conn.execute('SELECT id FROM accounts WHERE user_id = ? ORDER BY id', (user_id,))]
+    others = [row[0] for row in conn.execute('SELECT id FROM accounts WHERE user_id != ? LIMIT 100', (user_id,))]
+    created_at = conn.execute("SELECT datetime('now')").fetchone()[0]
+
+    def rows():
+        for _ in range(count):
+            kind = rng.choice(('DEPOSIT', 'WITHDRAWAL', 'TRANSFER', 'TRANSFER'))
+            if kind == 'DEPOSIT':
+                source, target = None, rng.choice(own)
+            elif kind == 'WITHDRAWAL':
+                source, target = rng.choice(own), None
+            else:
+                # Half the transfers are between the user's own accounts
+                source, target = rng.sample(own, 2) if rng.random() < 0.5 else (rng.choice(own), rng.choice(others))
+            yield source, target, kind, round(rng.uniform(1, 500), 2), f'Burst {kind.lower()}', created_at
+
+    conn.executemany('''
+        INSERT INTO transactions (from_account_id, to_account_id, transaction_type, amount, description, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', rows())
+    conn.commit()
+    return own
+
+def expected_ids(conn, account_ids):
+    marks = ','.join('?' * len(account_ids))
+    return [row[0] for row in conn.execute(f'''
+        SELECT id FROM transactions
+        WHERE from_account_id IN ({marks}) OR to_account_id IN ({marks})
+        ORDER BY created_at DESC, id DESC
+    ''', (*account_ids, *account_ids))]
+
+def walk(conn, user_id, limit):
+    """Every page of user_id's history: (ids in page order, seconds per page)"""
+    ids = []
+    timings = []
+    cursor = None
+    while True:
+        started = time.perf_counter()
+        page, cursor = services.transactions_page(conn, user_id, limit, cursor)
+        timings.append(time.perf_counter() - started)
+        ids.extend(t['id'] for t in page)
+        if not cursor:
+            return ids, timings
+
+def main():
+    parser = argparse.ArgumentParser(description="Transaction history paging through same-second rows")
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--transactions', type=int, default=200000)
+    parser.add_argument('--burst', type=int, default=20000)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    path, cleanup = synthetic.temp_database()
+    try:
+        synthetic.make_bank(path, args.users, accounts_per_user=2, transactions=args.transactions, seed=args.seed)
+        conn = database.get_db_connection()
+        try:
+            user_id = conn.execute('SELECT MIN(id) FROM users').fetchone()[0]
+            account_ids = add_burst(conn, user_id, args.burst, args.seed)
+            expected = expected_ids(conn, account_ids)
+            ids, timings = walk(conn, user_id, args.limit)
+        finally:
+            conn.close()
+
+        ok = ids == expected
+        print(f"paging check ({len(expected)} transactions, {args.burst} in one second, "
+              f"{len(timings)} pages of {args.limit}): {'OK' if ok else 'FAILED'}")
+        if not ok:
+            missing = len(set(expected) - set(ids))
+            print(f"  {missing} missing, {len(ids) - len(set(ids))} duplicated, {len(ids)} returned")
+
+        timings.sort()
+        print(f"page latency: p50 {1000 * timings[len(timings) // 2]:.2f} ms, "
+              f"p99 {1000 * timings[int(len(timings) * 0.99) - 1]:.2f} ms, "
+              f"max {1000 * timings[-1]:.2f} ms")
+        if not ok:
+            sys.exit(1)
+    finally:
+        cleanup()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# Concurrency stress test for the ledger.
+# Several worker processes hammer a small set of accounts with transfers
+# through ledger.transfer, then the final balances are checked against the
+# transactions table and the minimum balances.
+#
+#   python -m benchmarks.transfer_contention --workers 1 4 16 --transfers 2000
+import argparse
+import multiprocessing
+import random
+import time
+
+import database
+import ledger
+from benchmarks import synthetic
+
+def worker(path, seed, transfers, account_ids, minimums, results):
+    synthetic.use_database(path)
+    rng = random.Random(seed)
+    conn = database.get_db_connection()
+    done = rejected = busy = 0
+    try:
+        for _ in range(transfers):
+            source, target = rng.sample(account_ids, 2)
+            try:
+                ledger.transfer(conn, source, target, float(rng.randint(1, 500)), minimums[source], 'Stress transfer')
+                done += 1
+            except ledger.InsufficientFunds:
+                rejected += 1
+            except ledger.DatabaseBusy:
+                busy += 1
+    finally:
+        conn.close()
+    results.put((done, rejected, busy))
+
+def verify(path, initial):
+    """Balances must equal initial balance + credits - debits and respect minimums"""
+    synthetic.use_database(path)
+    conn = database.get_db_connection()
+    try:
+        rows = conn.execute('''
+            SELECT a.id, a.balance, at.minimum_balance,
+                   COALESCE((SELECT SUM(amount) FROM transactions WHERE to_account_id = a.id), 0) AS credits,
+                   COALESCE((SELECT SUM(amount) FROM transactions WHERE from_account_id = a.id), 0) AS debits
+            FROM accounts a JOIN account_types at ON a.account_type_id = at.id
+        ''').fetchall()
+        # Deposits and withdrawals move money into and out of the bank
+        external = conn.execute('''
+            SELECT COALESCE(SUM(CASE WHEN from_account_id IS NULL THEN amount END), 0)
+                 - COALESCE(SUM(CASE WHEN to_account_id IS NULL THEN amount END), 0)
+            FROM transactions
+        ''').fetchone()[0]
+    finally:
+        conn.close()
+    errors = []
+    for row in rows:
+        expected = initial[row['id']] + row['credits'] - row['debits']
+        if abs(expected - row['balance']) > 1e-6:
+            errors.append(f"account {row['id']}: balance {row['balance']} != ledger {expected}")
+        if row['balance'] < row['minimum_balance'] - 1e-9:
+            errors.append(f"account {row['id']}: below minimum balance")
+    if abs(sum(r['balance'] for r in rows) - sum(initial.values()) - external) > 1e-6:
+        errors.append('total money changed')
+    return errors
+
+def run(workers, transfers, accounts):
+    path, cleanup = synthetic.temp_database()
+    try:
+        synthetic.make_bank(path, users=max(accounts // 2, 1), accounts_per_user=2)
+        conn = database.get_db_connection()
+        rows = conn.execute('''
+            SELECT a.id, a.balance, at.minimum_balance
+            FROM accounts a JOIN account_types at ON a.account_type_id = at.id
+        ''').fetchall()
+        conn.close()
+        initial = {r['id']: r['balance'] for r in rows}
+        minimums = {r['id']: r['minimum_balance'] for r in rows}
+        account_ids = list(initial)
+
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=worker, args=(path, seed, transfers // workers, account_ids, minimums, results))
+            for seed in range(workers)
+        ]
+        started = time.perf_counter()
+        for p in processes:
+            p.start()
+        totals = [results.get() for _ in processes]
+        for p in processes:
+            p.join()
+        elapsed = time.perf_counter() - started
+
+        done = sum(t[0] for t in totals)
+        return {
+            'workers': workers,
+            'transfers': done,
+            'rejected': sum(t[1] for t in totals),
+            'busy': sum(t[2] for t in totals),
+            'per_second': done / elapsed,
+            'errors': verify(path, initial),
+        }
+    finally:
+        cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description='Ledger transfer contention stress test')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--transfers', type=int, default=4000, help='total transfers per run')
+    parser.add_argument('--accounts', type=int, default=20, help='accounts competing for the write lock')
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'transfers':>10} {'rejected':>9} {'busy':>6} {'per sec':>10}  result")
+    failed = False
+    for workers in args.workers:
+        r = run(workers, args.transfers, args.accounts)
+        status = 'OK' if not r['errors'] else f"FAILED: {'; '.join(r['errors'][:3])}"
+        failed = failed or bool(r['errors'])
+        print(f"{r['workers']:>8} {r['transfers']:>10} {r['rejected']:>9} {r['busy']:>6} {r['per_second']:>10.0f}  {status}")
+    raise SystemExit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# Benchmark: cost of the velocity limit check (velocity.py) on transfers.
+# Times services.transfer with no limits configured and with hourly and
+# daily limits on every account type, and the check on its own.
+#
+#   python -m benchmarks.velocity_limits --users 2000 --transactions 200000 --transfers 2000
+#
+# The history is spread over the last two days, so the counters are rebuilt
+# from about half of it. The limits are set high enough that no transfer is
+# rejected and both runs do the same work apart from the check.
+import argparse
+import random
+import time
+
+import database
+import services
+import velocity
+from benchmarks import synthetic
+from catalog import catalog
+
+LIMITS = {'hourly_limit': 1e9, 'daily_limit': 1e9, 'user_hourly_limit': 1e9, 'user_daily_limit': 1e9}
+
+def run_transfers(users, count, seed):
+    rng = random.Random(seed)
+    conn = database.get_db_connection()
+    timings = []
+    try:
+        for _ in range(count):
+            (user_id, number), (_, to_number) = rng.sample(users, 2)
+            data = {'amount': 1.0, 'transferType': 'external', 'fromAccountType': 'Checking', 'to_account': to_number}
+            started = time.perf_counter()
+            services.transfer(conn, user_id, number, data)
+            timings.append(time.perf_counter() - started)
+    finally:
+        conn.close()
+    return timings
+
+def run_checks(accounts, count, seed):
+    """Time limiter.check alone, inside a write transaction like the ledger's"""
+    rng = random.Random(seed)
+    limiter = velocity.get_limiter()
+    conn = database.get_db_connection()
+    timings = []
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        for _ in range(count):
+            account_id, user_id = rng.choice(accounts)
+            started = time.perf_counter()
+            limiter.check(conn, account_id, user_id, 1.0, LIMITS, external=True)
+            timings.append(time.perf_counter() - started)
+        conn.rollback()
+    finally:
+        conn.close()
+    return timings
+
+def summary(values):
+    values = sorted(values)
+    return 1000 * sum(values) / len(values), 1000 * values[int(len(values) * 0.99) - 1]
+
+def main():
+    parser = argparse.ArgumentParser(description="Transfer latency with and without velocity limits")
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--transactions', type=int, default=200000)
+    parser.add_argument('--transfers', type=int, default=2000)
+    args = parser.parse_args()
+
+    path, cleanup = synthetic.temp_database()
+    try:
+        synthetic.make_bank(path, args.users, accounts_per_user=2, transactions=args.transactions, max_age_days=2)
+        conn = database.get_db_connection()
+        users = [tuple(row) for row in conn.execute('SELECT id, account_number FROM users')]
+        accounts = [tuple(row) for row in conn.execute('SELECT id, user_id FROM accounts')]
+        conn.close()
+
+        catalog.refresh(force=True)
+        plain = run_transfers(users, args.transfers, seed=1)
+
+        conn = database.get_db_connection()
+        conn.execute(f"UPDATE account_types SET {', '.join(f'{column} = ?' for column in LIMITS)}",
+                     tuple(LIMITS.values()))
+        conn.commit()
+        started = time.perf_counter()
+        velocity.get_limiter().rebuild(conn)
+        print(f"counter rebuild: {velocity.get_limiter().stats()['counters']} counters "
+              f"in {1000 * (time.perf_counter() - started):.1f} ms")
+        conn.close()
+        catalog.refresh(force=True)
+        limited = run_transfers(users, args.transfers, seed=1)
+        checks = run_checks(accounts, args.transfers, seed=2)
+
+        print(f"{'path':>16} {'mean ms':>9} {'p99 ms':>9}")
+        for name, values in (('no limits', plain), ('with limits', limited), ('check alone', checks)):
+            mean, p99 = summary(values)
+            print(f"{name:>16} {mean:>9.3f} {p99:>9.3f}")
+        print(f"added per transfer: {summary(limited)[0] - summary(plain)[0]:.3f} ms (mean)")
+    finally:
+        cleanup()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+# Benchmark: time-to-first-request when N workers boot at once.
+# Each worker is a fresh Python process that imports main and serves one
+# request, which is what a gunicorn worker does at boot. "check" is the
+# current boot path (schema version check only). "legacy" first runs
+# legacy_init_db() below, the init_db() every worker used to run, against a
+# fresh database file of its own: the DDL, the COUNT queries, and seeding the
+# demo users with two password hashes. That is what each worker paid when a
+# deploy started on an empty database.
+#
+#   python -m benchmarks.worker_startup --workers 1 16
+import argparse
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+
+from werkzeug.security import generate_password_hash
+
+from benchmarks import synthetic
+
+WORKER = '''
+import time
+started = time.perf_counter()
+if {legacy_path!r}:
+    from benchmarks.worker_startup import legacy_init_db
+    legacy_init_db({legacy_path!r})
+import main
+main.app.test_client().get('/login')
+print(time.perf_counter() - started)
+'''
+
+def legacy_init_db(path):
+    """The per-worker init_db() from before `./securebank init`, as it ran on a new database"""
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            account_number TEXT UNIQUE NOT NULL,
+            full_name TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS account_types (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type_name TEXT UNIQUE NOT NULL,
+            interest_rate REAL NOT NULL,
+            minimum_balance REAL NOT NULL,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS accounts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            account_type_id INTEGER NOT NULL,
+            balance REAL DEFAULT 0.0,
+            last_interest_calc_date TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (account_type_id) REFERENCES account_types(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_account_id INTEGER,
+            to_account_id INTEGER,
+            transaction_type TEXT NOT NULL,
+            amount REAL NOT NULL,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (from_account_id) REFERENCES accounts(id),
+            FOREIGN KEY (to_account_id) REFERENCES accounts(id)
+        )
+    ''')
+
+    cursor.execute("SELECT COUNT(*) as count FROM account_types")
+    if cursor.fetchone()['count'] == 0:
+        cursor.executemany('''
+            INSERT INTO account_types (type_name, interest_rate, minimum_balance, description)
+            VALUES (?, ?, ?, ?)
+        ''', [
+            ('Checking', 0.0, 0.0, 'Basic checking account with no minimum balance'),
+            ('Savings', 2.5, 100.0, 'Savings account with 2.5% annual interest rate'),
+            ('Fixed Deposit', 5.0, 1000.0, 'Fixed deposit account with 5% annual interest rate'),
+            ('Premium Checking', 0.5, 5000.0, 'Premium checking account with 0.5% interest rate')
+        ])
+
+    cursor.execute("SELECT COUNT(*) as count FROM users")
+    if cursor.fetchone()['count'] == 0:
+        cursor.execute("PRAGMA table_info(accounts)")
+        cursor.fetchall()
+        cursor.execute("SELECT id, type_name FROM account_types")
+        types = {row['type_name']: row['id'] for row in cursor.fetchall()}
+        for number, name, email, accounts in [
+            ('ACC001', 'John Doe', 'john@example.com',
+             [('Checking', 5000.00), ('Savings', 10000.00), ('Fixed Deposit', 20000.00)]),
+            ('ACC002', 'Jane Smith', 'jane@example.com', [('Premium Checking', 15000.00), ('Savings', 8000.00)]),
+        ]:
+            cursor.execute('''
+                INSERT INTO users (account_number, full_name, email, password_hash)
+                VALUES (?, ?, ?, ?)
+            ''', (number, name, email, generate_password_hash('password123')))
+            user_id = cursor.lastrowid
+            cursor.executemany('''
+                INSERT INTO accounts (user_id, account_type_id, balance)
+                VALUES (?, ?, ?)
+            ''', [(user_id, types[type_name], balance) for type_name, balance in accounts])
+
+    conn.commit()
+    conn.close()
+
+def boot(path, workers, legacy):
+    env = dict(os.environ, SECUREBANK_DATABASE=path, SECUREBANK_VERIFY_WORKERS='0')
+    # Legacy workers each set up a new file next to the (already migrated) bank they then serve from
+    legacy_paths = [f'{path}.legacy{i}' if legacy else '' for i in range(workers)]
+    for legacy_path in filter(None, legacy_paths):
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+    started = time.perf_counter()
+    processes = [
+        subprocess.Popen([sys.executable, '-c', WORKER.format(legacy_path=legacy_path)], env=env,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        for legacy_path in legacy_paths
+    ]
+    per_worker = []
+    for p in processes:
+        out, err = p.communicate()
+        if p.returncode:
+            raise RuntimeError(err)
+        per_worker.append(float(out.strip().splitlines()[-1]))
+    return time.perf_counter() - started, per_worker
+
+def main():
+    parser = argparse.ArgumentParser(description='Worker boot time benchmark')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 16])
+    args = parser.parse_args()
+
+    path, cleanup = synthetic.temp_database()
+    try:
+        synthetic.make_bank(path, users=1000, accounts_per_user=2)
+        print(f"{'workers':>8} {'mode':>7} {'all ready s':>12} {'worker avg s':>13} {'worker max s':>13}")
+        for workers in args.workers:
+            for legacy in (True, False):
+                total, per_worker = boot(path, workers, legacy)
+                print(f"{workers:>8} {'legacy' if legacy else 'check':>7} {total:>12.3f} "
+                      f"{sum(per_worker) / len(per_worker):>13.3f} {max(per_worker):>13.3f}")
+    finally:
+        cleanup()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# This file keeps a copy of the account types (Checking, Savings, etc.) in memory.
+# Account types almost never change, so each worker loads them once and only
+# reloads them when the version number stored in the database goes up.
+# Account type catalog for SecureBank
+import os
+import threading
+import time
+import database
+from database import get_read_connection
+
+# How often (seconds) a worker re-reads the version counter
+REFRESH_INTERVAL = float(os.environ.get('SECUREBANK_CATALOG_REFRESH', '1'))
+# Fields of an account type that clients may see (/api/account-types); the
+# velocity limits stay server-side
+PUBLIC_FIELDS = ('id', 'name', 'interest_rate', 'minimum_balance', 'description')
+
+class AccountTypeCatalog:
+    """In-memory account types keyed by id and by type_name"""
+
+    def __init__(self, refresh_interval=REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.version = None
+        self.database = None
+        self.by_id = {}
+        self.by_name = {}
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _read_version(self, conn):
+        row = conn.execute(
+            "SELECT version FROM catalog_version WHERE name = 'account_types'"
+        ).fetchone()
+        return row['version'] if row else 0
+
+    def _load(self, conn, version):
+        types = [{
+            'id': t['id'],
+            'name': t['type_name'],
+            'interest_rate': float(t['interest_rate']),
+            'minimum_balance': float(t['minimum_balance']),
+            'description': t['description'],
+            # Outgoing limits enforced by velocity.py; None means no limit
+            **{column: None if t[column] is None else float(t[column])
+               for column in database.VELOCITY_LIMIT_COLUMNS},
+        } for t in conn.execute(f'''
+            SELECT id, type_name, interest_rate, minimum_balance, description,
+                   {', '.join(database.VELOCITY_LIMIT_COLUMNS)}
+            FROM account_types ORDER BY id
+        ''').fetchall()]
+        self.by_id = {t['id']: t for t in types}
+        self.by_name = {t['name']: t for t in types}
+        self.version = version
+        self.database = database.DATABASE
+
+    def refresh(self, force=False):
+        """Reload if the database version moved on since the last check"""
+        now = time.monotonic()
+        force = force or self.database != database.DATABASE
+        if not force and self.version is not None and now - self._checked_at < self.refresh_interval:
+            return self
+        with self._lock:
+            if not force and self.version is not None and now - self._checked_at < self.refresh_interval:
+                return self
+            conn = get_read_connection()
+            try:
+                version = self._read_version(conn)
+                if force or version != self.version:
+                    self._load(conn, version)
+            finally:
+                conn.close()
+            self._checked_at = now
+        return self
+
+    def get(self, type_name):
+        """Account type by name, or None"""
+        return self.refresh().by_name.get(type_name)
+
+    def get_by_id(self, type_id):
+        """Account type by id, or None"""
+        return self.refresh().by_id.get(type_id)
+
+    def all(self):
+        """All account types ordered by id"""
+        return list(self.refresh().by_id.values())
+
+    def public(self):
+        """All account types ordered by id, with only their PUBLIC_FIELDS"""
+        return [{field: t[field] for field in PUBLIC_FIELDS} for t in self.all()]
+
+    def invalidate(self):
+        """Force a version check on the next lookup"""
+        self._checked_at = 0.0
+
+catalog = AccountTypeCatalog()
@@ -0,0 +1,139 @@
+# Command line tools for running SecureBank.
+# Setting up or upgrading the database is done once with these commands,
+# before the web server starts, instead of in every server worker.
+#
+#   ./securebank init [--demo]   create or upgrade the database (optionally with demo accounts)
+#   ./securebank migrate         apply pending schema migrations
+#   ./securebank status          show the schema version
+#   ./securebank interest-scheduler [--once]   credit due interest in the background
+#   ./securebank project-interest OUTPUT        project every balance over the coming years
+#   ./securebank statements YYYY-MM OUTPUT      write every user's monthly statement
+#   ./securebank snapshot-balances              record daily closing balances (run daily)
+#   ./securebank outbox-relay [--once]          deliver transfers between shards
+#
+# With SECUREBANK_SHARDS > 1, init, migrate and status cover every shard, and
+# `--shard K` runs a command against shard K's database file alone (the batch
+# jobs above run once per shard). outbox-relay needs every shard to deliver
+# to, so there `--shard K` only limits which shard's outbox is scanned.
+import argparse
+import database
+import interest
+import outbox
+import projection
+import snapshots
+import statements
+
+def cmd_init(args):
+    database.init_db(demo_data=args.demo)
+
+def cmd_migrate(args):
+    for shard in database.shard_ids():
+        conn = database.get_db_connection(shard)
+        try:
+            version = database.migrate(conn)
+        finally:
+            conn.close()
+        print(f"{database.shard_path(shard)} is at schema version {version}")
+
+def cmd_status(args):
+    for shard in database.shard_ids():
+        conn = database.get_db_connection(shard)
+        try:
+            version = database.get_schema_version(conn)
+        finally:
+            conn.close()
+        state = 'up to date' if version >= database.SCHEMA_VERSION else f'needs migration to {database.SCHEMA_VERSION}'
+        print(f"{database.shard_path(shard)}: schema version {version} ({state})")
+
+def cmd_interest_scheduler(args):
+    database.check_schema()
+    interest.run_scheduler(interval=args.interval, chunk_size=args.chunk_size, once=args.once)
+
+def cmd_project_interest(args):
+    summary = projection.project_all(args.output, args.years, args.compounding, args.rate_schedule,
+                                     args.format)
+    print(f"Projected {summary['accounts']} accounts over {args.years} years "
+          f"in {summary['elapsed']:.2f}s -> {args.output}")
+
+def cmd_statements(args):
+    summary = statements.generate_statements(args.period, args.output, args.format, args.workers)
+    print(f"Wrote {summary['statements']} statements ({summary['skipped']} already present) "
+          f"in {summary['elapsed']:.2f}s: {summary['statements_per_second']:.0f}/s, "
+          f"{summary['statements_per_second_per_core']:.0f}/s per core on {summary['workers']} workers")
+
+def cmd_snapshot_balances(args):
+    database.check_schema()
+    summary = snapshots.run_snapshot_job(args.through)
+    print(f"Snapshots complete through {summary['through_day']}: "
+          f"{summary['snapshots']} written in {summary['elapsed']:.2f}s")
+
+def cmd_outbox_relay(args):
+    database.check_schema()
+    shards = None
+    if args.shard is not None:
+        check_shard(args.shard)
+        shards = [args.shard]
+    outbox.run_relay(interval=args.interval, once=args.once, shards=shards)
+
+def check_shard(shard):
+    if not 0 <= shard < database.SHARDS:
+        raise SystemExit(f"--shard must be between 0 and {database.SHARDS - 1}")
+
+def use_shard(shard):
+    """Point this process at one shard's database file, as if it were the only one"""
+    check_shard(shard)
+    database.DATABASE = database.shard_path(shard)
+    database.SHARDS = 1
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='securebank', description='SecureBank management commands')
+    parser.add_argument('--shard', type=int, help="run against one shard's database file (sharded mode)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    init = commands.add_parser('init', help='create or upgrade the database')
+    init.add_argument('--demo', action='store_true', help='seed the demo accounts if there are no users')
+    init.set_defaults(func=cmd_init)
+
+    commands.add_parser('migrate', help='apply pending schema migrations').set_defaults(func=cmd_migrate)
+    commands.add_parser('status', help='show the schema version').set_defaults(func=cmd_status)
+
+    scheduler = commands.add_parser('interest-scheduler', help='credit due interest in chunks, every --interval seconds')
+    scheduler.add_argument('--once', action='store_true', help='run a single pass and exit')
+    scheduler.add_argument('--interval', type=float, help='seconds between passes (SECUREBANK_INTEREST_INTERVAL)')
+    scheduler.add_argument('--chunk-size', type=int, help='accounts per transaction (SECUREBANK_INTEREST_CHUNK_SIZE)')
+    scheduler.set_defaults(func=cmd_interest_scheduler)
+
+    project = commands.add_parser('project-interest', help='write projected year-end balances for every account')
+    project.add_argument('output', help='CSV file, or a directory for --format columns')
+    project.add_argument('--years', type=int, default=10)
+    project.add_argument('--compounding', choices=list(projection.COMPOUNDING_PERIODS), default='daily')
+    project.add_argument('--rate-schedule', type=float, nargs='+',
+                         help='per-year rate changes in percentage points; the last one holds')
+    project.add_argument('--format', choices=projection.OUTPUT_FORMATS, default='csv',
+                         help='csv, or one .npy file per column')
+    project.set_defaults(func=cmd_project_interest)
+
+    statement = commands.add_parser('statements', help='write monthly statements for every user')
+    statement.add_argument('period', help='month as YYYY-MM')
+    statement.add_argument('output', help='directory; statements go to OUTPUT/YYYY-MM/')
+    statement.add_argument('--format', choices=list(statements.STATEMENT_FORMATS), default='html')
+    statement.add_argument('--workers', type=int, help='processes (SECUREBANK_STATEMENT_WORKERS)')
+    statement.set_defaults(func=cmd_statements)
+
+    snapshot = commands.add_parser('snapshot-balances', help='record daily closing balances since the last run')
+    snapshot.add_argument('--through', help='last day to snapshot, YYYY-MM-DD (default yesterday, UTC)')
+    snapshot.set_defaults(func=cmd_snapshot_balances)
+
+    relay = commands.add_parser('outbox-relay', help='deliver pending transfers between shards')
+    relay.add_argument('--once', action='store_true', help='deliver what is pending and exit')
+    relay.add_argument('--interval', type=float, help='seconds between passes (SECUREBANK_OUTBOX_INTERVAL)')
+    # Keeps the full shard map; --shard only picks the outbox to scan
+    relay.set_defaults(func=cmd_outbox_relay, all_shards=True)
+
+    args = parser.parse_args(argv)
+    if args.shard is not None and not getattr(args, 'all_shards', False):
+        use_shard(args.shard)
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
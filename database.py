@@ -2,32 +2,448 @@
 # It sets up the database and provides functions to connect and manage data.
 # Database utility functions for SecureBank
 # Handles connection, initialization, and schema setup for SQLite
+import os
+import queue
+import secrets
 import sqlite3
+import threading
+import time
+import zlib
 from datetime import datetime
-from werkzeug.security import generate_password_hash
+from urllib.request import pathname2url
+from flask import g, has_app_context
+import metrics
+import passwords
 
-DATABASE = 'banking.db'
+DATABASE = os.environ.get('SECUREBANK_DATABASE', 'banking.db')
+# Optional sharded storage: users, their accounts and transactions are split
+# across this many database files by user id (see the shard router below)
+SHARDS = int(os.environ.get('SECUREBANK_SHARDS', '1'))
 
-def get_db_connection():
-    """Create a database connection"""
-    conn = sqlite3.connect(DATABASE)
+# Connection pool settings (one pool per gunicorn worker process)
+POOL_SIZE = int(os.environ.get('SECUREBANK_POOL_SIZE', '5'))
+POOL_TIMEOUT = float(os.environ.get('SECUREBANK_POOL_TIMEOUT', '10'))
+# Read-only connections for GET requests come from a separate pool; WAL
+# readers never wait for writers, so this can be sized to the core count
+READ_POOL_SIZE = int(os.environ.get('SECUREBANK_READ_POOL_SIZE', str(max(4, os.cpu_count() or 1))))
+
+# Applied once to every new connection, not on every checkout
+CONNECTION_PRAGMAS = [
+    ('journal_mode', os.environ.get('SECUREBANK_JOURNAL_MODE', 'WAL')),
+    ('synchronous', os.environ.get('SECUREBANK_SYNCHRONOUS', 'NORMAL')),
+    ('busy_timeout', int(os.environ.get('SECUREBANK_BUSY_TIMEOUT_MS', '5000'))),
+    ('cache_size', int(os.environ.get('SECUREBANK_CACHE_SIZE', '-16000'))),
+    ('mmap_size', int(os.environ.get('SECUREBANK_MMAP_SIZE', '134217728'))),
+]
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that times its statements for /metrics, fetches included"""
+    _sql = None
+    _elapsed = 0.0
+    # Row-by-row fetch time not yet handed to metrics; it is recorded once per
+    # statement, when the rows run out or the cursor is re-executed or closed
+    _unrecorded = 0.0
+
+    def _record_rows(self):
+        if self._unrecorded:
+            elapsed, self._unrecorded = self._unrecorded, 0.0
+            metrics.record_fetch(self._sql, elapsed, self._elapsed)
+
+    def execute(self, sql, parameters=()):
+        self._record_rows()
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._sql = sql
+            self._elapsed = time.perf_counter() - started
+            metrics.record_query(sql, self._elapsed)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._record_rows()
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._sql = sql
+            self._elapsed = time.perf_counter() - started
+            metrics.record_query(sql, self._elapsed)
+
+    def _fetch(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            if self._sql is not None:
+                self._record_rows()
+                elapsed = time.perf_counter() - started
+                self._elapsed += elapsed
+                metrics.record_fetch(self._sql, elapsed, self._elapsed)
+
+    def fetchone(self):
+        return self._fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._fetch(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            row = None
+        if self._sql is not None:
+            elapsed = time.perf_counter() - started
+            self._elapsed += elapsed
+            self._unrecorded += elapsed
+        if row is None:
+            self._record_rows()
+            raise StopIteration
+        return row
+
+    def close(self):
+        self._record_rows()
+        super().close()
+
+    def __del__(self):
+        # A loop that breaks early leaves its rows unrecorded until here
+        self._record_rows()
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection that goes back to its pool instead of closing"""
+    pool = None
+    shard = 0
+    context_bound = False
+
+    # Every statement runs on a TimedCursor, so /metrics sees both the
+    # execute and the fetches, whether it went through the connection or a cursor
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        # Connections bound to a Flask app context are returned on teardown
+        if self.context_bound:
+            return
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            super().close()
+
+# Journal settings belong to writers; a read-only connection cannot change them
+WRITER_ONLY_PRAGMAS = ('journal_mode', 'synchronous')
+
+def configure_connection(conn, readonly=False):
+    """Apply the standard row factory and PRAGMA settings to a connection"""
     conn.row_factory = sqlite3.Row
+    for name, value in CONNECTION_PRAGMAS:
+        if readonly and name in WRITER_ONLY_PRAGMAS:
+            continue
+        conn.execute(f'PRAGMA {name} = {value}')
+    if readonly:
+        conn.execute('PRAGMA query_only = 1')
     return conn
 
+def connect(database=None, readonly=False):
+    """A new configured connection that is not part of the pool
+
+    close() really closes it. Used by long-lived background threads that
+    should not hold one of the request pool's connections. Read-only
+    connections are opened with a mode=ro URI and query_only set.
+    """
+    database = database or DATABASE
+    if readonly:
+        conn = sqlite3.connect(f'file:{pathname2url(os.path.abspath(database))}?mode=ro', uri=True,
+                               factory=PooledConnection, check_same_thread=False)
+    else:
+        conn = sqlite3.connect(database, factory=PooledConnection, check_same_thread=False)
+    return configure_connection(conn, readonly)
+
+class ConnectionPool:
+    """A fixed-size pool of pre-configured SQLite connections"""
+
+    def __init__(self, database, size=POOL_SIZE, timeout=POOL_TIMEOUT, readonly=False, shard=0):
+        self.database = database
+        self.readonly = readonly
+        self.shard = shard
+        self.size = size
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self.checkouts = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+
+    def _connect(self):
+        conn = connect(self.database, self.readonly)
+        conn.pool = self
+        conn.shard = self.shard
+        return conn
+
+    def acquire(self):
+        """Check a connection out, waiting up to `timeout` if the pool is exhausted"""
+        started = time.perf_counter()
+        conn = None
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self.timeouts += 1
+                    raise TimeoutError('Timed out waiting for a database connection')
+
+        waited = time.perf_counter() - started
+        with self._lock:
+            self._in_use += 1
+            self.checkouts += 1
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+        return conn
+
+    def release(self, conn):
+        """Return a connection, discarding any uncommitted work"""
+        conn.context_bound = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # A broken connection is dropped and replaced on the next checkout
+            sqlite3.Connection.close(conn)
+            with self._lock:
+                self._in_use -= 1
+                self._created -= 1
+            return
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(conn)
+
+    def close_all(self):
+        """Close every idle connection (used on shutdown and after fork)"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            sqlite3.Connection.close(conn)
+            with self._lock:
+                self._created -= 1
+
+    def stats(self):
+        """Snapshot of pool metrics"""
+        with self._lock:
+            return {
+                'pool_size': self.size,
+                'connections': self._created,
+                'in_use': self._in_use,
+                'idle': self._created - self._in_use,
+                'checkouts': self.checkouts,
+                'wait_time_total': self.wait_time,
+                'wait_time_avg': self.wait_time / self.checkouts if self.checkouts else 0.0,
+                'wait_time_max': self.max_wait,
+                'timeouts': self.timeouts,
+            }
+
+# Shard router. With SECUREBANK_SHARDS=N, users live in N database files:
+# shard 0 is DATABASE itself (it also holds sessions and the app secret) and
+# shard k is DATABASE with ".shard<k>" before the extension. A user and their
+# accounts are on shard id % N, so any id can be routed without a lookup; ids
+# are allocated with new_id() to keep that true. With one shard every helper
+# below collapses to DATABASE.
+
+def shard_path(shard):
+    """Database file of a shard"""
+    if shard == 0:
+        return DATABASE
+    root, extension = os.path.splitext(DATABASE)
+    return f'{root}.shard{shard}{extension}'
+
+def shard_ids():
+    return range(SHARDS)
+
+def shard_for_user(user_id):
+    return user_id % SHARDS
+
+def shard_for_account(account_id):
+    return account_id % SHARDS
+
+def place_user(account_number):
+    """Shard for a new user, spread by account number"""
+    return zlib.crc32(account_number.encode()) % SHARDS
+
+def new_id(conn, table, shard):
+    """Next id for a row of users or accounts on `shard`
+
+    None with a single shard, so AUTOINCREMENT picks it as before. Must run
+    inside the write transaction that inserts the row.
+    """
+    if SHARDS == 1:
+        return None
+    last = conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}').fetchone()[0]
+    next_id = last - last % SHARDS + shard
+    return next_id if next_id > last else next_id + SHARDS
+
+def find_user_shard(account_number):
+    """Shard holding the user with this account number (0 if there is none)
+
+    One index seek per shard; only login needs it, as every later request
+    routes by the user id in the session.
+    """
+    if SHARDS == 1:
+        return 0
+    for shard in shard_ids():
+        conn = get_read_connection(shard)
+        try:
+            if conn.execute('SELECT 1 FROM users WHERE account_number = ?', (account_number,)).fetchone():
+                return shard
+        finally:
+            conn.close()
+    return 0
+
+_pools = {}
+_pool_lock = threading.Lock()
+
+def _get_pool(readonly, shard=0):
+    pid = os.getpid()
+    key = (shard, readonly)
+    pool = _pools.get(key)
+    if pool is None or pool.pid != pid or pool.database != shard_path(shard):
+        with _pool_lock:
+            pool = _pools.get(key)
+            if pool is None or pool.pid != pid or pool.database != shard_path(shard):
+                pool = _pools[key] = ConnectionPool(
+                    shard_path(shard), READ_POOL_SIZE if readonly else POOL_SIZE, readonly=readonly, shard=shard)
+    return pool
+
+def get_pool(shard=0):
+    """Return this process's writer pool, creating a fresh one after a fork"""
+    return _get_pool(False, shard)
+
+def get_read_pool(shard=0):
+    """Return this process's read-only pool, creating a fresh one after a fork"""
+    return _get_pool(True, shard)
+
+def pool_stats():
+    """Metrics for the current worker's writer connection pool"""
+    return get_pool().stats()
+
+def read_pool_stats():
+    """Metrics for the current worker's read-only connection pool"""
+    return get_read_pool().stats()
+
+def _context_connection(readonly, shard):
+    # One connection per shard and mode for the whole app context
+    connections = g.get('_db_conns')
+    if connections is None:
+        connections = g._db_conns = {}
+    conn = connections.get((shard, readonly))
+    if conn is None:
+        conn = _get_pool(readonly, shard).acquire()
+        conn.context_bound = True
+        connections[(shard, readonly)] = conn
+    return conn
+
+def get_db_connection(shard=0):
+    """Get a pooled read-write database connection
+
+    Inside a Flask app context the same connection is reused for the whole
+    request and returned to the pool on teardown. Outside of one, the caller
+    owns the connection until it calls close(). `shard` picks the database
+    file in sharded mode (see shard_for_user); the default is DATABASE.
+    """
+    if has_app_context():
+        return _context_connection(False, shard)
+    return get_pool(shard).acquire()
+
+def get_read_connection(shard=0):
+    """Get a pooled read-only connection, for code that never writes
+
+    Bound to the app context like get_db_connection(). Each statement reads
+    a WAL snapshot; code that needs several queries to agree wraps them in
+    BEGIN/COMMIT. Read transactions are kept that short on purpose, as one
+    held open for a whole request keeps checkpoints from resetting the WAL.
+    """
+    if has_app_context():
+        return _context_connection(True, shard)
+    return get_read_pool(shard).acquire()
+
+def release_db_connection(exception=None):
+    """Return the app context's connections to their pools"""
+    for conn in g.pop('_db_conns', {}).values():
+        conn.pool.release(conn)
+
+def init_app(app):
+    """Bind connection checkout/return to the Flask app context"""
+    app.teardown_appcontext(release_db_connection)
+
 def hash_password(password):
-    """Hash a password securely using werkzeug"""
-    return generate_password_hash(password)
+    """Hash a password securely using werkzeug (method set by SECUREBANK_HASH_METHOD)"""
+    return passwords.hash_password(password)
+
+# Rows copied per transaction by data-copy migrations
+MIGRATION_CHUNK_SIZE = int(os.environ.get('SECUREBANK_MIGRATION_CHUNK_SIZE', '50000'))
+
+def copy_in_chunks(conn, target, insert_select, params=(), chunk_size=None, label='rows'):
+    """Run a data-copy INSERT ... SELECT in id-ordered chunks, one commit each
+
+    `insert_select` must select from the source with `WHERE <id> > ?
+    ORDER BY <id> LIMIT ?`; the extra parameters are appended after
+    `params`. The highest id already in `target` is the checkpoint, so an
+    interrupted copy picks up where it stopped. SQLite does the copying,
+    so memory use does not depend on the table size.
+    """
+    chunk_size = chunk_size or MIGRATION_CHUNK_SIZE
+    copied = conn.execute(f'SELECT COUNT(*) FROM {target}').fetchone()[0]
+    last_id = conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {target}').fetchone()[0]
+    if conn.in_transaction:
+        conn.commit()
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        count = conn.execute(insert_select, (*params, last_id, chunk_size)).rowcount
+        if count <= 0:
+            conn.rollback()
+            break
+        last_id = conn.execute(f'SELECT MAX(id) FROM {target}').fetchone()[0]
+        conn.commit()
+        copied += count
+        print(f"  copied {copied} {label} (up to id {last_id})")
+    return copied
 
 def migrate_accounts(conn, cursor):
-    """Migrate existing accounts to the new schema"""
+    """Version 2: migrate existing accounts to the account_types schema"""
     # Check if we need to migrate
     cursor.execute("PRAGMA table_info(accounts)")
     columns = [column[1] for column in cursor.fetchall()]
     
     if 'account_type' in columns and 'account_type_id' not in columns:
-        # Create temporary table
+        # Create temporary table (kept across runs so the copy can resume)
         cursor.execute('''
-            CREATE TABLE accounts_temp (
+            CREATE TABLE IF NOT EXISTS accounts_temp (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
                 account_type_id INTEGER NOT NULL,
@@ -52,34 +468,29 @@ def migrate_accounts(conn, cursor):
                 ]
             )
         
-        # Get account type mapping
-        cursor.execute("SELECT id, type_name FROM account_types")
-        type_map = {row[1]: row[0] for row in cursor.fetchall()}
-        
-        # Migrate data
-        cursor.execute("SELECT * FROM accounts")
-        old_accounts = cursor.fetchall()
+        checking_id = cursor.execute("SELECT id FROM account_types WHERE type_name = 'Checking'").fetchone()[0]
         
-        for account in old_accounts:
-            account_type = account[2]  # account_type column in old schema
-            type_id = type_map.get(account_type, type_map['Checking'])  # Default to Checking if type not found
-            
-            cursor.execute('''
-                INSERT INTO accounts_temp (id, user_id, account_type_id, balance, created_at)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (account[0], account[1], type_id, account[3], account[4]))
+        # Migrate data with a mapping join, defaulting to Checking if the type is unknown
+        copy_in_chunks(conn, 'accounts_temp', '''
+            INSERT INTO accounts_temp (id, user_id, account_type_id, balance, created_at)
+            SELECT a.id, a.user_id, COALESCE(at.id, ?), a.balance, a.created_at
+            FROM accounts a
+            LEFT JOIN account_types at ON at.type_name = a.account_type
+            WHERE a.id > ?
+            ORDER BY a.id
+            LIMIT ?
+        ''', (checking_id,), label='accounts')
         
-        # Drop old table and rename new one
+        # Drop old table and rename new one; committed together with the
+        # schema version by migrate()
+        conn.execute('BEGIN IMMEDIATE')
         cursor.execute("DROP TABLE accounts")
         cursor.execute("ALTER TABLE accounts_temp RENAME TO accounts")
         
         print("Account migration completed successfully!")
 
-def init_db():
-    """Initialize the database with tables"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
+def create_base_schema(conn, cursor):
+    """Version 1: core tables and the default account types"""
     # Create users table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -148,63 +559,304 @@ def init_db():
             VALUES (?, ?, ?, ?)
         ''', account_types)
 
-    # Create demo accounts if they don't exist
-    cursor.execute("SELECT COUNT(*) as count FROM users")
-    if cursor.fetchone()['count'] == 0:
-        # Migrate existing accounts if needed
-        migrate_accounts(conn, cursor)
-        
-        # Get account type IDs
-        cursor.execute("SELECT id, type_name FROM account_types")
-        account_type_map = {row['type_name']: row['id'] for row in cursor.fetchall()}
+def create_history_indexes(conn, cursor):
+    """Version 3: indexes for account lookups and transaction history"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_accounts_user_id ON accounts (user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_transactions_from_created ON transactions (from_account_id, created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_transactions_to_created ON transactions (to_account_id, created_at)')
 
-        # Create demo user 1
-        cursor.execute('''
-            INSERT INTO users (account_number, full_name, email, password_hash)
-            VALUES (?, ?, ?, ?)
-        ''', ('ACC001', 'John Doe', 'john@example.com', hash_password('password123')))
-        user1_id = cursor.lastrowid
-        
-        # Create multiple accounts for user 1
-        accounts_user1 = [
-            (user1_id, account_type_map['Checking'], 5000.00),
-            (user1_id, account_type_map['Savings'], 10000.00),
-            (user1_id, account_type_map['Fixed Deposit'], 20000.00)
-        ]
-        cursor.executemany('''
-            INSERT INTO accounts (user_id, account_type_id, balance)
-            VALUES (?, ?, ?)
-        ''', accounts_user1)
-        
-        # Create demo user 2
+def create_catalog_version(conn, cursor):
+    """Version 4: version counter bumped whenever account_types changes"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO catalog_version (name, version) VALUES ('account_types', 1)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS account_types_version_{event.lower()}
+            AFTER {event} ON account_types
+            BEGIN
+                UPDATE catalog_version SET version = version + 1 WHERE name = 'account_types';
+            END
+        ''')
+
+def create_session_tables(conn, cursor):
+    """Version 5: server-side sessions and the shared application secret"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS app_secrets (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+
+def create_interest_schedule(conn, cursor):
+    """Version 6: due-date index and checkpoints for the interest scheduler"""
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_accounts_interest_due '
+        'ON accounts (COALESCE(last_interest_calc_date, created_at))'
+    )
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS interest_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            as_of TIMESTAMP NOT NULL,
+            last_due_at TEXT NOT NULL DEFAULT '',
+            last_account_id INTEGER NOT NULL DEFAULT 0,
+            accounts INTEGER NOT NULL DEFAULT 0,
+            total_credited REAL NOT NULL DEFAULT 0,
+            started_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            finished_at REAL
+        )
+    ''')
+
+def create_balance_snapshots(conn, cursor):
+    """Version 7: daily closing balances and the snapshot job's progress"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS account_balance_snapshots (
+            account_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            balance REAL NOT NULL,
+            PRIMARY KEY (account_id, day),
+            FOREIGN KEY (account_id) REFERENCES accounts(id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS balance_snapshot_progress (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            through_day TEXT NOT NULL,
+            last_account_id INTEGER NOT NULL
+        )
+    ''')
+    # The job reads only the transactions since its last run
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_transactions_created_at ON transactions (created_at)')
+
+VELOCITY_LIMIT_COLUMNS = ('hourly_limit', 'daily_limit', 'user_hourly_limit', 'user_daily_limit')
+
+def add_velocity_limits(conn, cursor):
+    """Version 8: per account type hourly and daily outgoing limits (NULL = none)"""
+    cursor.execute("PRAGMA table_info(account_types)")
+    columns = {column[1] for column in cursor.fetchall()}
+    for column in VELOCITY_LIMIT_COLUMNS:
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE account_types ADD COLUMN {column} REAL')
+    # ALTER TABLE fires no trigger; make running workers reload the catalog
+    cursor.execute("UPDATE catalog_version SET version = version + 1 WHERE name = 'account_types'")
+
+def create_recipient_directory(conn, cursor):
+    """Version 9: deposit account preference and the recipient directory's version counter"""
+    cursor.execute("PRAGMA table_info(users)")
+    if 'deposit_account_id' not in {column[1] for column in cursor.fetchall()}:
+        # NULL: Checking first, then the oldest account (see recipients.py)
+        cursor.execute('ALTER TABLE users ADD COLUMN deposit_account_id INTEGER REFERENCES accounts (id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_accounts_user_type ON accounts (user_id, account_type_id)')
+    cursor.execute("INSERT OR IGNORE INTO catalog_version (name, version) VALUES ('accounts', 1)")
+    # Balance updates do not touch these columns, so transfers never fire them
+    for name, event in (
+        ('accounts_insert', 'INSERT ON accounts'),
+        ('accounts_delete', 'DELETE ON accounts'),
+        ('accounts_update', 'UPDATE OF user_id, account_type_id ON accounts'),
+        ('users_delete', 'DELETE ON users'),
+        ('users_update', 'UPDATE OF account_number, deposit_account_id ON users'),
+    ):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS recipient_directory_{name}
+            AFTER {event}
+            BEGIN
+                UPDATE catalog_version SET version = version + 1 WHERE name = 'accounts';
+            END
+        ''')
+
+def create_transfer_outbox(conn, cursor):
+    """Version 10: outbox and inbox for transfers between shards (see outbox.py)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS transfer_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_account_id INTEGER NOT NULL,
+            to_account_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            description TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            settled_at TIMESTAMP,
+            FOREIGN KEY (from_account_id) REFERENCES accounts(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_transfer_outbox_pending
+        ON transfer_outbox (from_account_id, id) WHERE status = 'pending'
+    ''')
+    # One row per transfer received from another shard, so a redelivery is a no-op
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS transfer_inbox (
+            source_shard INTEGER NOT NULL,
+            outbox_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (source_shard, outbox_id)
+        ) WITHOUT ROWID
+    ''')
+
+# Ordered schema migrations. The database's PRAGMA user_version records the
+# last one applied, so checking the schema is a single header read.
+MIGRATIONS = [
+    (1, 'base schema', create_base_schema),
+    (2, 'account types on accounts', migrate_accounts),
+    (3, 'history indexes', create_history_indexes),
+    (4, 'account type catalog version', create_catalog_version),
+    (5, 'sessions and secrets', create_session_tables),
+    (6, 'interest scheduler', create_interest_schedule),
+    (7, 'daily balance snapshots', create_balance_snapshots),
+    (8, 'velocity limits', add_velocity_limits),
+    (9, 'recipient directory', create_recipient_directory),
+    (10, 'shard transfer outbox', create_transfer_outbox),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn):
+    """Return the schema version stored in the database header"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn):
+    """Apply pending migrations in order, each in its own transaction"""
+    current = get_schema_version(conn)
+    for version, name, apply in MIGRATIONS:
+        if version <= current:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            apply(conn, conn.cursor())
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Applied migration {version}: {name}")
+        current = version
+    return current
+
+def get_secret_key():
+    """The app secret shared by every worker and kept across restarts
+
+    SECUREBANK_SECRET_KEY wins if set; otherwise one is generated on first
+    use and stored in the app_secrets table.
+    """
+    if os.environ.get('SECUREBANK_SECRET_KEY'):
+        return os.environ['SECUREBANK_SECRET_KEY']
+    conn = get_db_connection()
+    try:
+        row = conn.execute("SELECT value FROM app_secrets WHERE name = 'secret_key'").fetchone()
+        if row:
+            return row['value']
+        conn.execute(
+            "INSERT OR IGNORE INTO app_secrets (name, value) VALUES ('secret_key', ?)",
+            (secrets.token_hex(32),)
+        )
+        conn.commit()
+        return conn.execute("SELECT value FROM app_secrets WHERE name = 'secret_key'").fetchone()['value']
+    finally:
+        conn.close()
+
+class SchemaOutOfDate(RuntimeError):
+    """The database has not been migrated to the version this code expects"""
+
+def check_schema():
+    """Cheap boot-time check: one header read per shard, no DDL and no writes"""
+    versions = []
+    for shard in shard_ids():
+        conn = get_db_connection(shard)
+        try:
+            versions.append(get_schema_version(conn))
+        finally:
+            conn.close()
+    version = min(versions)
+    if version < SCHEMA_VERSION:
+        raise SchemaOutOfDate(
+            f"Database schema is at version {version}, expected {SCHEMA_VERSION}. "
+            "Run `./securebank migrate` (or `./securebank init --demo` for a new database)."
+        )
+    return version
+
+def create_user(conn, account_number, full_name, email, password_hash, accounts):
+    """Insert a user and their accounts [(account_type_id, balance)]; returns the user id
+
+    conn must be on the user's shard (place_user(account_number)) and in a
+    write transaction; the ids are allocated so they route back to it.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO users (id, account_number, full_name, email, password_hash)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (new_id(conn, 'users', conn.shard), account_number, full_name, email, password_hash))
+    user_id = cursor.lastrowid
+    for account_type_id, balance in accounts:
         cursor.execute('''
-            INSERT INTO users (account_number, full_name, email, password_hash)
+            INSERT INTO accounts (id, user_id, account_type_id, balance)
             VALUES (?, ?, ?, ?)
-        ''', ('ACC002', 'Jane Smith', 'jane@example.com', hash_password('password123')))
-        user2_id = cursor.lastrowid
-        
-        # Create multiple accounts for user 2
-        accounts_user2 = [
-            (user2_id, account_type_map['Premium Checking'], 15000.00),
-            (user2_id, account_type_map['Savings'], 8000.00)
-        ]
-        cursor.executemany('''
-            INSERT INTO accounts (user_id, account_type_id, balance)
-            VALUES (?, ?, ?)
-        ''', accounts_user2)
-        
-        print("Demo accounts created!")
-        print("Account 1: ACC001 / password123")
-        print("- Checking Balance: $5,000")
-        print("- Savings Balance: $10,000")
-        print("- Fixed Deposit: $20,000")
-        print("\nAccount 2: ACC002 / password123")
-        print("- Premium Checking Balance: $15,000")
-        print("- Savings Balance: $8,000")
-    
-    conn.commit()
-    conn.close()
+        ''', (new_id(conn, 'accounts', conn.shard), user_id, account_type_id, balance))
+    return user_id
+
+def seed_demo_data():
+    """Create the two demo users and their accounts if there are no users yet"""
+    for shard in shard_ids():
+        conn = get_db_connection(shard)
+        try:
+            if conn.execute("SELECT COUNT(*) as count FROM users").fetchone()['count']:
+                return
+        finally:
+            conn.close()
+
+    demo_users = [
+        ('ACC001', 'John Doe', 'john@example.com',
+         [('Checking', 5000.00), ('Savings', 10000.00), ('Fixed Deposit', 20000.00)]),
+        ('ACC002', 'Jane Smith', 'jane@example.com',
+         [('Premium Checking', 15000.00), ('Savings', 8000.00)]),
+    ]
+    for account_number, full_name, email, accounts in demo_users:
+        # Each demo user goes to the shard its account number maps to
+        conn = get_db_connection(place_user(account_number))
+        try:
+            account_type_map = {row['type_name']: row['id'] for row in conn.execute("SELECT id, type_name FROM account_types")}
+            conn.execute('BEGIN IMMEDIATE')
+            create_user(conn, account_number, full_name, email, hash_password('password123'),
+                        [(account_type_map[type_name], balance) for type_name, balance in accounts])
+            conn.commit()
+        finally:
+            conn.close()
+
+    print("Demo accounts created!")
+    print("Account 1: ACC001 / password123")
+    print("- Checking Balance: $5,000")
+    print("- Savings Balance: $10,000")
+    print("- Fixed Deposit: $20,000")
+    print("\nAccount 2: ACC002 / password123")
+    print("- Premium Checking Balance: $15,000")
+    print("- Savings Balance: $8,000")
+
+def init_db(demo_data=False):
+    """Initialize the database: run migrations, create the app secret and
+    optionally seed the demo accounts. Meant to run once per deploy (see
+    cli.py), not in every worker. In sharded mode every shard is migrated."""
+    for shard in shard_ids():
+        conn = get_db_connection(shard)
+        try:
+            migrate(conn)
+        finally:
+            conn.close()
+    if demo_data:
+        seed_demo_data()
+    get_secret_key()
     print("Database initialized successfully!")
 
 if __name__ == "__main__":
-    init_db()
+    init_db(demo_data=True)
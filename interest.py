@@ -2,12 +2,33 @@
 # Interest is extra money added to accounts like Savings or Fixed Deposit, based on their balance and rate.
 # Interest calculation logic for SecureBank
 # Provides functions to calculate and apply interest to accounts
-from datetime import datetime, timedelta
+# The background scheduler (./securebank interest-scheduler) credits every due
+# account in short chunked transactions and records a checkpoint per chunk.
+import os
+import time
+from datetime import datetime, timedelta, timezone
+import database
+import ledger
 from database import get_db_connection
 
+# Background scheduler settings
+SCHEDULER_INTERVAL = float(os.environ.get('SECUREBANK_INTEREST_INTERVAL', '3600'))
+SCHEDULER_CHUNK_SIZE = int(os.environ.get('SECUREBANK_INTEREST_CHUNK_SIZE', '1000'))
+# The on-demand endpoint leaves accrual to the scheduler only while it has
+# reported progress this recently
+SCHEDULER_STALE_AFTER = float(os.environ.get('SECUREBANK_INTEREST_STALE', str(2 * SCHEDULER_INTERVAL)))
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+# When an account last earned interest; matches idx_accounts_interest_due
+DUE_AT = 'COALESCE(a.last_interest_calc_date, a.created_at)'
+
+def utc_now():
+    """The current UTC time without tzinfo, comparable with SQLite's CURRENT_TIMESTAMP"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 def calculate_interest(account_id):
     """Calculate interest for an account based on its type"""
-    conn = get_db_connection()
+    conn = get_db_connection(database.shard_for_account(account_id))
     
     # Get account details with its type
     account = conn.execute('''
@@ -28,7 +49,7 @@ def calculate_interest(account_id):
     
     # Calculate days since last interest calculation
     last_calc = datetime.strptime(account['last_interest_calc_date'], '%Y-%m-%d %H:%M:%S') if account['last_interest_calc_date'] else datetime.strptime(account['created_at'], '%Y-%m-%d %H:%M:%S')
-    days_since_last_calc = (datetime.now() - last_calc).days
+    days_since_last_calc = (utc_now() - last_calc).days
     
     if days_since_last_calc < 1:
         conn.close()
@@ -61,4 +82,232 @@ def calculate_interest(account_id):
     except Exception as e:
         conn.rollback()
         conn.close()
-        return False, f"Error calculating interest: {str(e)}"
\ No newline at end of file
+        return False, f"Error calculating interest: {str(e)}"
+
+def _create_interest_due(conn):
+    conn.execute('DROP TABLE IF EXISTS temp.interest_due')
+    conn.execute('''
+        CREATE TEMP TABLE interest_due (
+            account_id INTEGER PRIMARY KEY,
+            amount REAL NOT NULL,
+            type_name TEXT NOT NULL,
+            due_at TEXT
+        )
+    ''')
+
+def _apply_interest_due(conn, as_of_str):
+    """Credit everything in temp.interest_due and return its count and total"""
+    # Log the interest credits as transactions in bulk
+    conn.execute('''
+        INSERT INTO transactions (to_account_id, transaction_type, amount, description)
+        SELECT account_id, 'INTEREST', amount, 'Interest credit for ' || type_name || ' account'
+        FROM temp.interest_due
+    ''')
+
+    conn.execute('''
+        UPDATE accounts
+        SET balance = balance + (SELECT amount FROM temp.interest_due d WHERE d.account_id = accounts.id),
+            last_interest_calc_date = ?
+        WHERE id IN (SELECT account_id FROM temp.interest_due)
+    ''', (as_of_str,))
+
+    summary = conn.execute(
+        'SELECT COUNT(*) AS accounts, COALESCE(SUM(amount), 0) AS total FROM temp.interest_due'
+    ).fetchone()
+    conn.execute('DROP TABLE temp.interest_due')
+    return summary
+
+def accrue_all_interest(as_of=None):
+    """Accrue interest for every eligible account in one set-based transaction
+
+    Uses the same rules as calculate_interest (whole days since the last
+    calculation, simple daily interest at rate / 365) so the credited
+    amounts match the per-account path exactly. as_of is a naive UTC
+    datetime, like the timestamps SQLite stores; it defaults to now.
+    """
+    as_of = as_of or utc_now()
+    as_of_str = as_of.strftime(TIMESTAMP_FORMAT)
+    started = time.perf_counter()
+
+    conn = get_db_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        _create_interest_due(conn)
+
+        # Work out whole days and the interest owed entirely inside SQLite
+        conn.execute(f'''
+            INSERT INTO temp.interest_due (account_id, amount, type_name)
+            SELECT id, balance * (interest_rate / 365 / 100) * days, type_name
+            FROM (
+                SELECT a.id, a.balance, at.interest_rate, at.type_name,
+                       (CAST(strftime('%s', ?) AS INTEGER)
+                        - CAST(strftime('%s', {DUE_AT}) AS INTEGER)
+                       ) / 86400 AS days
+                FROM accounts a
+                JOIN account_types at ON a.account_type_id = at.id
+                WHERE at.interest_rate != 0
+            )
+            WHERE days >= 1
+        ''', (as_of_str,))
+
+        summary = _apply_interest_due(conn, as_of_str)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return {
+        'accounts': summary['accounts'],
+        'total_credited': float(summary['total']),
+        'elapsed': time.perf_counter() - started,
+    }
+
+def _parse_timestamp(value):
+    return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+def _accrue_chunk(conn, run, chunk_size):
+    """Credit the next chunk of due accounts after the run's checkpoint
+
+    Accounts are visited in (due date, id) order through the index, so the
+    checkpoint is simply the last key credited. It is saved in the same
+    transaction as the credits, so a crash never credits an account twice.
+    """
+    _create_interest_due(conn)
+    conn.execute(f'''
+        INSERT INTO temp.interest_due (account_id, amount, type_name, due_at)
+        SELECT a.id,
+               a.balance * (at.interest_rate / 365 / 100)
+               * ((CAST(strftime('%s', ?) AS INTEGER) - CAST(strftime('%s', {DUE_AT}) AS INTEGER)) / 86400),
+               at.type_name, {DUE_AT}
+        FROM accounts a
+        JOIN account_types at ON a.account_type_id = at.id
+        WHERE at.interest_rate != 0
+          AND {DUE_AT} BETWEEN ? AND ?
+          AND ({DUE_AT}, a.id) > (?, ?)
+        ORDER BY {DUE_AT}, a.id
+        LIMIT ?
+    ''', (run['as_of'], run['last_due_at'], run['cutoff'], run['last_due_at'], run['last_account_id'], chunk_size))
+
+    last = conn.execute(
+        'SELECT due_at, account_id FROM temp.interest_due ORDER BY due_at DESC, account_id DESC LIMIT 1'
+    ).fetchone()
+    summary = _apply_interest_due(conn, run['as_of'])
+    if last is None:
+        return 0, 0.0, None
+    conn.execute('''
+        UPDATE interest_runs
+        SET last_due_at = ?, last_account_id = ?, accounts = accounts + ?,
+            total_credited = total_credited + ?, updated_at = ?
+        WHERE id = ?
+    ''', (last['due_at'], last['account_id'], summary['accounts'], summary['total'], time.time(), run['id']))
+    return summary['accounts'], float(summary['total']), (last['due_at'], last['account_id'])
+
+def _start_run(conn, as_of):
+    """The unfinished run to resume, or a new one for as_of"""
+    row = conn.execute('SELECT * FROM interest_runs WHERE finished_at IS NULL ORDER BY id DESC LIMIT 1').fetchone()
+    resumed = row is not None
+    if not resumed:
+        now = time.time()
+        conn.execute(
+            'INSERT INTO interest_runs (as_of, started_at, updated_at) VALUES (?, ?, ?)',
+            (as_of.strftime(TIMESTAMP_FORMAT), now, now)
+        )
+        conn.commit()
+        row = conn.execute('SELECT * FROM interest_runs WHERE finished_at IS NULL ORDER BY id DESC LIMIT 1').fetchone()
+    run = dict(row)
+    # Accounts are due once a whole day has passed since their last credit
+    run['cutoff'] = (_parse_timestamp(run['as_of']) - timedelta(days=1)).strftime(TIMESTAMP_FORMAT)
+    return run, resumed
+
+def _oldest_due(conn, cutoff):
+    row = conn.execute(f'''
+        SELECT {DUE_AT} AS due_at
+        FROM accounts a
+        JOIN account_types at ON a.account_type_id = at.id
+        WHERE at.interest_rate != 0 AND {DUE_AT} <= ?
+        ORDER BY {DUE_AT}
+        LIMIT 1
+    ''', (cutoff,)).fetchone()
+    return _parse_timestamp(row['due_at']) if row else None
+
+def run_scheduled_accrual(as_of=None, chunk_size=None):
+    """One scheduler pass: credit every account due as of as_of in chunks
+
+    Each chunk is its own short BEGIN IMMEDIATE transaction (retried like
+    ledger writes when the database is busy), so online writers only ever
+    wait for one chunk. An interrupted pass is resumed, with its original
+    as_of, from the last saved checkpoint. Returns the pass's throughput and
+    lag: how long the most overdue account had been waiting when it started.
+    """
+    chunk_size = chunk_size or SCHEDULER_CHUNK_SIZE
+    started = time.perf_counter()
+    conn = database.connect()
+    try:
+        run, resumed = _start_run(conn, as_of or utc_now())
+        oldest = _oldest_due(conn, run['cutoff'])
+        lag = (_parse_timestamp(run['cutoff']) - oldest).total_seconds() if oldest else 0.0
+        if resumed:
+            print(f"Resuming interest run {run['id']} (as of {run['as_of']}) after account {run['last_account_id']}")
+
+        accounts, total, chunks = 0, 0.0, 0
+        while True:
+            credited, amount, checkpoint = ledger.run_in_transaction(conn, _accrue_chunk, run, chunk_size)
+            if not credited:
+                break
+            run['last_due_at'], run['last_account_id'] = checkpoint
+            accounts += credited
+            total += amount
+            chunks += 1
+            print(f"  credited {accounts} accounts (up to account {run['last_account_id']})")
+
+        conn.execute('UPDATE interest_runs SET finished_at = ?, updated_at = ? WHERE id = ?',
+                     (time.time(), time.time(), run['id']))
+        conn.commit()
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    return {
+        'run_id': run['id'],
+        'as_of': run['as_of'],
+        'resumed': resumed,
+        'accounts': accounts,
+        'total_credited': total,
+        'chunks': chunks,
+        'elapsed': elapsed,
+        'accounts_per_second': accounts / elapsed if elapsed else 0.0,
+        'lag_seconds': lag,
+    }
+
+def run_scheduler(interval=None, chunk_size=None, once=False):
+    """Run a scheduler pass every interval seconds, printing a report for each"""
+    interval = SCHEDULER_INTERVAL if interval is None else interval
+    while True:
+        started = time.monotonic()
+        summary = run_scheduled_accrual(chunk_size=chunk_size)
+        print(f"Interest run {summary['run_id']} as of {summary['as_of']}: "
+              f"{summary['accounts']} accounts, ${summary['total_credited']:.2f} credited in "
+              f"{summary['chunks']} chunks, {summary['elapsed']:.2f}s "
+              f"({summary['accounts_per_second']:.0f} accounts/s), lag {summary['lag_seconds']:.0f}s")
+        if once:
+            return summary
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+def scheduler_status(conn):
+    """The latest scheduler run, or None if the scheduler never ran
+
+    `active` says whether the scheduler has reported progress within
+    SCHEDULER_STALE_AFTER seconds, i.e. whether it can be relied on.
+    """
+    row = conn.execute(
+        'SELECT as_of, finished_at, updated_at FROM interest_runs ORDER BY id DESC LIMIT 1'
+    ).fetchone()
+    if row is None:
+        return None
+    return {
+        'as_of': row['as_of'],
+        'running': row['finished_at'] is None,
+        'active': time.time() - row['updated_at'] <= SCHEDULER_STALE_AFTER,
+    }
@@ -0,0 +1,344 @@
+# This file moves money between accounts.
+# Deposits, withdrawals and transfers all go through here so that balances stay
+# correct even when many requests change the same account at the same time.
+# Money movement core for SecureBank
+# Each operation is one short write transaction (BEGIN IMMEDIATE) with guarded
+# UPDATEs, retried with jittered backoff when SQLite reports the database busy.
+# In group-commit mode (SECUREBANK_GROUP_COMMIT=1) deposits, withdrawals and
+# transfers are instead handed to one writer thread per worker, which applies
+# everything queued within a few milliseconds in a single transaction.
+# In sharded mode a transfer to an account on another shard debits here and
+# leaves an outbox row in the same transaction; outbox.py delivers it.
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+import database
+
+MAX_ATTEMPTS = int(os.environ.get('SECUREBANK_WRITE_ATTEMPTS', '5'))
+BACKOFF_BASE = float(os.environ.get('SECUREBANK_WRITE_BACKOFF', '0.01'))
+BACKOFF_MAX = 0.5
+
+GROUP_COMMIT = os.environ.get('SECUREBANK_GROUP_COMMIT', '0') == '1'
+# How long the writer waits for more operations after the first, and the most
+# operations it puts in one transaction. With no delay a batch is whatever
+# queued up while the previous one was committing; a delay only pays off when
+# commits (fsyncs) are slow
+GROUP_COMMIT_DELAY = float(os.environ.get('SECUREBANK_GROUP_COMMIT_DELAY_MS', '0')) / 1000
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get('SECUREBANK_GROUP_COMMIT_MAX_BATCH', '64'))
+# Seconds a caller waits for the writer to pick up its operation (SECUREBANK_GROUP_COMMIT_TIMEOUT)
+GROUP_COMMIT_TIMEOUT = float(os.environ.get('SECUREBANK_GROUP_COMMIT_TIMEOUT', '30'))
+
+class LedgerError(Exception):
+    """Base class for money movement failures"""
+
+class AccountNotFound(LedgerError):
+    """The account to credit or debit does not exist"""
+
+class InsufficientFunds(LedgerError):
+    """The debit would take the account below its minimum balance"""
+
+class DatabaseBusy(LedgerError):
+    """The write lock could not be taken after all retries"""
+
+def is_busy_error(error):
+    message = str(error).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+def run_in_transaction(conn, operation, *args):
+    """Run operation(conn, *args) inside BEGIN IMMEDIATE, retrying on SQLITE_BUSY"""
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            result = operation(conn, *args)
+            conn.commit()
+            return result
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if not is_busy_error(e):
+                raise
+            if attempt == MAX_ATTEMPTS - 1:
+                raise DatabaseBusy('Database is busy, please try again') from e
+            # Full jitter so competing workers do not retry in lockstep
+            time.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+def _balance(conn, account_id):
+    return float(conn.execute('SELECT balance FROM accounts WHERE id = ?', (account_id,)).fetchone()['balance'])
+
+def _credit(conn, account_id, amount):
+    updated = conn.execute(
+        'UPDATE accounts SET balance = balance + ? WHERE id = ?',
+        (amount, account_id)
+    ).rowcount
+    if not updated:
+        raise AccountNotFound(f'Account {account_id} not found')
+
+def _debit(conn, account_id, amount, minimum_balance):
+    # The balance check and the write are one statement, so a concurrent
+    # writer can never slip in between them
+    updated = conn.execute(
+        'UPDATE accounts SET balance = balance - ? WHERE id = ? AND balance - ? >= ?',
+        (amount, account_id, amount, minimum_balance)
+    ).rowcount
+    if not updated:
+        if conn.execute('SELECT 1 FROM accounts WHERE id = ?', (account_id,)).fetchone() is None:
+            raise AccountNotFound(f'Account {account_id} not found')
+        raise InsufficientFunds(minimum_balance)
+
+def _record(conn, from_account_id, to_account_id, transaction_type, amount, description):
+    conn.execute('''
+        INSERT INTO transactions (from_account_id, to_account_id, transaction_type, amount, description)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (from_account_id, to_account_id, transaction_type, amount, description))
+
+def _deposit(conn, account_id, amount, description):
+    _credit(conn, account_id, amount)
+    _record(conn, None, account_id, 'DEPOSIT', amount, description)
+    return _balance(conn, account_id)
+
+def _withdraw(conn, account_id, amount, minimum_balance, description, guard=None):
+    if guard is not None:
+        guard(conn, amount)
+    _debit(conn, account_id, amount, minimum_balance)
+    _record(conn, account_id, None, 'WITHDRAWAL', amount, description)
+    return _balance(conn, account_id)
+
+def is_remote(conn, account_id):
+    """Whether account_id lives on another shard than conn"""
+    return database.SHARDS > 1 and database.shard_for_account(account_id) != conn.shard
+
+def _send(conn, from_account_id, to_account_id, amount, description):
+    conn.execute('''
+        INSERT INTO transfer_outbox (from_account_id, to_account_id, amount, description)
+        VALUES (?, ?, ?, ?)
+    ''', (from_account_id, to_account_id, amount, description))
+
+def _transfer(conn, from_account_id, to_account_id, amount, minimum_balance, description, guard=None):
+    if guard is not None:
+        guard(conn, amount)
+    _debit(conn, from_account_id, amount, minimum_balance)
+    if is_remote(conn, to_account_id):
+        _send(conn, from_account_id, to_account_id, amount, description)
+    else:
+        _credit(conn, to_account_id, amount)
+    _record(conn, from_account_id, to_account_id, 'TRANSFER', amount, description)
+    return _balance(conn, from_account_id)
+
+class GroupCommitter:
+    """Single writer thread that commits queued operations in batches
+
+    Callers block on a future until the transaction holding their operation
+    has committed. Each operation runs under its own savepoint, so one that
+    fails (say InsufficientFunds) is rolled back and reported to its caller
+    without affecting the others in the batch.
+    """
+
+    def __init__(self, delay=GROUP_COMMIT_DELAY, max_batch=GROUP_COMMIT_MAX_BATCH, shard=0):
+        self.delay = delay
+        self.shard = shard
+        self.max_batch = max(max_batch, 1)
+        self.pid = os.getpid()
+        self._queue = queue.Queue()
+        self.batches = 0
+        self.operations = 0
+        self._thread = threading.Thread(target=self._run, name='securebank-group-commit', daemon=True)
+        self._thread.start()
+
+    def submit(self, operation, *args):
+        """Queue operation(conn, *args) and wait for its committed result
+
+        Raises DatabaseBusy if the writer has not picked the operation up
+        within GROUP_COMMIT_TIMEOUT; it is cancelled then and never runs.
+        Once picked up it is already in a transaction, so the caller waits
+        for that transaction's outcome instead.
+        """
+        future = Future()
+        self._queue.put((operation, args, future))
+        try:
+            return future.result(timeout=GROUP_COMMIT_TIMEOUT)
+        except FutureTimeout:
+            if future.cancel():
+                raise DatabaseBusy('Database is busy, please try again')
+        return future.result()
+
+    def _take(self, block=True, timeout=None):
+        # Next operation the caller has not cancelled, marked as running
+        while True:
+            item = self._queue.get(block, timeout)
+            if item[2].set_running_or_notify_cancel():
+                return item
+
+    def _collect(self):
+        batch = [self._take()]
+        deadline = time.monotonic() + self.delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._take(timeout=remaining) if remaining > 0 else self._take(block=False))
+            except queue.Empty:
+                break
+        return batch
+
+    @staticmethod
+    def _apply(conn, batch):
+        results = []
+        for operation, args, _ in batch:
+            conn.execute('SAVEPOINT operation')
+            try:
+                results.append((True, operation(conn, *args)))
+            except (LedgerError, sqlite3.IntegrityError) as e:
+                conn.execute('ROLLBACK TO operation')
+                results.append((False, e))
+            conn.execute('RELEASE operation')
+        return results
+
+    def _run(self):
+        conn = database.connect(database.shard_path(self.shard))
+        conn.shard = self.shard
+        while True:
+            batch = self._collect()
+            try:
+                results = run_in_transaction(conn, self._apply, batch)
+            except Exception as e:
+                # Nothing was committed; every caller in the batch gets the error
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.operations += len(batch)
+            for (_, _, future), (ok, value) in zip(batch, results):
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'operations': self.operations,
+            'batch_size_avg': self.operations / self.batches if self.batches else 0.0,
+            'queued': self._queue.qsize(),
+        }
+
+_committers = {}
+_committer_lock = threading.Lock()
+
+def get_committer(shard=0):
+    """This process's group committer for a shard, recreated after a fork"""
+    committer = _committers.get(shard)
+    if committer is None or committer.pid != os.getpid():
+        with _committer_lock:
+            committer = _committers.get(shard)
+            if committer is None or committer.pid != os.getpid():
+                committer = _committers[shard] = GroupCommitter(shard=shard)
+    return committer
+
+def _execute(conn, operation, *args):
+    if GROUP_COMMIT:
+        return get_committer(conn.shard).submit(operation, *args)
+    return run_in_transaction(conn, operation, *args)
+
+def deposit(conn, account_id, amount, description):
+    """Credit an account; returns the new balance"""
+    return _execute(conn, _deposit, account_id, amount, description)
+
+def withdraw(conn, account_id, amount, minimum_balance, description, guard=None):
+    """Debit an account if it stays at or above minimum_balance; returns the new balance
+
+    guard(conn, amount), if given, runs first inside the same transaction
+    and may reject the debit by raising a LedgerError (see velocity.guard).
+    """
+    return _execute(conn, _withdraw, account_id, amount, minimum_balance, description, guard)
+
+def transfer(conn, from_account_id, to_account_id, amount, minimum_balance, description, guard=None):
+    """Move money between accounts atomically; returns the source's new balance
+
+    guard works as in withdraw().
+    """
+    return _execute(conn, _transfer, from_account_id, to_account_id, amount, minimum_balance, description, guard)
+
+def _load_balances(conn, account_ids):
+    balances = {}
+    ids = list(account_ids)
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        placeholders = ','.join('?' * len(chunk))
+        for row in conn.execute(f'SELECT id, balance FROM accounts WHERE id IN ({placeholders})', chunk):
+            balances[row['id']] = float(row['balance'])
+    return balances
+
+def _check_guard(conn, guard, amount, pending):
+    if guard is None:
+        return None
+    try:
+        guard(conn, amount, pending)
+    except LedgerError as e:
+        return e
+    return None
+
+def _apply_batch(conn, transfers, atomic):
+    # Balances read after BEGIN IMMEDIATE cannot change underneath us, so the
+    # whole batch can be checked in memory and written with two executemany calls
+    balances = _load_balances(conn, {t['from_account_id'] for t in transfers} | {t['to_account_id'] for t in transfers})
+    results = []
+    rows = []
+    outbox = []
+    # Amounts accepted so far, for guards that limit totals
+    pending = {}
+    for t in transfers:
+        source, target, amount = t['from_account_id'], t['to_account_id'], t['amount']
+        remote = is_remote(conn, target)
+        if source not in balances or (target not in balances and not remote):
+            results.append(AccountNotFound('Account not found'))
+        elif balances[source] - amount < t['minimum_balance']:
+            results.append(InsufficientFunds(t['minimum_balance']))
+        elif (rejection := _check_guard(conn, t.get('guard'), amount, pending)) is not None:
+            results.append(rejection)
+        else:
+            balances[source] -= amount
+            if remote:
+                outbox.append((source, target, amount, t['description']))
+            else:
+                balances[target] += amount
+            rows.append((source, target, 'TRANSFER', amount, t['description']))
+            results.append(balances[source])
+
+    if atomic and len(rows) != len(transfers):
+        return results, False
+
+    touched = {row[0] for row in rows} | {row[1] for row in rows if row[1] in balances}
+    conn.executemany('UPDATE accounts SET balance = ? WHERE id = ?',
+                     [(balances[account_id], account_id) for account_id in touched])
+    conn.executemany('''
+        INSERT INTO transactions (from_account_id, to_account_id, transaction_type, amount, description)
+        VALUES (?, ?, ?, ?, ?)
+    ''', rows)
+    if outbox:
+        conn.executemany('''
+            INSERT INTO transfer_outbox (from_account_id, to_account_id, amount, description)
+            VALUES (?, ?, ?, ?)
+        ''', outbox)
+    return results, True
+
+def transfer_batch(conn, transfers, atomic=True):
+    """Apply many transfers in one transaction
+
+    `transfers` is a list of dicts with from_account_id, to_account_id,
+    amount, minimum_balance, description and optionally a guard (as in
+    withdraw(), also passed a dict of amounts accepted earlier in the
+    batch), applied in order. Returns
+    (results, applied): one entry per transfer, either the source's new
+    balance or the LedgerError that rejected it. In atomic mode a single
+    rejection means nothing is written and applied is False. Transfers to
+    accounts on another shard leave outbox rows for outbox.deliver().
+    """
+    return run_in_transaction(conn, _apply_batch, transfers, atomic)
@@ -45,19 +45,47 @@
 # API: Withdraw funds from the user's Checking account only
 # API: Transfer funds between user's own accounts or to another user's account
 # Flask app entry point
-git credential-manager-core erasefrom flask import Flask, render_template, request, jsonify, session, redirect, url_for
-from database import get_db_connection, init_db
-from werkzeug.security import check_password_hash, generate_password_hash
+from flask import Flask, Response, render_template, request, jsonify, session, redirect, url_for, stream_with_context
+import database
+from database import get_db_connection, get_read_connection
+import metrics
+import passwords
+import sessions
+import services
 from datetime import datetime
-from interest import calculate_interest
-import os
+from catalog import catalog
+import ledger
+import velocity
+from recipients import directory as recipient_directory
+import csv
+import heapq
+import io
+import json
 
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
 
-# Initialize database on startup
+# Pooled connections are checked out per app context and returned on teardown
+database.init_app(app)
+
+# Workers only check the schema version; setup and migrations run once per
+# deploy through `./securebank init` / `./securebank migrate`
 with app.app_context():
-    init_db()
+    database.check_schema()
+    # Shared by all workers and kept across restarts
+    app.secret_key = database.get_secret_key()
+
+# Sessions live in the database with a per-worker in-memory cache
+sessions.init_app(app)
+
+# Per-route latency histograms and per-query timings, exported at /metrics
+metrics.init_app(app)
+
+# Start the password verifier pool before any request threads exist
+passwords.get_verifier()
+
+def user_shard():
+    """Shard holding the logged-in user's accounts (always 0 unless sharded)"""
+    return database.shard_for_user(session['user_id'])
 
 @app.route('/')
 def index():
@@ -80,14 +108,18 @@ def login():
         if not account_number or not password:
             return jsonify({'success': False, 'message': 'Account number and password required'}), 400
         
-        conn = get_db_connection()
-        user = conn.execute(
-            'SELECT * FROM users WHERE account_number = ?',
-            (account_number,)
-        ).fetchone()
-        conn.close()
+        # The slow hash check runs in the verifier pool, not on this worker
+        conn = get_db_connection(database.find_user_shard(account_number))
+        try:
+            user = services.authenticate(conn, account_number, password)
+        except services.ServiceError as e:
+            return jsonify({'success': False, 'message': e.message}), e.status
+        finally:
+            conn.close()
         
-        if user and check_password_hash(user['password_hash'], password):
+        if user:
+            # New session id on login, so an id planted beforehand stays anonymous
+            session.rotate()
             session['user_id'] = user['id']
             session['account_number'] = user['account_number']
             session['full_name'] = user['full_name']
@@ -113,132 +145,257 @@ def dashboard():
                          full_name=session.get('full_name'),
                          account_number=session.get('account_number'))
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics for this worker
+
+    Only for scrapers holding SECUREBANK_METRICS_TOKEN; without it the
+    route does not exist, since the labels name every route and statement.
+    """
+    if not metrics.METRICS_TOKEN:
+        return jsonify({'error': 'Not found'}), 404
+    if not metrics.authorized(request.headers.get('Authorization')):
+        return jsonify({'error': 'Not authorized'}), 401
+    gauges = {f'securebank_db_pool_{name}': value for name, value in database.pool_stats().items()}
+    gauges.update({f'securebank_db_read_pool_{name}': value for name, value in database.read_pool_stats().items()})
+    gauges.update({f'securebank_sessions_{name}': value for name, value in app.session_interface.stats().items()})
+    if ledger.GROUP_COMMIT:
+        gauges.update({f'securebank_group_commit_{name}': value for name, value in ledger.get_committer().stats().items()})
+    gauges.update({f'securebank_velocity_{name}': value for name, value in velocity.get_limiter().stats().items()})
+    gauges.update({f'securebank_recipients_{name}': value for name, value in recipient_directory.stats().items()})
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.errorhandler(services.ServiceError)
+def service_error(e):
+    """Business rule failures become JSON errors with their status"""
+    return jsonify({'error': e.message}), e.status
+
 @app.route('/api/account-info')
 def get_account_info():
     """Get user account information"""
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    conn = get_db_connection()
-    # First check if the account_type_id column exists
-    cursor = conn.cursor()
-    cursor.execute("PRAGMA table_info(accounts)")
-    columns = [column[1] for column in cursor.fetchall()]
-    
-    if 'account_type_id' in columns:
-        # New schema
-        accounts = conn.execute('''
-            SELECT a.*, at.type_name, at.interest_rate, at.minimum_balance, at.description
-            FROM accounts a
-            JOIN account_types at ON a.account_type_id = at.id
-            WHERE a.user_id = ?
-        ''', (session['user_id'],)).fetchall()
-        
-        if accounts:
-            result = {
-                'accounts': [{
-                    'account_id': acc['id'],
-                    'account_type': acc['type_name'],
-                    'balance': float(acc['balance']),
-                    'interest_rate': float(acc['interest_rate']),
-                    'minimum_balance': float(acc['minimum_balance']),
-                    'description': acc['description'],
-                    'created_at': acc['created_at']
-                } for acc in accounts]
-            }
-    else:
-        # Old schema
-        account = conn.execute(
-            'SELECT * FROM accounts WHERE user_id = ?',
-            (session['user_id'],)
-        ).fetchone()
-        
-        if account:
-            result = {
-                'accounts': [{
-                    'account_id': account['id'],
-                    'account_type': account['account_type'],
-                    'balance': float(account['balance']),
-                    'created_at': account['created_at']
-                }]
-            }
-    
-    conn.close()
-    
-    if 'result' in locals():
-        return jsonify(result)
-    return jsonify({'error': 'No accounts found'}), 404
+    # The schema is brought up to date by database.migrate at startup,
+    # so there is no need to inspect the accounts table here
+    conn = get_read_connection(user_shard())
+    try:
+        return jsonify(services.account_info(conn, session['user_id']))
+    finally:
+        conn.close()
+
+@app.route('/api/dashboard')
+def get_dashboard():
+    """Accounts, total balance and recent transactions in one response
+
+    Replaces the separate account-info and transactions calls the dashboard
+    page used to make on every load.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    conn = get_read_connection(user_shard())
+    try:
+        return jsonify(services.dashboard(conn, session['user_id']))
+    finally:
+        conn.close()
 
 @app.route('/api/account-types')
 def get_account_types():
-    """Get all available account types"""
-    conn = get_db_connection()
-    types = conn.execute('SELECT * FROM account_types').fetchall()
-    conn.close()
-    
-    return jsonify({
-        'account_types': [{
-            'id': t['id'],
-            'name': t['type_name'],
-            'interest_rate': float(t['interest_rate']),
-            'minimum_balance': float(t['minimum_balance']),
-            'description': t['description']
-        } for t in types]
-    })
+    """Get all available account types
+
+    Served from the catalog with an ETag tied to the catalog version, so
+    clients revalidating an unchanged list get a 304.
+    """
+    catalog.refresh()
+    response = jsonify({'account_types': catalog.public()})
+    response.set_etag(f'account-types-{catalog.version}')
+    return response.make_conditional(request)
 
 @app.route('/api/accounts/<int:account_id>/calculate-interest', methods=['POST'])
 def calculate_account_interest(account_id):
-    """Calculate and apply interest for a specific account"""
+    """Interest status for a specific account (applied here when no scheduler runs)"""
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
     # Verify account belongs to user
-    conn = get_db_connection()
-    account = conn.execute(
-        'SELECT * FROM accounts WHERE id = ? AND user_id = ?',
-        (account_id, session['user_id'])
-    ).fetchone()
-    conn.close()
-    
-    if not account:
-        return jsonify({'error': 'Account not found or access denied'}), 404
-    
-    success, message = calculate_interest(account_id)
-    if success:
-        return jsonify({'message': message})
-    return jsonify({'error': message}), 400
+    conn = get_db_connection(user_shard())
+    try:
+        return jsonify(services.calculate_account_interest(conn, session['user_id'], account_id))
+    finally:
+        conn.close()
+
+@app.route('/api/accounts/<int:account_id>/interest-projection')
+def get_interest_projection(account_id):
+    """Projected balances of one of the user's accounts over the coming years"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    conn = get_read_connection(user_shard())
+    try:
+        return jsonify(services.interest_projection(
+            conn, session['user_id'], account_id, request.args.get('years'),
+            request.args.get('compounding'), request.args.get('rate_schedule')))
+    finally:
+        conn.close()
+
+@app.route('/api/accounts/<int:account_id>/balance-history')
+def get_balance_history(account_id):
+    """Daily closing balances of one of the user's accounts (from / to dates)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    conn = get_read_connection(user_shard())
+    try:
+        return jsonify(services.balance_history(
+            conn, session['user_id'], account_id, request.args.get('from'), request.args.get('to')))
+    finally:
+        conn.close()
 
 @app.route('/api/transactions')
 def get_transactions():
-    """Get user transaction history"""
+    """Get user transaction history across all of the user's accounts
+
+    Pages newest first. Pass `limit` (default 20, max 100) and, for the next
+    page, `before` set to the X-Next-Cursor header of the previous response.
+    """
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
-    
-    conn = get_db_connection()
-    account = conn.execute(
+
+    conn = get_read_connection(user_shard())
+    try:
+        transactions, next_cursor = services.transactions_page(
+            conn, session['user_id'], request.args.get('limit'), request.args.get('before'))
+    finally:
+        conn.close()
+
+    response = jsonify(transactions)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_COLUMNS = ['id', 'created_at', 'transaction_type', 'from_account_id', 'to_account_id', 'amount', 'description']
+
+def parse_export_date(value, end_of_day=False):
+    """Accept 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS' and return a timestamp string"""
+    if len(value) == 10:
+        datetime.strptime(value, '%Y-%m-%d')
+        return value + (' 23:59:59' if end_of_day else ' 00:00:00')
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d %H:%M:%S')
+
+def iter_cursor(cursor, size=EXPORT_CHUNK_SIZE):
+    """Yield rows from a cursor in fetchmany chunks"""
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield from rows
+
+def iter_transactions(conn, account_ids, start=None, end=None):
+    """Stream transactions for the given accounts oldest first
+
+    Every account/direction pair is an ordered index range scan; the scans
+    are merged lazily so memory does not grow with the size of the history.
+    """
+    clause = ''
+    params = []
+    if start:
+        clause += ' AND created_at >= ?'
+        params.append(start)
+    if end:
+        clause += ' AND created_at <= ?'
+        params.append(end)
+
+    streams = []
+    for account_id in account_ids:
+        for column in ('from_account_id', 'to_account_id'):
+            cursor = conn.execute(f'''
+                SELECT * FROM transactions
+                WHERE {column} = ?{clause}
+                ORDER BY created_at, id
+            ''', (account_id, *params))
+            streams.append(iter_cursor(cursor))
+
+    last_id = None
+    for row in heapq.merge(*streams, key=lambda t: (t['created_at'], t['id'])):
+        # Transfers between the user's own accounts show up in two scans
+        if row['id'] == last_id:
+            continue
+        last_id = row['id']
+        yield row
+
+def export_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for count, row in enumerate(rows, 1):
+        writer.writerow([row[column] for column in EXPORT_COLUMNS])
+        if count % EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def export_ndjson(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps({column: row[column] for column in EXPORT_COLUMNS}))
+        if len(chunk) == EXPORT_CHUNK_SIZE:
+            yield '\n'.join(chunk) + '\n'
+            chunk = []
+    if chunk:
+        yield '\n'.join(chunk) + '\n'
+
+EXPORT_FORMATS = {
+    'csv': (export_csv, 'text/csv'),
+    'ndjson': (export_ndjson, 'application/x-ndjson'),
+}
+
+@app.route('/api/transactions/export')
+def export_transactions():
+    """Stream the user's full transaction history as CSV or NDJSON
+
+    Query parameters: format (csv or ndjson), from / to (dates, inclusive)
+    and account_id to restrict the export to one account.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': 'Format must be csv or ndjson'}), 400
+
+    try:
+        start = parse_export_date(request.args['from']) if request.args.get('from') else None
+        end = parse_export_date(request.args['to'], end_of_day=True) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid date format, use YYYY-MM-DD'}), 400
+
+    conn = get_read_connection(user_shard())
+    account_ids = [row['id'] for row in conn.execute(
         'SELECT id FROM accounts WHERE user_id = ?',
         (session['user_id'],)
-    ).fetchone()
-    
-    if not account:
-        conn.close()
+    ).fetchall()]
+
+    account_id = request.args.get('account_id')
+    if account_id:
+        try:
+            account_id = int(account_id)
+        except ValueError:
+            return jsonify({'error': 'Invalid account id'}), 400
+        if account_id not in account_ids:
+            return jsonify({'error': 'Account not found or access denied'}), 404
+        account_ids = [account_id]
+
+    if not account_ids:
         return jsonify({'error': 'Account not found'}), 404
-    
-    transactions = conn.execute('''
-        SELECT * FROM transactions 
-        WHERE from_account_id = ? OR to_account_id = ?
-        ORDER BY created_at DESC
-        LIMIT 20
-    ''', (account['id'], account['id'])).fetchall()
-    conn.close()
-    
-    return jsonify([{
-        'id': t['id'],
-        'type': t['transaction_type'],
-        'amount': float(t['amount']),
-        'description': t['description'],
-        'created_at': t['created_at']
-    } for t in transactions])
+
+    render, mimetype = EXPORT_FORMATS[export_format]
+    body = stream_with_context(render(iter_transactions(conn, account_ids, start, end)))
+    response = Response(body, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=transactions.{export_format}'
+    return response
 
 @app.route('/api/deposit', methods=['POST'])
 def deposit():
@@ -250,47 +407,11 @@ def deposit():
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    data = request.get_json(silent=True)
-    if not data:
-        return jsonify({'error': 'Invalid request'}), 400
-    
+    conn = get_db_connection(user_shard())
     try:
-        amount = float(data.get('amount', 0))
-    except (ValueError, TypeError):
-        return jsonify({'error': 'Invalid amount format'}), 400
-    
-    if amount <= 0:
-        return jsonify({'error': 'Amount must be greater than zero'}), 400
-    
-    conn = get_db_connection()
-    # Get the checking account
-    account = conn.execute('''
-        SELECT a.* FROM accounts a
-        JOIN account_types at ON a.account_type_id = at.id
-        WHERE a.user_id = ? AND at.type_name = 'Checking'
-    ''', (session['user_id'],)).fetchone()
-    
-    if not account:
+        return jsonify(services.deposit(conn, session['user_id'], request.get_json(silent=True)))
+    finally:
         conn.close()
-        return jsonify({'error': 'Checking account not found'}), 404
-    
-    # Update balance
-    new_balance = float(account['balance']) + amount
-    conn.execute(
-        'UPDATE accounts SET balance = ? WHERE id = ?',
-        (new_balance, account['id'])
-    )
-    
-    # Record transaction
-    conn.execute('''
-        INSERT INTO transactions (to_account_id, transaction_type, amount, description)
-        VALUES (?, ?, ?, ?)
-    ''', (account['id'], 'DEPOSIT', amount, 'Deposit to Checking account'))
-    
-    conn.commit()
-    conn.close()
-    
-    return jsonify({'success': True, 'new_balance': new_balance, 'message': f'Successfully deposited ${amount:.2f} to Checking account'})
 
 @app.route('/api/withdraw', methods=['POST'])
 def withdraw():
@@ -303,51 +424,11 @@ def withdraw():
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    data = request.get_json(silent=True)
-    if not data:
-        return jsonify({'error': 'Invalid request'}), 400
-    
+    conn = get_db_connection(user_shard())
     try:
-        amount = float(data.get('amount', 0))
-    except (ValueError, TypeError):
-        return jsonify({'error': 'Invalid amount format'}), 400
-    
-    if amount <= 0:
-        return jsonify({'error': 'Amount must be greater than zero'}), 400
-    
-    conn = get_db_connection()
-    # Get the checking account
-    account = conn.execute('''
-        SELECT a.*, at.minimum_balance FROM accounts a
-        JOIN account_types at ON a.account_type_id = at.id
-        WHERE a.user_id = ? AND at.type_name = 'Checking'
-    ''', (session['user_id'],)).fetchone()
-    
-    if not account:
-        conn.close()
-        return jsonify({'error': 'Checking account not found'}), 404
-    
-    new_balance = float(account['balance']) - amount
-    if new_balance < float(account['minimum_balance']):
+        return jsonify(services.withdraw(conn, session['user_id'], request.get_json(silent=True)))
+    finally:
         conn.close()
-        return jsonify({'error': f'Cannot withdraw: minimum balance for Checking is ${account["minimum_balance"]:.2f}'}), 400
-    
-    # Update balance
-    conn.execute(
-        'UPDATE accounts SET balance = ? WHERE id = ?',
-        (new_balance, account['id'])
-    )
-    
-    # Record transaction
-    conn.execute('''
-        INSERT INTO transactions (from_account_id, transaction_type, amount, description)
-        VALUES (?, ?, ?, ?)
-    ''', (account['id'], 'WITHDRAWAL', amount, 'Withdrawal from Checking account'))
-    
-    conn.commit()
-    conn.close()
-    
-    return jsonify({'success': True, 'new_balance': new_balance, 'message': f'Successfully withdrew ${amount:.2f} from Checking account'})
 
 @app.route('/api/transfer', methods=['POST'])
 def transfer():
@@ -356,117 +437,113 @@ def transfer():
     # External: Send money to another user's account number
     # The system checks that you have enough money and that your account doesn't go below the minimum required balance.
     # If you try to send money to yourself, it will show an error.
-# Flask app entry point
-# This starts the web server so users can access the bank online.
-    # Handles both internal (between user's own accounts) and external (to another user) transfers
     # Enforces minimum balance for all account types
     """Handle both internal and external transfers"""
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
+    conn = get_db_connection(user_shard())
+    try:
+        return jsonify(services.transfer(conn, session['user_id'], session['account_number'],
+                                         request.get_json(silent=True)))
+    finally:
+        conn.close()
+
+@app.route('/api/deposit-account', methods=['POST'])
+def set_deposit_account():
+    """Choose the account that receives external transfers to this user
+
+    Body: {"accountType": "Savings"}. Without a choice, transfers go to the
+    Checking account (or the oldest account if there is no Checking).
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    conn = get_db_connection(user_shard())
+    try:
+        return jsonify(services.set_deposit_account(conn, session['user_id'], request.get_json(silent=True)))
+    finally:
+        conn.close()
+
+MAX_BATCH_TRANSFERS = 5000
+
+@app.route('/api/transfers/batch', methods=['POST'])
+def transfer_batch():
+    """Apply many transfers in a single transaction
+
+    Body: {"transfers": [...], "mode": "atomic" | "best_effort"}. Each item
+    takes the same fields as /api/transfer. In atomic mode (the default)
+    either every transfer is applied or none is; in best_effort mode the
+    valid ones are applied. The response has one result per item.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
     data = request.get_json(silent=True)
-    if not data or 'amount' not in data or 'transferType' not in data or 'fromAccountType' not in data:
-        return jsonify({'error': 'Amount, transfer type, and source account type are required'}), 400
-    
-    amount = float(data['amount'])
-    transfer_type = data['transferType']
-    from_account_type = data['fromAccountType']
-    
-    if amount <= 0:
-        return jsonify({'error': 'Amount must be positive'}), 400
-    
-    conn = get_db_connection()
+    if not isinstance(data, dict) or not isinstance(data.get('transfers'), list) or not data['transfers']:
+        return jsonify({'error': 'A non-empty list of transfers is required'}), 400
+    if len(data['transfers']) > MAX_BATCH_TRANSFERS:
+        return jsonify({'error': f'At most {MAX_BATCH_TRANSFERS} transfers per batch'}), 400
+
+    mode = data.get('mode', 'atomic')
+    if mode not in ('atomic', 'best_effort'):
+        return jsonify({'error': 'Mode must be atomic or best_effort'}), 400
+    atomic = mode == 'atomic'
+
+    conn = get_db_connection(user_shard())
     try:
-        # Get source account
-        from_account = conn.execute('''
-            SELECT a.* FROM accounts a
-            JOIN account_types at ON a.account_type_id = at.id
-            WHERE a.user_id = ? AND at.type_name = ?
-        ''', (session['user_id'], from_account_type)).fetchone()
-        
-        if not from_account:
-            return jsonify({'error': 'Source account not found'}), 404
-        
-        # Check sufficient balance and minimum balance
-        new_balance = float(from_account['balance']) - amount
-        # Get minimum balance for the account type
-        min_balance_row = conn.execute('SELECT minimum_balance FROM account_types WHERE type_name = ?', (from_account_type,)).fetchone()
-        min_balance = float(min_balance_row['minimum_balance']) if min_balance_row else 0.0
-        if new_balance < min_balance:
-            return jsonify({'error': f'Cannot transfer: minimum balance for {from_account_type} is ${min_balance:.2f}'}), 400
-        
-        if transfer_type == 'internal':
-            # Internal transfer between own accounts
-            if 'toAccountType' not in data:
-                return jsonify({'error': 'Destination account type is required'}), 400
-            
-            to_account_type = data['toAccountType']
-            
-            if from_account_type == to_account_type:
-                return jsonify({'error': 'Cannot transfer to the same account type'}), 400
-            
-            # Get destination account
-            to_account = conn.execute('''
-                SELECT a.* FROM accounts a
-                JOIN account_types at ON a.account_type_id = at.id
-                WHERE a.user_id = ? AND at.type_name = ?
-            ''', (session['user_id'], to_account_type)).fetchone()
-            
-            if not to_account:
-                return jsonify({'error': 'Destination account not found'}), 404
-            
-            description = f"Transfer from {from_account_type} to {to_account_type}"
-            
-        else:  # external transfer
-            if 'to_account' not in data:
-                return jsonify({'error': 'Destination account number is required'}), 400
-            
-            to_account_number = data['to_account']
-            
-            if to_account_number == session['account_number']:
-                return jsonify({'error': 'Cannot transfer to your own account number'}), 400
-            
-            # Get recipient's account (first available account)
-            recipient = conn.execute('''
-                SELECT u.id, u.account_number, u.full_name, a.id as account_id 
-                FROM users u 
-                JOIN accounts a ON u.id = a.user_id
-                WHERE u.account_number = ?
-                LIMIT 1
-            ''', (to_account_number,)).fetchone()
-            
-            if not recipient:
-                return jsonify({'error': 'Recipient account not found'}), 404
-            
-            to_account = {'id': recipient['account_id']}
-            description = f"Transfer to account {to_account_number}"
-        
-        # Perform transfer
-        conn.execute(
-            'UPDATE accounts SET balance = balance - ? WHERE id = ?',
-            (amount, from_account['id'])
-        )
-        
-        conn.execute(
-            'UPDATE accounts SET balance = balance + ? WHERE id = ?',
-            (amount, to_account['id'])
-        )
-        
-        # Record transaction
-        conn.execute('''
-            INSERT INTO transactions 
-            (from_account_id, to_account_id, transaction_type, amount, description)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (from_account['id'], to_account['id'], 'TRANSFER', amount, description))
-        
-        conn.commit()
+        own_accounts = services.load_own_accounts(conn, session['user_id'])
+        recipients = services.find_recipient_accounts(conn, [
+            item['to_account'] for item in data['transfers']
+            if isinstance(item, dict) and item.get('transferType') != 'internal' and isinstance(item.get('to_account'), str)
+        ])
+
+        # Validate everything up front; only valid items reach the ledger
+        results = [None] * len(data['transfers'])
+        resolved = []
+        for index, item in enumerate(data['transfers']):
+            try:
+                resolved.append((index, services.resolve_transfer(
+                    item, own_accounts, recipients, session['account_number'])))
+            except services.ServiceError as e:
+                results[index] = {'index': index, 'success': False, 'error': e.message}
+
+        applied = False
+        if resolved and not (atomic and len(resolved) != len(results)):
+            outcomes, applied = ledger.transfer_batch(conn, [t for _, t in resolved], atomic)
+            for (index, t), outcome in zip(resolved, outcomes):
+                if isinstance(outcome, ledger.InsufficientFunds):
+                    results[index] = {'index': index, 'success': False,
+                                      'error': f"Cannot transfer: minimum balance for {t['from_account_type']} is ${t['minimum_balance']:.2f}"}
+                elif isinstance(outcome, ledger.AccountNotFound):
+                    recipient_directory.invalidate()
+                    results[index] = {'index': index, 'success': False, 'error': 'Recipient account not found'}
+                elif isinstance(outcome, ledger.LedgerError):
+                    results[index] = {'index': index, 'success': False, 'error': str(outcome)}
+                else:
+                    results[index] = {'index': index, 'success': applied, 'new_balance': outcome,
+                                      'message': f"Successfully transferred ${t['amount']:.2f}. {t['description']}"}
+
+        if applied:
+            for source in {t['from_account_id'] for _, t in resolved if ledger.is_remote(conn, t['to_account_id'])}:
+                services.deliver_transfers(conn, source)
+
+        if atomic and not applied:
+            # Nothing was written; mark the otherwise valid items as not applied
+            for index, result in enumerate(results):
+                if result is None or 'error' not in result:
+                    results[index] = {'index': index, 'success': False, 'error': 'Not applied: batch was rolled back'}
+
+        succeeded = sum(1 for r in results if r['success'])
+        status = 400 if atomic and not applied else 200
         return jsonify({
-            'message': f'Successfully transferred ${amount:.2f}. {description}',
-            'new_balance': float(from_account['balance']) - amount
-        })
-    except Exception as e:
-        conn.rollback()
-        return jsonify({'error': str(e)}), 500
+            'mode': mode,
+            'applied': succeeded,
+            'failed': len(results) - succeeded,
+            'results': results
+        }), status
+    except ledger.DatabaseBusy as e:
+        return jsonify({'error': str(e)}), 503
     finally:
         conn.close()
 
@@ -0,0 +1,180 @@
+# This file measures how long each page and each database query takes.
+# The numbers are published at /metrics in the Prometheus text format so
+# slow pages and slow queries can be spotted on a dashboard.
+# Request and SQL instrumentation for SecureBank
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from functools import lru_cache
+from flask import g, has_app_context, request
+
+SLOW_QUERY_MS = float(os.environ.get('SECUREBANK_SLOW_QUERY_MS', '100'))
+# Scrapers send "Authorization: Bearer <token>"; without a token /metrics is off
+METRICS_TOKEN = os.environ.get('SECUREBANK_METRICS_TOKEN', '')
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+slow_query_log = logging.getLogger('securebank.sql')
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        counts = series[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+class Registry:
+    """All metrics of this worker process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.request_latency = Histogram(LATENCY_BUCKETS)
+        self.requests = {}
+        self.queries_per_request = Histogram(QUERY_COUNT_BUCKETS)
+        self.queries = {}
+
+    def record_request(self, route, method, status, elapsed, queries):
+        with self.lock:
+            self.request_latency.observe((route, method), elapsed)
+            key = (route, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.queries_per_request.observe((route,), queries)
+
+    def record_query(self, fingerprint, elapsed):
+        with self.lock:
+            stats = self.queries.get(fingerprint)
+            if stats is None:
+                stats = self.queries[fingerprint] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+    def add_query_time(self, fingerprint, elapsed, total):
+        """Time spent fetching the rows of a statement already counted
+
+        `total` is the statement's time so far (execute plus fetches), which
+        is what the max gauge tracks.
+        """
+        with self.lock:
+            stats = self.queries.get(fingerprint)
+            if stats is None:
+                stats = self.queries[fingerprint] = [0, 0.0, 0.0]
+            stats[1] += elapsed
+            stats[2] = max(stats[2], total)
+
+registry = Registry()
+
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_in_lists = re.compile(r'IN\s*\((?:\s*\?\s*,?)+\)', re.IGNORECASE)
+_whitespace = re.compile(r'\s+')
+
+@lru_cache(maxsize=1024)
+def fingerprint(sql):
+    """Normalise a statement so queries differing only in literals group together"""
+    sql = _literals.sub('?', sql)
+    sql = _in_lists.sub('IN (...)', sql)
+    return _whitespace.sub(' ', sql).strip()
+
+def record_query(sql, elapsed):
+    """Called by database connections after every statement"""
+    registry.record_query(fingerprint(sql), elapsed)
+    if has_app_context():
+        g._query_count = g.get('_query_count', 0) + 1
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        slow_query_log.warning('slow query (%.1f ms): %s', elapsed * 1000, fingerprint(sql))
+
+def record_fetch(sql, elapsed, total):
+    """Called by database cursors after fetching rows of a statement
+
+    SQLite does most of a SELECT's work while rows are stepped through, so
+    this time is added to the statement's. The slow query log fires once,
+    when the running total crosses the threshold.
+    """
+    registry.add_query_time(fingerprint(sql), elapsed, total)
+    if (total - elapsed) * 1000 < SLOW_QUERY_MS <= total * 1000:
+        slow_query_log.warning('slow query (%.1f ms incl. fetch): %s', total * 1000, fingerprint(sql))
+
+def _start_timer():
+    g._request_started = time.perf_counter()
+    g._query_count = 0
+
+def _record_response(response):
+    started = g.pop('_request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        registry.record_request(route, request.method, response.status_code,
+                                time.perf_counter() - started, g.get('_query_count', 0))
+    return response
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+def _render_histogram(lines, name, help_text, histogram, label_names):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for labels, (counts, total, count) in sorted(histogram.series.items()):
+        base = dict(zip(label_names, labels))
+        cumulative = 0
+        for bound, bucket_count in zip(histogram.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{_labels(**base, le=bound)} {cumulative}')
+        lines.append(f'{name}_bucket{_labels(**base, le="+Inf")} {count}')
+        lines.append(f'{name}_sum{_labels(**base)} {total}')
+        lines.append(f'{name}_count{_labels(**base)} {count}')
+
+def render(gauges=None):
+    """Prometheus text exposition of this worker's metrics plus extra gauges"""
+    lines = []
+    with registry.lock:
+        _render_histogram(lines, 'securebank_http_request_duration_seconds',
+                          'Request latency by route', registry.request_latency, ('route', 'method'))
+        lines.append('# HELP securebank_http_requests_total Requests by route and status')
+        lines.append('# TYPE securebank_http_requests_total counter')
+        for (route, method, status), count in sorted(registry.requests.items()):
+            lines.append(f'securebank_http_requests_total{_labels(route=route, method=method, status=status)} {count}')
+        _render_histogram(lines, 'securebank_sql_queries_per_request',
+                          'SQL statements executed per request', registry.queries_per_request, ('route',))
+        for name, index, kind, help_text in (
+            ('securebank_sql_queries_total', 0, 'counter', 'SQL statements executed by fingerprint'),
+            ('securebank_sql_query_seconds_total', 1, 'counter', 'Time spent executing SQL statements and fetching their rows, by fingerprint'),
+            ('securebank_sql_query_seconds_max', 2, 'gauge', 'Slowest execution of each fingerprint'),
+        ):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for statement, stats in sorted(registry.queries.items()):
+                lines.append(f'{name}{_labels(statement=statement)} {stats[index]}')
+    for name, value in sorted((gauges or {}).items()):
+        lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+def authorized(authorization):
+    """Whether an Authorization header value carries the metrics token"""
+    if not METRICS_TOKEN or not authorization:
+        return False
+    scheme, _, token = authorization.partition(' ')
+    return scheme.lower() == 'bearer' and secrets.compare_digest(token.strip(), METRICS_TOKEN)
+
+def init_app(app):
+    """Time every request on the app"""
+    app.before_request(_start_timer)
+    app.after_request(_record_response)
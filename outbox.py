@@ -0,0 +1,132 @@
+# This file finishes transfers between customers whose accounts are kept in
+# different database files (sharded mode). The money leaves the sender at
+# once; this delivers it to the recipient, and sends it back if their account
+# is gone.
+# Cross-shard transfer delivery for SecureBank
+# A transfer to another shard commits in three steps, each one short
+# transaction on a single shard:
+#   1. source: debit, TRANSFER row and a 'pending' transfer_outbox row (ledger.py)
+#   2. target: credit and TRANSFER row, or nothing if the account is gone,
+#      plus a transfer_inbox row keyed by (source shard, outbox id)
+#   3. source: mark the outbox row delivered, or returned and refund it
+# Step 2 is skipped if the inbox row already exists and step 3 only changes a
+# row that is still pending, so repeating steps after a crash is harmless:
+# the relay (./securebank outbox-relay) retries every pending row until it
+# is settled, and each transfer is credited exactly once.
+import os
+import time
+import database
+import ledger
+
+RELAY_INTERVAL = float(os.environ.get('SECUREBANK_OUTBOX_INTERVAL', '1'))
+RELAY_BATCH = int(os.environ.get('SECUREBANK_OUTBOX_BATCH', '500'))
+
+class MisroutedTransfer(RuntimeError):
+    """An outbox row whose target maps to its own shard
+
+    Only transfers to another shard get an outbox row, so this means the
+    shard map differs from the one that wrote it (e.g. a wrong
+    SECUREBANK_SHARDS). Delivering would find no account and refund the
+    transfer, so the relay stops instead.
+    """
+
+def _receive(conn, source_shard, row):
+    existing = conn.execute(
+        'SELECT status FROM transfer_inbox WHERE source_shard = ? AND outbox_id = ?',
+        (source_shard, row['id'])
+    ).fetchone()
+    if existing:
+        return existing['status']
+    credited = conn.execute(
+        'UPDATE accounts SET balance = balance + ? WHERE id = ?',
+        (row['amount'], row['to_account_id'])
+    ).rowcount
+    status = 'delivered' if credited else 'returned'
+    if credited:
+        conn.execute('''
+            INSERT INTO transactions (from_account_id, to_account_id, transaction_type, amount, description)
+            VALUES (?, ?, 'TRANSFER', ?, ?)
+        ''', (row['from_account_id'], row['to_account_id'], row['amount'], row['description']))
+    conn.execute(
+        'INSERT INTO transfer_inbox (source_shard, outbox_id, status) VALUES (?, ?, ?)',
+        (source_shard, row['id'], status)
+    )
+    return status
+
+def _settle(conn, row, status):
+    settled = conn.execute('''
+        UPDATE transfer_outbox SET status = ?, settled_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND status = 'pending'
+    ''', (status, row['id'])).rowcount
+    if settled and status == 'returned':
+        conn.execute('UPDATE accounts SET balance = balance + ? WHERE id = ?',
+                     (row['amount'], row['from_account_id']))
+        conn.execute('''
+            INSERT INTO transactions (from_account_id, to_account_id, transaction_type, amount, description)
+            VALUES (?, ?, 'TRANSFER', ?, ?)
+        ''', (row['to_account_id'], row['from_account_id'], row['amount'], f"Returned: {row['description']}"))
+    return settled
+
+def deliver(source_shard, from_account_id=None, limit=None):
+    """Deliver pending outbox rows of a shard; returns {status: count}
+
+    With from_account_id only that account's rows are delivered, which is
+    what a request does right after its transfer commits.
+    """
+    conn = database.get_db_connection(source_shard)
+    try:
+        if from_account_id is None:
+            rows = conn.execute(
+                "SELECT * FROM transfer_outbox WHERE status = 'pending' ORDER BY id LIMIT ?",
+                (limit or RELAY_BATCH,)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT * FROM transfer_outbox WHERE status = 'pending' AND from_account_id = ? ORDER BY id",
+                (from_account_id,)
+            ).fetchall()
+        counts = {}
+        for row in rows:
+            target_shard = database.shard_for_account(row['to_account_id'])
+            if target_shard == source_shard:
+                raise MisroutedTransfer(
+                    f"Outbox row {row['id']} on shard {source_shard} targets account {row['to_account_id']} "
+                    f"on the same shard; check SECUREBANK_SHARDS (currently {database.SHARDS})"
+                )
+            target = database.get_db_connection(target_shard)
+            try:
+                status = ledger.run_in_transaction(target, _receive, source_shard, row)
+            finally:
+                target.close()
+            if ledger.run_in_transaction(conn, _settle, row, status):
+                counts[status] = counts.get(status, 0) + 1
+        return counts
+    finally:
+        conn.close()
+
+def pending(shard):
+    """Outbox rows of a shard that are not settled yet"""
+    conn = database.get_read_connection(shard)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM transfer_outbox WHERE status = 'pending'").fetchone()[0]
+    finally:
+        conn.close()
+
+def run_relay(interval=None, once=False, shards=None):
+    """Deliver pending transfers of every shard (or of `shards`), every `interval` seconds"""
+    interval = RELAY_INTERVAL if interval is None else interval
+    while True:
+        for shard in database.shard_ids() if shards is None else shards:
+            while True:
+                try:
+                    counts = deliver(shard)
+                except ledger.DatabaseBusy as e:
+                    print(f"Shard {shard}: {e}")
+                    break
+                if counts:
+                    print(f"Shard {shard}: " + ', '.join(f'{count} {status}' for status, count in sorted(counts.items())))
+                if sum(counts.values()) < RELAY_BATCH:
+                    break
+        if once:
+            return
+        time.sleep(interval)
@@ -0,0 +1,127 @@
+# This file checks passwords when people log in.
+# Checking a password is deliberately slow (to make guessing hard), so the work
+# is done by a small pool of helper processes instead of the web worker itself.
+# Password hashing and verification for SecureBank
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+# werkzeug method string, e.g. 'scrypt', 'scrypt:16384:8:1' or 'pbkdf2:sha256:600000'
+HASH_METHOD = os.environ.get('SECUREBANK_HASH_METHOD', 'scrypt')
+
+# Helper processes per web worker (0 verifies inline) and how many
+# verifications may be queued or running before logins get a 503
+VERIFY_WORKERS = int(os.environ.get('SECUREBANK_VERIFY_WORKERS', '2'))
+VERIFY_QUEUE_LIMIT = int(os.environ.get('SECUREBANK_VERIFY_QUEUE_LIMIT', '16'))
+VERIFY_TIMEOUT = float(os.environ.get('SECUREBANK_VERIFY_TIMEOUT', '10'))
+
+class VerifierBusy(Exception):
+    """Too many password verifications are already in flight"""
+
+def canonical_method(method):
+    """Expand a werkzeug method string to the prefix it writes into hashes"""
+    parts = method.split(':')
+    if parts[0] == 'scrypt':
+        return method if len(parts) == 4 else 'scrypt:32768:8:1'
+    if parts[0] == 'pbkdf2':
+        algorithm = parts[1] if len(parts) > 1 else 'sha256'
+        iterations = parts[2] if len(parts) > 2 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{algorithm}:{iterations}'
+    return method
+
+def hash_password(password):
+    """Hash a password with the configured method and cost"""
+    return generate_password_hash(password, method=HASH_METHOD)
+
+def needs_rehash(password_hash):
+    """True if a stored hash was made with a different method or cost"""
+    return password_hash.split('$', 1)[0] != canonical_method(HASH_METHOD)
+
+class Verifier:
+    """Bounded process pool for password hashing work"""
+
+    def __init__(self, workers=VERIFY_WORKERS, queue_limit=VERIFY_QUEUE_LIMIT):
+        self.workers = workers
+        self.pid = os.getpid()
+        self._slots = threading.BoundedSemaphore(max(queue_limit, 1))
+        self._executor = None
+        if workers > 0:
+            self._executor = ProcessPoolExecutor(max_workers=workers,
+                                                 mp_context=multiprocessing.get_context('fork'))
+            # The fork context starts every helper on the first submit; do it
+            # now, while the worker is still single threaded at boot
+            self._executor.submit(int).result()
+
+    def _submit(self, fn, *args):
+        # The slot is held until the work finishes, not until the caller
+        # gives up waiting, so timed-out checks still count against the queue
+        if not self._slots.acquire(blocking=False):
+            raise VerifierBusy('Too many logins in progress, please try again')
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def run(self, fn, *args):
+        """Run fn(*args) in the pool, or raise VerifierBusy if the queue is full or it times out"""
+        if self._executor is None:
+            return fn(*args)
+        future = self._submit(fn, *args)
+        try:
+            return future.result(timeout=VERIFY_TIMEOUT)
+        except FutureTimeout:
+            future.cancel()
+            raise VerifierBusy('Password check timed out, please try again')
+
+    async def run_async(self, fn, *args):
+        """Await fn(*args) in the pool without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        if self._executor is None:
+            return await loop.run_in_executor(None, fn, *args)
+        future = self._submit(fn, *args)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future, loop=loop), VERIFY_TIMEOUT)
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise VerifierBusy('Password check timed out, please try again')
+
+    def shutdown(self):
+        """Stop the helper processes"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+_verifier = None
+_verifier_lock = threading.Lock()
+
+def get_verifier():
+    """This process's verifier, recreated after a fork"""
+    global _verifier
+    if _verifier is None or _verifier.pid != os.getpid():
+        with _verifier_lock:
+            if _verifier is None or _verifier.pid != os.getpid():
+                _verifier = Verifier()
+    return _verifier
+
+def verify_password(password_hash, password):
+    """Check a password against its stored hash off the request thread"""
+    return get_verifier().run(check_password_hash, password_hash, password)
+
+def rehash_password(password):
+    """Compute a fresh hash with the current settings off the request thread"""
+    return get_verifier().run(generate_password_hash, password, HASH_METHOD)
+
+async def verify_password_async(password_hash, password):
+    """verify_password for async handlers"""
+    return await get_verifier().run_async(check_password_hash, password_hash, password)
+
+async def rehash_password_async(password):
+    """rehash_password for async handlers"""
+    return await get_verifier().run_async(generate_password_hash, password, HASH_METHOD)
@@ -0,0 +1,133 @@
+# This file finds which account receives money sent to a customer's account
+# number. Each worker remembers recent answers so repeat payees cost nothing.
+# Recipient directory for SecureBank
+# An account number resolves to the user's chosen deposit account
+# (users.deposit_account_id) if it still belongs to them, otherwise their
+# Checking account, otherwise their oldest account. Each lookup is a few
+# index seeks (users.account_number, then accounts (user_id, account_type_id)),
+# so it does not depend on how many users there are. Answers are kept in a
+# bounded LRU and dropped when the 'accounts' version counter goes up, which
+# triggers do whenever accounts are opened, closed or reassigned. In sharded
+# mode every shard is asked, through its read-only pool.
+import os
+import threading
+import time
+from collections import OrderedDict
+import database
+from catalog import catalog
+
+RECIPIENT_CACHE_SIZE = int(os.environ.get('SECUREBANK_RECIPIENT_CACHE_SIZE', '10000'))
+# How often (seconds) a worker re-reads the version counter
+REFRESH_INTERVAL = float(os.environ.get('SECUREBANK_RECIPIENT_REFRESH', '1'))
+# Account numbers resolved per query
+LOOKUP_CHUNK = 500
+
+class RecipientDirectory:
+    """account_number -> receiving account id, with a per-worker LRU"""
+
+    def __init__(self, size=RECIPIENT_CACHE_SIZE, refresh_interval=REFRESH_INTERVAL):
+        self.size = size
+        self.refresh_interval = refresh_interval
+        self.version = None
+        self.database = None
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _shard_connections(self, conn):
+        if database.SHARDS == 1:
+            yield conn
+            return
+        for shard in database.shard_ids():
+            shard_conn = database.get_read_connection(shard)
+            try:
+                yield shard_conn
+            finally:
+                shard_conn.close()
+
+    def _read_version(self, conn):
+        versions = []
+        for shard_conn in self._shard_connections(conn):
+            row = shard_conn.execute("SELECT version FROM catalog_version WHERE name = 'accounts'").fetchone()
+            versions.append(row['version'] if row else 0)
+        return tuple(versions)
+
+    def _refresh(self, conn):
+        # Called with the lock held
+        now = time.monotonic()
+        if self.database == database.DATABASE and self.version is not None and now - self._checked_at < self.refresh_interval:
+            return
+        version = self._read_version(conn)
+        if version != self.version or self.database != database.DATABASE:
+            self.entries.clear()
+            self.version = version
+            self.database = database.DATABASE
+        self._checked_at = now
+
+    def _lookup(self, conn, account_numbers):
+        checking = catalog.get('Checking')
+        found = {}
+        for shard_conn in self._shard_connections(conn):
+            found.update(self._lookup_shard(shard_conn, account_numbers, checking))
+        return found
+
+    def _lookup_shard(self, conn, account_numbers, checking):
+        found = {}
+        for i in range(0, len(account_numbers), LOOKUP_CHUNK):
+            chunk = account_numbers[i:i + LOOKUP_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            found.update({row['account_number']: row['account_id'] for row in conn.execute(f'''
+                SELECT u.account_number, COALESCE(
+                    (SELECT a.id FROM accounts a WHERE a.id = u.deposit_account_id AND a.user_id = u.id),
+                    (SELECT MIN(a.id) FROM accounts a WHERE a.user_id = u.id AND a.account_type_id = ?),
+                    (SELECT MIN(a.id) FROM accounts a WHERE a.user_id = u.id)
+                ) AS account_id
+                FROM users u
+                WHERE u.account_number IN ({placeholders})
+            ''', (checking['id'] if checking else None, *chunk)).fetchall()})
+        return found
+
+    def resolve(self, conn, account_numbers):
+        """{account_number: account id} for the numbers that have an account"""
+        numbers = list(set(account_numbers))
+        result = {}
+        with self._lock:
+            self._refresh(conn)
+            missing = []
+            for number in numbers:
+                if number in self.entries:
+                    self.entries.move_to_end(number)
+                    result[number] = self.entries[number]
+                else:
+                    missing.append(number)
+            self.hits += len(numbers) - len(missing)
+            self.misses += len(missing)
+            version = self.version
+        if not missing:
+            return {number: account_id for number, account_id in result.items() if account_id is not None}
+
+        found = self._lookup(conn, missing)
+        with self._lock:
+            # Skip caching if the accounts changed while we were reading
+            if version == self.version:
+                for number in missing:
+                    # Unknown numbers are cached too, as None
+                    self.entries[number] = found.get(number)
+                    self.entries.move_to_end(number)
+                while len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+        result.update(found)
+        return {number: account_id for number, account_id in result.items() if account_id is not None}
+
+    def invalidate(self):
+        """Drop every cached answer (after a transfer hit a vanished account)"""
+        with self._lock:
+            self.entries.clear()
+            self._checked_at = 0.0
+
+    def stats(self):
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+directory = RecipientDirectory()
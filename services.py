@@ -0,0 +1,515 @@
+# This file holds the banking rules behind the API.
+# The regular web app (main.py) and the async server (asgi.py) both call these
+# functions, so an account behaves the same whichever server answers.
+# Request-independent business logic for SecureBank
+# Every function takes an open connection and plain values (no Flask request
+# or session) and either returns the JSON-ready result or raises ServiceError.
+import passwords
+import interest
+import ledger
+import outbox
+import projection
+from recipients import directory as recipient_directory
+import snapshots
+import velocity
+from catalog import catalog
+from datetime import date, timedelta
+from interest import calculate_interest
+
+TRANSACTIONS_PAGE_SIZE = 20
+TRANSACTIONS_MAX_PAGE_SIZE = 100
+PROJECTION_YEARS = 10
+
+class ServiceError(Exception):
+    """A request that cannot be carried out, with the HTTP status to answer"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+def find_user(conn, account_number):
+    return conn.execute(
+        'SELECT * FROM users WHERE account_number = ?',
+        (account_number,)
+    ).fetchone()
+
+def upgrade_password_hash(conn, user, new_hash):
+    """Replace a hash made with old settings, unless it changed meanwhile"""
+    conn.execute(
+        'UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+        (new_hash, user['id'], user['password_hash'])
+    )
+    conn.commit()
+
+def authenticate(conn, account_number, password):
+    """The user row for valid credentials, or None
+
+    The hash check runs in the verifier pool. Hashes made with old settings
+    are upgraded while the password is at hand. Raises ServiceError (503)
+    when the verifier queue is full.
+    """
+    user = find_user(conn, account_number)
+    try:
+        valid = user is not None and passwords.verify_password(user['password_hash'], password)
+        if valid and passwords.needs_rehash(user['password_hash']):
+            upgrade_password_hash(conn, user, passwords.rehash_password(password))
+    except passwords.VerifierBusy as e:
+        raise ServiceError(str(e), 503)
+    return user if valid else None
+
+async def authenticate_async(call_db, account_number, password):
+    """authenticate() for async handlers
+
+    call_db(service, *args) awaits a service function on a database thread;
+    the hash checks are awaited in the verifier pool, so no thread waits on
+    them.
+    """
+    user = await call_db(find_user, account_number)
+    try:
+        valid = user is not None and await passwords.verify_password_async(user['password_hash'], password)
+        if valid and passwords.needs_rehash(user['password_hash']):
+            await call_db(upgrade_password_hash, user, await passwords.rehash_password_async(password))
+    except passwords.VerifierBusy as e:
+        raise ServiceError(str(e), 503)
+    return user if valid else None
+
+def format_account(account, types):
+    type_info = types[account['account_type_id']]
+    return {
+        'account_id': account['id'],
+        'account_type': type_info['name'],
+        'balance': float(account['balance']),
+        'interest_rate': type_info['interest_rate'],
+        'minimum_balance': type_info['minimum_balance'],
+        'description': type_info['description'],
+        'created_at': account['created_at']
+    }
+
+def format_transaction(transaction):
+    return {
+        'id': transaction['id'],
+        'type': transaction['transaction_type'],
+        'amount': float(transaction['amount']),
+        'description': transaction['description'],
+        'created_at': transaction['created_at']
+    }
+
+def next_page_cursor(transactions, limit):
+    """Cursor for the page after `transactions`, or None on the last page"""
+    if len(transactions) < limit:
+        return None
+    last = transactions[-1]
+    return f"{last['created_at']}|{last['id']}"
+
+def account_info(conn, user_id):
+    """All of the user's accounts with their type details"""
+    accounts = conn.execute(
+        'SELECT * FROM accounts WHERE user_id = ?',
+        (user_id,)
+    ).fetchall()
+    if not accounts:
+        raise ServiceError('No accounts found', 404)
+
+    # Type details come from the in-memory catalog instead of a JOIN
+    types = catalog.refresh().by_id
+    return {'accounts': [format_account(acc, types) for acc in accounts]}
+
+def parse_transactions_cursor(value):
+    """Parse a `before` cursor of the form '<created_at>|<id>'"""
+    created_at, _, transaction_id = value.rpartition('|')
+    if not created_at:
+        raise ValueError('Invalid cursor')
+    return created_at, int(transaction_id)
+
+def fetch_transactions_page(conn, account_ids, limit, before=None):
+    """Newest-first page of transactions touching any of the given accounts
+
+    Each account/direction pair is its own index range scan on
+    (from_account_id, created_at) or (to_account_id, created_at), limited
+    before merging, so the cost depends on the page size and not on how
+    large the transactions table is.
+    """
+    if before:
+        # Everything before the cursor, as two seeks on the index (whose last
+        # column is the rowid, i.e. id): the rest of the cursor's second, then
+        # older rows. SQLite only seeks on the first column of a row value
+        # like (created_at, id) < (?, ?) and would scan the whole second
+        ranges = [('AND created_at = ? AND id < ?', before), ('AND created_at < ?', (before[0],))]
+    else:
+        ranges = [('', ())]
+
+    parts = []
+    params = []
+    for account_id in account_ids:
+        for column in ('from_account_id', 'to_account_id'):
+            for range_clause, range_params in ranges:
+                parts.append(f'''
+                    SELECT * FROM (
+                        SELECT * FROM transactions
+                        WHERE {column} = ? {range_clause}
+                        ORDER BY created_at DESC, id DESC
+                        LIMIT ?
+                    )''')
+                params.extend((account_id, *range_params, limit))
+
+    # UNION drops the duplicate row of transfers between the user's own accounts
+    query = ' UNION '.join(parts) + ' ORDER BY created_at DESC, id DESC LIMIT ?'
+    params.append(limit)
+    return conn.execute(query, params).fetchall()
+
+def transactions_page(conn, user_id, limit=None, before=None):
+    """One page of the user's history and the cursor for the next page
+
+    limit and before are the raw query string values. The cursor is None on
+    the last page.
+    """
+    try:
+        limit = int(limit) if limit is not None else TRANSACTIONS_PAGE_SIZE
+    except ValueError:
+        raise ServiceError('Invalid limit')
+    if limit < 1 or limit > TRANSACTIONS_MAX_PAGE_SIZE:
+        raise ServiceError(f'Limit must be between 1 and {TRANSACTIONS_MAX_PAGE_SIZE}')
+
+    if before:
+        try:
+            before = parse_transactions_cursor(before)
+        except ValueError:
+            raise ServiceError('Invalid cursor')
+
+    account_ids = [row['id'] for row in conn.execute(
+        'SELECT id FROM accounts WHERE user_id = ?',
+        (user_id,)
+    ).fetchall()]
+    if not account_ids:
+        raise ServiceError('Account not found', 404)
+
+    transactions = fetch_transactions_page(conn, account_ids, limit, before)
+    return [format_transaction(t) for t in transactions], next_page_cursor(transactions, limit)
+
+def dashboard(conn, user_id, limit=TRANSACTIONS_PAGE_SIZE):
+    """Everything the dashboard shows, read in one transaction
+
+    Two queries (the accounts, then the first page of history) from the same
+    snapshot, so the total always matches the listed balances and history.
+    """
+    types = catalog.refresh().by_id
+    owns_transaction = not conn.in_transaction
+    if owns_transaction:
+        conn.execute('BEGIN')
+    try:
+        accounts = conn.execute(
+            'SELECT * FROM accounts WHERE user_id = ?',
+            (user_id,)
+        ).fetchall()
+        if not accounts:
+            raise ServiceError('No accounts found', 404)
+        transactions = fetch_transactions_page(conn, [acc['id'] for acc in accounts], limit)
+    finally:
+        if owns_transaction:
+            conn.commit()
+
+    return {
+        'accounts': [format_account(acc, types) for acc in accounts],
+        'total_balance': round(sum(float(acc['balance']) for acc in accounts), 2),
+        'transactions': [format_transaction(t) for t in transactions],
+        'next_cursor': next_page_cursor(transactions, limit),
+    }
+
+def parse_amount(data):
+    """The positive amount of a deposit or withdrawal request body"""
+    if not data or not isinstance(data, dict):
+        raise ServiceError('Invalid request')
+    try:
+        amount = float(data.get('amount', 0))
+    except (ValueError, TypeError):
+        raise ServiceError('Invalid amount format')
+    if amount <= 0:
+        raise ServiceError('Amount must be greater than zero')
+    return amount
+
+def checking_account(conn, user_id):
+    """The user's Checking account row and its account type"""
+    checking = catalog.get('Checking')
+    account = conn.execute(
+        'SELECT * FROM accounts WHERE user_id = ? AND account_type_id = ?',
+        (user_id, checking['id'])
+    ).fetchone()
+    if not account:
+        raise ServiceError('Checking account not found', 404)
+    return account, checking
+
+def deposit(conn, user_id, data):
+    """Deposit into the user's Checking account (the only one that takes deposits)"""
+    amount = parse_amount(data)
+    account, _ = checking_account(conn, user_id)
+
+    # Update balance and record the transaction in one write transaction
+    try:
+        new_balance = ledger.deposit(conn, account['id'], amount, 'Deposit to Checking account')
+    except ledger.DatabaseBusy as e:
+        raise ServiceError(str(e), 503)
+    return {'success': True, 'new_balance': new_balance, 'message': f'Successfully deposited ${amount:.2f} to Checking account'}
+
+def withdraw(conn, user_id, data):
+    """Withdraw from the user's Checking account, keeping its minimum balance"""
+    amount = parse_amount(data)
+    account, checking = checking_account(conn, user_id)
+
+    # The minimum balance check happens inside the UPDATE itself
+    try:
+        new_balance = ledger.withdraw(conn, account['id'], amount, checking['minimum_balance'],
+                                      'Withdrawal from Checking account',
+                                      guard=velocity.guard(account, checking, external=True))
+    except ledger.InsufficientFunds:
+        raise ServiceError(f'Cannot withdraw: minimum balance for Checking is ${checking["minimum_balance"]:.2f}')
+    except velocity.VelocityLimitExceeded as e:
+        raise ServiceError(f'Cannot withdraw: {e}', 429)
+    except ledger.DatabaseBusy as e:
+        raise ServiceError(str(e), 503)
+    return {'success': True, 'new_balance': new_balance, 'message': f'Successfully withdrew ${amount:.2f} from Checking account'}
+
+def load_own_accounts(conn, user_id):
+    """The user's accounts keyed by account_type_id"""
+    return {row['account_type_id']: row for row in conn.execute(
+        'SELECT * FROM accounts WHERE user_id = ?', (user_id,)
+    ).fetchall()}
+
+def find_recipient_accounts(conn, account_numbers):
+    """Map recipient account numbers to the account that receives transfers
+
+    Served from the per-worker recipient directory (recipients.py): the
+    recipient's chosen deposit account, else Checking, else their oldest.
+    """
+    return recipient_directory.resolve(conn, account_numbers)
+
+def set_deposit_account(conn, user_id, data):
+    """Choose which of the user's accounts receives transfers from others"""
+    if not isinstance(data, dict) or 'accountType' not in data:
+        raise ServiceError('Account type is required')
+    account_type = catalog.get(data['accountType'])
+    account = load_own_accounts(conn, user_id).get(account_type['id']) if account_type else None
+    if not account:
+        raise ServiceError('Account not found', 404)
+
+    def update(conn):
+        conn.execute('UPDATE users SET deposit_account_id = ? WHERE id = ?', (account['id'], user_id))
+    try:
+        ledger.run_in_transaction(conn, update)
+    except ledger.DatabaseBusy as e:
+        raise ServiceError(str(e), 503)
+    return {'success': True, 'message': f"Transfers to your account number now go to your {data['accountType']} account"}
+
+def resolve_transfer(data, own_accounts, recipients, own_account_number):
+    """Validate one transfer request and resolve its source and destination accounts"""
+    if not isinstance(data, dict) or 'amount' not in data or 'transferType' not in data or 'fromAccountType' not in data:
+        raise ServiceError('Amount, transfer type, and source account type are required')
+
+    try:
+        amount = float(data['amount'])
+    except (ValueError, TypeError):
+        raise ServiceError('Invalid amount format')
+    transfer_type = data['transferType']
+    from_account_type = data['fromAccountType']
+
+    if amount <= 0:
+        raise ServiceError('Amount must be positive')
+
+    # Get source account
+    from_type = catalog.get(from_account_type)
+    from_account = own_accounts.get(from_type['id']) if from_type else None
+    if not from_account:
+        raise ServiceError('Source account not found', 404)
+
+    if transfer_type == 'internal':
+        # Internal transfer between own accounts
+        if 'toAccountType' not in data:
+            raise ServiceError('Destination account type is required')
+
+        to_account_type = data['toAccountType']
+
+        if from_account_type == to_account_type:
+            raise ServiceError('Cannot transfer to the same account type')
+
+        # Get destination account
+        to_type = catalog.get(to_account_type)
+        to_account = own_accounts.get(to_type['id']) if to_type else None
+        if not to_account:
+            raise ServiceError('Destination account not found', 404)
+
+        to_account_id = to_account['id']
+        description = f"Transfer from {from_account_type} to {to_account_type}"
+
+    else:  # external transfer
+        if 'to_account' not in data:
+            raise ServiceError('Destination account number is required')
+
+        to_account_number = data['to_account']
+        if not isinstance(to_account_number, str):
+            raise ServiceError('Destination account number must be a string')
+
+        if to_account_number == own_account_number:
+            raise ServiceError('Cannot transfer to your own account number')
+
+        to_account_id = recipients.get(to_account_number)
+        if not to_account_id:
+            raise ServiceError('Recipient account not found', 404)
+
+        description = f"Transfer to account {to_account_number}"
+
+    return {
+        'from_account_id': from_account['id'],
+        'from_account_type': from_account_type,
+        'to_account_id': to_account_id,
+        'amount': amount,
+        'minimum_balance': from_type['minimum_balance'],
+        'description': description,
+        'guard': velocity.guard(from_account, from_type, external=transfer_type != 'internal'),
+    }
+
+def transfer(conn, user_id, account_number, data):
+    """Internal (between own accounts) or external (to another account number) transfer"""
+    own_accounts = load_own_accounts(conn, user_id)
+    to_account_number = data.get('to_account') if isinstance(data, dict) else None
+    # resolve_transfer rejects anything but a string with a 400
+    recipients = find_recipient_accounts(conn, [to_account_number]) if isinstance(to_account_number, str) else {}
+    t = resolve_transfer(data, own_accounts, recipients, account_number)
+
+    # Perform transfer; the debit is guarded by the minimum balance
+    try:
+        new_balance = ledger.transfer(conn, t['from_account_id'], t['to_account_id'], t['amount'],
+                                      t['minimum_balance'], t['description'], guard=t['guard'])
+    except ledger.InsufficientFunds:
+        raise ServiceError(f"Cannot transfer: minimum balance for {t['from_account_type']} is ${t['minimum_balance']:.2f}")
+    except velocity.VelocityLimitExceeded as e:
+        raise ServiceError(f'Cannot transfer: {e}', 429)
+    except ledger.AccountNotFound:
+        # The recipient's account was closed after it was cached
+        recipient_directory.invalidate()
+        raise ServiceError('Recipient account not found', 404)
+    except ledger.DatabaseBusy as e:
+        raise ServiceError(str(e), 503)
+    except Exception as e:
+        conn.rollback()
+        raise ServiceError(str(e), 500)
+    if ledger.is_remote(conn, t['to_account_id']):
+        deliver_transfers(conn, t['from_account_id'])
+    return {
+        'message': f"Successfully transferred ${t['amount']:.2f}. {t['description']}",
+        'new_balance': new_balance
+    }
+
+def deliver_transfers(conn, from_account_id):
+    """Credit the recipients on other shards of an account's committed transfers
+
+    The money has already left; if this cannot finish now the outbox relay
+    delivers it later, so the request still succeeds.
+    """
+    try:
+        outbox.deliver(conn.shard, from_account_id)
+    except (ledger.DatabaseBusy, outbox.MisroutedTransfer):
+        pass
+
+def calculate_account_interest(conn, user_id, account_id):
+    """Interest status for one of the user's accounts
+
+    While the background scheduler is running this only reads the account's
+    last credit and the scheduler's progress. Without a live scheduler the
+    interest is applied on the spot, as before.
+    """
+    account = conn.execute(
+        'SELECT id, last_interest_calc_date FROM accounts WHERE id = ? AND user_id = ?',
+        (account_id, user_id)
+    ).fetchone()
+    if not account:
+        raise ServiceError('Account not found or access denied', 404)
+
+    status = interest.scheduler_status(conn)
+    if status is None or not status['active']:
+        success, message = calculate_interest(account_id)
+        if not success:
+            raise ServiceError(message)
+        return {'message': message}
+
+    last_credited = account['last_interest_calc_date']
+    return {
+        'message': f'Interest is credited automatically, last on {last_credited}' if last_credited
+                   else 'Interest is credited automatically; none has been credited yet',
+        'last_interest_calc_date': last_credited,
+        'scheduler': {'as_of': status['as_of'], 'running': status['running']},
+    }
+
+def interest_projection(conn, user_id, account_id, years=None, compounding=None, rate_schedule=None):
+    """Projected year-end balances of one of the user's accounts
+
+    years, compounding and rate_schedule are the raw query string values;
+    rate_schedule is a comma-separated list of per-year rate changes in
+    percentage points (see projection.year_rates).
+    """
+    try:
+        years = int(years) if years is not None else PROJECTION_YEARS
+        schedule = [float(shift) for shift in rate_schedule.split(',')] if rate_schedule else None
+    except ValueError:
+        raise ServiceError('Invalid years or rate schedule')
+    compounding = compounding or 'daily'
+    try:
+        projection.validate(years, compounding)
+    except ValueError as e:
+        raise ServiceError(str(e))
+
+    account = conn.execute(
+        'SELECT id, balance, account_type_id FROM accounts WHERE id = ? AND user_id = ?',
+        (account_id, user_id)
+    ).fetchone()
+    if not account:
+        raise ServiceError('Account not found or access denied', 404)
+
+    rate = catalog.refresh().by_id[account['account_type_id']]['interest_rate']
+    balances = projection.project([account['balance']], [rate], years, compounding, schedule)[0]
+    return {
+        'account_id': account['id'],
+        'balance': float(account['balance']),
+        'interest_rate': rate,
+        'compounding': compounding,
+        'rate_schedule': schedule or [],
+        'projection': [{'year': year, 'balance': round(float(balance), 2)}
+                       for year, balance in enumerate(balances, start=1)],
+    }
+
+def balance_history(conn, user_id, account_id, start=None, end=None):
+    """Daily closing balances of one of the user's accounts
+
+    start and end are the raw 'YYYY-MM-DD' query string values; by default
+    the last BALANCE_HISTORY_DAYS days up to today (UTC).
+    """
+    try:
+        end = date.fromisoformat(end) if end else snapshots.utc_today()
+        start = date.fromisoformat(start) if start else end - timedelta(days=snapshots.BALANCE_HISTORY_DAYS - 1)
+    except ValueError:
+        raise ServiceError('Invalid date format, use YYYY-MM-DD')
+    if start > end:
+        raise ServiceError('from must not be after to')
+    if (end - start).days >= snapshots.BALANCE_HISTORY_MAX_DAYS:
+        raise ServiceError(f'At most {snapshots.BALANCE_HISTORY_MAX_DAYS} days per request')
+
+    owns_transaction = not conn.in_transaction
+    if owns_transaction:
+        conn.execute('BEGIN')
+    try:
+        account = conn.execute(
+            'SELECT id, balance, created_at FROM accounts WHERE id = ? AND user_id = ?',
+            (account_id, user_id)
+        ).fetchone()
+        if not account:
+            raise ServiceError('Account not found or access denied', 404)
+        history = snapshots.balance_history(conn, account, start, end)
+    finally:
+        if owns_transaction:
+            conn.commit()
+
+    return {
+        'account_id': account_id,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'balances': [{'date': day, 'balance': balance} for day, balance in history],
+    }
@@ -0,0 +1,252 @@
+# This file remembers who is logged in.
+# Login sessions are kept in the database so every server worker sees the same
+# sessions and nobody is logged out when the server restarts. Recently used
+# sessions are also kept in memory so most requests never touch the database.
+# Server-side session storage for SecureBank
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+from database import connect, get_read_connection
+
+SESSION_LIFETIME = int(os.environ.get('SECUREBANK_SESSION_LIFETIME', '3600'))
+# Sliding expiry is only written back once this many seconds have passed
+SESSION_REFRESH_INTERVAL = int(os.environ.get('SECUREBANK_SESSION_REFRESH', '300'))
+CACHE_SIZE = int(os.environ.get('SECUREBANK_SESSION_CACHE_SIZE', '10000'))
+# How long a worker keeps a cached copy before re-reading the store (logged-in
+# sessions are still checked for logout or expiry on every request)
+CACHE_TTL = float(os.environ.get('SECUREBANK_SESSION_CACHE_TTL', '5'))
+PURGE_EVERY = 1000
+
+class SessionStore:
+    """Interface for session backends"""
+
+    def load(self, sid):
+        """Return (data, expires_at) or None"""
+        raise NotImplementedError
+
+    def expires_at(self, sid):
+        """Return the session's expiry without loading its data, or None if it is gone"""
+        record = self.load(sid)
+        return record[1] if record else None
+
+    def save(self, sid, data, expires_at):
+        raise NotImplementedError
+
+    def touch(self, sid, expires_at):
+        """Extend a session without rewriting its data"""
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in the sessions table of the main database
+
+    Writes go through a connection of their own, so saving a session never
+    commits (or waits on) whatever the request did on its pooled connection.
+    """
+
+    def __init__(self):
+        self._writes = 0
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _write(self, sql, parameters, purge=False):
+        with self._lock:
+            if self._conn is None or self._pid != os.getpid():
+                # A forked worker opens its own
+                self._conn = connect()
+                self._pid = os.getpid()
+            self._conn.execute(sql, parameters)
+            if purge:
+                self._conn.execute('DELETE FROM sessions WHERE expires_at < ?', (time.time(),))
+            self._conn.commit()
+
+    def load(self, sid):
+        row = get_read_connection().execute(
+            'SELECT data, expires_at FROM sessions WHERE id = ?', (sid,)
+        ).fetchone()
+        return (json.loads(row['data']), row['expires_at']) if row else None
+
+    def expires_at(self, sid):
+        row = get_read_connection().execute(
+            'SELECT expires_at FROM sessions WHERE id = ?', (sid,)
+        ).fetchone()
+        return row['expires_at'] if row else None
+
+    def save(self, sid, data, expires_at):
+        self._writes += 1
+        self._write('INSERT OR REPLACE INTO sessions (id, data, expires_at) VALUES (?, ?, ?)',
+                    (sid, json.dumps(data), expires_at), purge=self._writes % PURGE_EVERY == 0)
+
+    def touch(self, sid, expires_at):
+        self._write('UPDATE sessions SET expires_at = ? WHERE id = ?', (expires_at, sid))
+
+    def delete(self, sid):
+        self._write('DELETE FROM sessions WHERE id = ?', (sid,))
+
+class CachedSessionStore(SessionStore):
+    """Per-worker LRU of hot sessions in front of another store
+
+    Sessions of logged-in users are still checked against the backend on
+    every hit (a primary key lookup, without reading the data), so a logout
+    or a rotated id on one worker takes effect on all of them at once.
+    """
+
+    def __init__(self, backend, size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.backend = backend
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _put(self, sid, data, expires_at):
+        with self._lock:
+            self._entries[sid] = (data, expires_at, time.monotonic() + self.ttl)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is not None and entry[2] > time.monotonic():
+                self._entries.move_to_end(sid)
+                self.hits += 1
+            else:
+                self._entries.pop(sid, None)
+                self.misses += 1
+                entry = None
+        if entry is not None:
+            if 'user_id' not in entry[0]:
+                return entry[0], entry[1]
+            expires_at = self.backend.expires_at(sid)
+            if expires_at is not None:
+                return entry[0], expires_at
+            with self._lock:
+                self._entries.pop(sid, None)
+            return None
+        record = self.backend.load(sid)
+        if record is not None:
+            self._put(sid, *record)
+        return record
+
+    def save(self, sid, data, expires_at):
+        self.backend.save(sid, data, expires_at)
+        self._put(sid, data, expires_at)
+
+    def touch(self, sid, expires_at):
+        self.backend.touch(sid, expires_at)
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is not None:
+                self._entries[sid] = (entry[0], expires_at, entry[2])
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+        self.backend.delete(sid)
+
+    def stats(self):
+        with self._lock:
+            return {'cached': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session dict that remembers its id and whether it changed"""
+
+    def __init__(self, initial=None, sid=None, expires_at=None, new=False):
+        def on_update(session):
+            session.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.new = new
+        self.modified = False
+        # Set by rotate(); the old id's row is deleted when the session is saved
+        self.previous_sid = None
+
+    def rotate(self):
+        """Move the session to a fresh id, keeping its data
+
+        Called on login so an id planted in the browser beforehand (session
+        fixation) never becomes an authenticated session.
+        """
+        if not self.new and self.previous_sid is None:
+            self.previous_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface backed by a SessionStore"""
+
+    def __init__(self, store):
+        self.store = store
+        self.lookups = 0
+        self.lookup_time = 0.0
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            started = time.perf_counter()
+            record = self.store.load(sid)
+            self.lookups += 1
+            self.lookup_time += time.perf_counter() - started
+            if record is not None and record[1] > time.time():
+                return ServerSession(record[0], sid=sid, expires_at=record[1])
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.previous_sid is not None:
+            self.store.delete(session.previous_sid)
+            session.previous_sid = None
+
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = time.time()
+        expires_at = now + SESSION_LIFETIME
+        if session.modified:
+            self.store.save(session.sid, dict(session), expires_at)
+        elif session.expires_at - now < SESSION_LIFETIME - SESSION_REFRESH_INTERVAL:
+            # Sliding expiry, written at most once per refresh interval
+            self.store.touch(session.sid, expires_at)
+        else:
+            return
+
+        response.set_cookie(
+            name, session.sid,
+            max_age=SESSION_LIFETIME,
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            httponly=self.get_cookie_httponly(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+    def stats(self):
+        result = {
+            'lookups': self.lookups,
+            'lookup_time_avg': self.lookup_time / self.lookups if self.lookups else 0.0,
+        }
+        if isinstance(self.store, CachedSessionStore):
+            result.update(self.store.stats())
+        return result
+
+def init_app(app, store=None):
+    """Use server-side sessions for the app (SQLite store behind an LRU by default)"""
+    app.session_interface = ServerSessionInterface(store or CachedSessionStore(SQLiteSessionStore()))
@@ -0,0 +1,163 @@
+# This file keeps a record of every account's balance at the end of each day.
+# With it, the balance on a past date can be looked up directly instead of
+# being worked out again from years of transactions.
+# Daily balance snapshots for SecureBank
+# account_balance_snapshots holds an account's closing balance for every day
+# its balance changed, and for the day it was opened; the balance on any
+# other day is the latest snapshot before it. The job (./securebank
+# snapshot-balances, run once a day) reads only the transactions since its
+# last run and works the closing balances back from the current balance.
+import time
+from datetime import date, datetime, timedelta, timezone
+import database
+import ledger
+
+BALANCE_HISTORY_DAYS = 30
+BALANCE_HISTORY_MAX_DAYS = 366
+
+def utc_today():
+    # Transaction timestamps come from SQLite's CURRENT_TIMESTAMP, which is UTC
+    return datetime.now(timezone.utc).date()
+
+def _day_after_start(day):
+    """'YYYY-MM-DD' -> the first second of the following day"""
+    return f'{date.fromisoformat(day) + timedelta(days=1)} 00:00:00'
+
+def get_progress(conn):
+    """(last day with complete snapshots or None, highest account id covered)"""
+    row = conn.execute(
+        'SELECT through_day, last_account_id FROM balance_snapshot_progress WHERE id = 1'
+    ).fetchone()
+    return (row['through_day'], row['last_account_id']) if row else (None, 0)
+
+def _snapshot_through(conn, through_day):
+    last_day, last_account_id = get_progress(conn)
+    if last_day is not None and last_day >= through_day:
+        return 0
+    since = _day_after_start(last_day) if last_day else ''
+    end = _day_after_start(through_day)
+
+    # Net flow per account and day since the last run, including today's
+    # so far; accounts opened since the last run get a zero row for their
+    # first day so they have a snapshot even without transactions
+    conn.execute('DROP TABLE IF EXISTS temp.snapshot_flows')
+    conn.execute('''
+        CREATE TEMP TABLE snapshot_flows AS
+        SELECT account_id, day, SUM(amount) AS net
+        FROM (
+            SELECT to_account_id AS account_id, date(created_at) AS day, amount
+            FROM transactions WHERE created_at >= ? AND to_account_id IS NOT NULL
+            UNION ALL
+            SELECT from_account_id, date(created_at), -amount
+            FROM transactions WHERE created_at >= ? AND from_account_id IS NOT NULL
+            UNION ALL
+            SELECT id, MAX(date(created_at), ?), 0
+            FROM accounts WHERE id > ? AND created_at < ?
+        )
+        GROUP BY account_id, day
+    ''', (since, since, since[:10], last_account_id, end))
+
+    # Closing balance of a day = current balance minus everything after it
+    count = conn.execute('''
+        INSERT OR REPLACE INTO account_balance_snapshots (account_id, day, balance)
+        SELECT account_id, day, balance
+        FROM (
+            SELECT f.account_id, f.day,
+                   a.balance - COALESCE(SUM(f.net) OVER (
+                       PARTITION BY f.account_id ORDER BY f.day DESC
+                       ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+                   ), 0) AS balance
+            FROM temp.snapshot_flows f
+            JOIN accounts a ON a.id = f.account_id
+        )
+        WHERE day <= ?
+    ''', (through_day,)).rowcount
+    conn.execute('DROP TABLE temp.snapshot_flows')
+
+    last_account_id = conn.execute(
+        'SELECT COALESCE(MAX(id), ?) FROM accounts WHERE id > ? AND created_at < ?',
+        (last_account_id, last_account_id, end)
+    ).fetchone()[0]
+    conn.execute(
+        'INSERT OR REPLACE INTO balance_snapshot_progress (id, through_day, last_account_id) VALUES (1, ?, ?)',
+        (through_day, last_account_id)
+    )
+    return count
+
+def run_snapshot_job(through_day=None):
+    """Snapshot every closed day since the last run, up to yesterday (UTC)
+
+    One BEGIN IMMEDIATE transaction, retried like ledger writes when the
+    database is busy. After the first run it only touches the transactions
+    since the previous one, i.e. about a day's worth.
+    """
+    through_day = through_day or (utc_today() - timedelta(days=1)).isoformat()
+    started = time.perf_counter()
+    conn = database.connect()
+    try:
+        count = ledger.run_in_transaction(conn, _snapshot_through, through_day)
+    finally:
+        conn.close()
+    return {'through_day': through_day, 'snapshots': count, 'elapsed': time.perf_counter() - started}
+
+def _daily_flows_since(conn, account_id, since):
+    rows = conn.execute('''
+        SELECT day, SUM(amount) AS net
+        FROM (
+            SELECT date(created_at) AS day, amount FROM transactions
+            WHERE to_account_id = ? AND created_at >= ?
+            UNION ALL
+            SELECT date(created_at), -amount FROM transactions
+            WHERE from_account_id = ? AND created_at >= ?
+        )
+        GROUP BY day
+    ''', (account_id, since, account_id, since)).fetchall()
+    return {row['day']: row['net'] for row in rows}
+
+def balance_history(conn, account, first_day, last_day):
+    """[(day, closing balance)] for an account row (id, balance, created_at)
+
+    Days the job has covered are read from the snapshots: the latest one on
+    or before first_day, then the changes up to last_day. Later days are
+    worked back from the current balance using only the transactions since
+    the job's last run. Days before the account was opened are left out.
+    conn should hold one read snapshot so the two parts agree.
+    """
+    through_day, _ = get_progress(conn)
+    opened = account['created_at'][:10]
+    days = [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+    days = [day.isoformat() for day in days if day.isoformat() >= opened]
+    if not days:
+        return []
+
+    balances = {}
+    if through_day is not None and days[0] <= through_day:
+        covered_to = min(days[-1], through_day)
+        base = conn.execute('''
+            SELECT balance FROM account_balance_snapshots
+            WHERE account_id = ? AND day <= ? ORDER BY day DESC LIMIT 1
+        ''', (account['id'], days[0])).fetchone()
+        changes = dict(conn.execute('''
+            SELECT day, balance FROM account_balance_snapshots
+            WHERE account_id = ? AND day > ? AND day <= ? ORDER BY day
+        ''', (account['id'], days[0], covered_to)).fetchall())
+        balance = base['balance'] if base else None
+        for day in days:
+            if day > covered_to:
+                break
+            balance = changes.get(day, balance)
+            balances[day] = balance
+
+    uncovered = [day for day in days if through_day is None or day > through_day]
+    if uncovered:
+        since = _day_after_start(through_day) if through_day else ''
+        flows = _daily_flows_since(conn, account['id'], since)
+        balance = float(account['balance'])
+        # Walk back from today, undoing each day's flows
+        later = sorted(flows, reverse=True)
+        for day in reversed(uncovered):
+            while later and later[0] > day:
+                balance -= flows[later.pop(0)]
+            balances[day] = balance
+
+    return [(day, round(balances[day], 2)) for day in days if balances.get(day) is not None]
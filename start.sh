@@ -1,2 +1,4 @@
 #!/usr/bin/env bash
-gunicorn main:app
\ No newline at end of file
+# Migrate once per deploy; workers then only check the schema version at boot.
+# Threaded workers keep serving other requests while a login waits on the password verifier pool.
+./securebank migrate && exec gunicorn --worker-class gthread --threads 8 main:app
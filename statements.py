@@ -0,0 +1,222 @@
+# This file makes the monthly statements for every customer.
+# A statement shows, for each account, the balance at the start and end of the
+# month, every transaction in the month and the interest that was paid.
+# Monthly statement batch job for SecureBank
+# Users are split into id-range shards. Each shard is handled by one process
+# in a pool, reading from its own read-only snapshot: one ordered scan of the
+# shard's accounts and one ordered index range scan per transaction direction,
+# merged in (user, account, time) order, so only one user's statement is in
+# memory at a time. Statements are written atomically and a finished shard
+# leaves a marker, so an interrupted run resumes where it stopped.
+import heapq
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from functools import lru_cache
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+import database
+
+STATEMENT_WORKERS = int(os.environ.get('SECUREBANK_STATEMENT_WORKERS', str(os.cpu_count() or 1)))
+# Shards per worker; more shards even out the load between processes
+SHARDS_PER_WORKER = 4
+STATEMENT_FORMATS = {'html': 'statement.html', 'text': 'statement.txt', 'json': None}
+FILE_EXTENSIONS = {'html': 'html', 'text': 'txt', 'json': 'json'}
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+FETCH_SIZE = 1000
+
+def period_bounds(period):
+    """'YYYY-MM' -> (first second of the month, first second of the next)"""
+    start = datetime.strptime(period, '%Y-%m')
+    end = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    return start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S')
+
+@lru_cache(maxsize=None)
+def _templates():
+    return Environment(loader=FileSystemLoader(TEMPLATES_DIR), autoescape=select_autoescape(['html']))
+
+def render(statement, statement_format):
+    if statement_format == 'json':
+        return json.dumps(statement, indent=2)
+    return _templates().get_template(STATEMENT_FORMATS[statement_format]).render(**statement)
+
+def _rows(cursor):
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            return
+        yield from rows
+
+def _transaction_scan(conn, column, first_user, last_user, start):
+    # Driven by idx_accounts_user_id and then the (account, created_at)
+    # index of the direction, so rows come out already ordered
+    return _rows(conn.execute(f'''
+        SELECT a.user_id, a.id AS account_id, t.id, t.from_account_id, t.to_account_id,
+               t.transaction_type, t.amount, t.description, t.created_at
+        FROM accounts a
+        JOIN transactions t ON t.{column} = a.id
+        WHERE a.user_id BETWEEN ? AND ? AND t.created_at >= ?
+        ORDER BY a.user_id, a.id, t.created_at, t.id
+    ''', (first_user, last_user, start)))
+
+def _transaction_key(row):
+    return row['user_id'], row['account_id'], row['created_at'], row['id']
+
+def iter_statements(conn, first_user, last_user, period):
+    """Yield (account_number, statement) for each user in the id range
+
+    Closing balances are worked back from the current balance and the
+    transactions after the period, so conn should hold one read snapshot.
+    """
+    start, end = period_bounds(period)
+    types = {row['id']: row['type_name'] for row in conn.execute('SELECT id, type_name FROM account_types')}
+    transactions = heapq.merge(
+        _transaction_scan(conn, 'to_account_id', first_user, last_user, start),
+        _transaction_scan(conn, 'from_account_id', first_user, last_user, start),
+        key=_transaction_key,
+    )
+    pending = next(transactions, None)
+    accounts = _rows(conn.execute('''
+        SELECT u.id AS user_id, u.account_number, u.full_name, a.id, a.account_type_id, a.balance
+        FROM users u
+        JOIN accounts a ON a.user_id = u.id
+        WHERE u.id BETWEEN ? AND ? AND a.created_at < ?
+        ORDER BY u.id, a.id
+    ''', (first_user, last_user, end)))
+
+    statement, user_id = None, None
+    for account in accounts:
+        if account['user_id'] != user_id:
+            if statement is not None:
+                yield statement['account_number'], statement
+            user_id = account['user_id']
+            statement = {
+                'account_number': account['account_number'],
+                'full_name': account['full_name'],
+                'period': period,
+                'period_start': start,
+                'period_end': end,
+                'accounts': [],
+            }
+
+        key = (user_id, account['id'])
+        # Skip transactions of accounts opened after the period
+        while pending is not None and (pending['user_id'], pending['account_id']) < key:
+            pending = next(transactions, None)
+
+        in_period, net_in_period, net_after, interest = [], 0.0, 0.0, 0.0
+        while pending is not None and (pending['user_id'], pending['account_id']) == key:
+            amount = float(pending['amount'])
+            if pending['to_account_id'] != account['id']:
+                amount = -amount
+            if pending['created_at'] < end:
+                net_in_period += amount
+                if pending['transaction_type'] == 'INTEREST':
+                    interest += amount
+                in_period.append({
+                    'id': pending['id'],
+                    'type': pending['transaction_type'],
+                    'amount': amount,
+                    'description': pending['description'],
+                    'created_at': pending['created_at'],
+                })
+            else:
+                net_after += amount
+            pending = next(transactions, None)
+
+        closing = float(account['balance']) - net_after
+        statement['accounts'].append({
+            'account_id': account['id'],
+            'account_type': types.get(account['account_type_id'], 'Unknown'),
+            'opening_balance': round(closing - net_in_period, 2),
+            'closing_balance': round(closing, 2),
+            'interest_credited': round(interest, 2),
+            'transactions': in_period,
+        })
+    if statement is not None:
+        yield statement['account_number'], statement
+
+def _shard_marker(directory, first_user, last_user):
+    return os.path.join(directory, f'.shard-{first_user}-{last_user}.done')
+
+def generate_shard(database_path, period, statement_format, directory, first_user, last_user):
+    """Write the statements of one user id range; runs in a pool process
+
+    Statements already on disk are kept, so a rerun only fills the gaps.
+    Returns (statements written, statements skipped).
+    """
+    extension = FILE_EXTENSIONS[statement_format]
+    written = skipped = 0
+    conn = database.connect(database_path, readonly=True)
+    try:
+        conn.execute('BEGIN')
+        for account_number, statement in iter_statements(conn, first_user, last_user, period):
+            path = os.path.join(directory, f'{account_number}.{extension}')
+            if os.path.exists(path):
+                skipped += 1
+                continue
+            partial = path + '.partial'
+            with open(partial, 'w') as out:
+                out.write(render(statement, statement_format))
+            os.replace(partial, path)
+            written += 1
+        conn.commit()
+    finally:
+        conn.close()
+    open(_shard_marker(directory, first_user, last_user), 'w').close()
+    return written, skipped
+
+def plan_shards(conn, shards):
+    """Split the user id range into at most `shards` contiguous ranges"""
+    first, last = conn.execute('SELECT MIN(id), MAX(id) FROM users').fetchone()
+    if first is None:
+        return []
+    step = max(1, -(-(last - first + 1) // shards))
+    return [(lo, min(lo + step - 1, last)) for lo in range(first, last + 1, step)]
+
+def generate_statements(period, output, statement_format='html', workers=None):
+    """Write every user's statement for period into output/<period>/
+
+    Shards run in a pool of `workers` processes. Shards finished by an
+    earlier, interrupted run are skipped. Returns counts, elapsed time and
+    throughput in statements per second, overall and per core.
+    """
+    if statement_format not in STATEMENT_FORMATS:
+        raise ValueError(f"Format must be one of {', '.join(STATEMENT_FORMATS)}")
+    period_bounds(period)
+    workers = workers or STATEMENT_WORKERS
+    directory = os.path.join(output, period)
+    os.makedirs(directory, exist_ok=True)
+
+    conn = database.connect(readonly=True)
+    try:
+        shards = plan_shards(conn, workers * SHARDS_PER_WORKER)
+    finally:
+        conn.close()
+    todo = [s for s in shards if not os.path.exists(_shard_marker(directory, *s))]
+    if len(todo) < len(shards):
+        print(f"Resuming: {len(shards) - len(todo)} of {len(shards)} shards already done")
+
+    started = time.perf_counter()
+    written = skipped = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(generate_shard, os.path.abspath(database.DATABASE), period,
+                               statement_format, directory, lo, hi) for lo, hi in todo]
+        for done, future in enumerate(as_completed(futures), start=1):
+            shard_written, shard_skipped = future.result()
+            written += shard_written
+            skipped += shard_skipped
+            print(f"  {done}/{len(todo)} shards, {written} statements written")
+    elapsed = time.perf_counter() - started
+
+    per_second = written / elapsed if elapsed else 0.0
+    return {
+        'statements': written,
+        'skipped': skipped,
+        'shards': len(todo),
+        'workers': workers,
+        'elapsed': elapsed,
+        'statements_per_second': per_second,
+        'statements_per_second_per_core': per_second / workers,
+    }
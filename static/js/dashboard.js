@@ -5,80 +5,78 @@
 // Handles account info, transactions, and form logic for deposit, withdraw, and transfer
 let currentAccountId = null;
 
-async function loadAccountInfo() {
+// Accounts, total balance and recent transactions come from one request
+async function loadDashboard() {
     try {
-        const response = await fetch('/api/account-info');
+        const response = await fetch('/api/dashboard');
         const data = await response.json();
         
-        if (response.ok && data.accounts && data.accounts.length > 0) {
-            let totalBalance = 0;
-            const accountsContainer = document.getElementById('accountsContainer') || document.createElement('div');
-            accountsContainer.id = 'accountsContainer';
-            accountsContainer.innerHTML = '';
-            
-            data.accounts.forEach(account => {
-                totalBalance += account.balance;
-                const accountDiv = document.createElement('div');
-                accountDiv.className = 'account-item';
-                accountDiv.innerHTML = `
-                    <div class="account-type">${account.account_type} Account</div>
-                    <div class="account-balance">$${account.balance.toFixed(2)}</div>
-                    <div class="account-details">
-                        <div>Interest Rate: ${account.interest_rate}%</div>
-                        <div>Minimum Balance: $${account.minimum_balance}</div>
-                    </div>
-                `;
-                accountsContainer.appendChild(accountDiv);
-            });
-            
-            document.getElementById('balance').textContent = `$${totalBalance.toFixed(2)}`;
-            
-            // Insert accounts container after the main balance display
-            const balanceContainer = document.querySelector('.account-summary');
-            if (!document.getElementById('accountsContainer')) {
-                balanceContainer.parentNode.insertBefore(accountsContainer, balanceContainer.nextSibling);
-            }
-            
-            // Set the current account ID to the first account
-            currentAccountId = data.accounts[0].account_id;
+        if (response.ok) {
+            renderAccounts(data.accounts, data.total_balance);
+            renderTransactions(data.transactions);
         }
     } catch (error) {
-        console.error('Error loading account info:', error);
+        console.error('Error loading dashboard:', error);
     }
 }
 
-async function loadTransactions() {
-    try {
-        const response = await fetch('/api/transactions');
-        const transactions = await response.json();
-        
-        const transactionsList = document.getElementById('transactionsList');
-        
-        if (transactions.length === 0) {
-            transactionsList.innerHTML = '<p class="loading">No transactions yet</p>';
-            return;
-        }
+function renderAccounts(accounts, totalBalance) {
+    const accountsContainer = document.getElementById('accountsContainer') || document.createElement('div');
+    accountsContainer.id = 'accountsContainer';
+    accountsContainer.innerHTML = '';
+    
+    accounts.forEach(account => {
+        const accountDiv = document.createElement('div');
+        accountDiv.className = 'account-item';
+        accountDiv.innerHTML = `
+            <div class="account-type">${account.account_type} Account</div>
+            <div class="account-balance">$${account.balance.toFixed(2)}</div>
+            <div class="account-details">
+                <div>Interest Rate: ${account.interest_rate}%</div>
+                <div>Minimum Balance: $${account.minimum_balance}</div>
+            </div>
+        `;
+        accountsContainer.appendChild(accountDiv);
+    });
+    
+    // The total is computed by the server
+    document.getElementById('balance').textContent = `$${totalBalance.toFixed(2)}`;
+    
+    // Insert accounts container after the main balance display
+    const balanceContainer = document.querySelector('.account-summary');
+    if (!document.getElementById('accountsContainer')) {
+        balanceContainer.parentNode.insertBefore(accountsContainer, balanceContainer.nextSibling);
+    }
+    
+    // Set the current account ID to the first account
+    currentAccountId = accounts[0].account_id;
+}
+
+function renderTransactions(transactions) {
+    const transactionsList = document.getElementById('transactionsList');
+    
+    if (transactions.length === 0) {
+        transactionsList.innerHTML = '<p class="loading">No transactions yet</p>';
+        return;
+    }
+    
+    transactionsList.innerHTML = transactions.map(t => {
+        const isPositive = t.type === 'DEPOSIT' || t.type === 'TRANSFER';
+        const amountClass = isPositive ? 'positive' : 'negative';
+        const sign = isPositive ? '+' : '-';
         
-        transactionsList.innerHTML = transactions.map(t => {
-            const isPositive = t.type === 'DEPOSIT' || t.type === 'TRANSFER';
-            const amountClass = isPositive ? 'positive' : 'negative';
-            const sign = isPositive ? '+' : '-';
-            
-            return `
-                <div class="transaction-item">
-                    <div class="transaction-info">
-                        <div class="transaction-type">${t.type}</div>
-                        <div class="transaction-date">${new Date(t.created_at).toLocaleString()}</div>
-                    </div>
-                    <div class="transaction-amount ${amountClass}">
-                        ${sign}$${t.amount.toFixed(2)}
-                    </div>
+        return `
+            <div class="transaction-item">
+                <div class="transaction-info">
+                    <div class="transaction-type">${t.type}</div>
+                    <div class="transaction-date">${new Date(t.created_at).toLocaleString()}</div>
                 </div>
-            `;
-        }).join('');
-    } catch (error) {
-        console.error('Error loading transactions:', error);
-    }
+                <div class="transaction-amount ${amountClass}">
+                    ${sign}$${t.amount.toFixed(2)}
+                </div>
+            </div>
+        `;
+    }).join('');
 }
 
 function showNotification(message, isError = false) {
@@ -113,8 +111,7 @@ document.getElementById('depositForm').addEventListener('submit', async (e) => {
         if (response.ok) {
             showNotification(data.message);
             document.getElementById('depositAmount').value = '';
-            await loadAccountInfo();
-            await loadTransactions();
+            await loadDashboard();
         } else {
             showNotification(data.error, true);
         }
@@ -142,8 +139,7 @@ document.getElementById('withdrawForm').addEventListener('submit', async (e) =>
         if (response.ok) {
             showNotification(data.message);
             document.getElementById('withdrawAmount').value = '';
-            await loadAccountInfo();
-            await loadTransactions();
+            await loadDashboard();
         } else {
             showNotification(data.error, true);
         }
@@ -239,8 +235,7 @@ document.getElementById('transferForm').addEventListener('submit', async (e) =>
             } else {
                 document.getElementById('externalAccount').value = '';
             }
-            await loadAccountInfo();
-            await loadTransactions();
+            await loadDashboard();
         } else {
             showNotification(data.error, true);
         }
@@ -250,6 +245,5 @@ document.getElementById('transferForm').addEventListener('submit', async (e) =>
 });
 
 // Initial loads
-loadAccountInfo();
-loadTransactions();
+loadDashboard();
 loadAccountTypes();
@@ -0,0 +1,209 @@
+# This file enforces limits on how much money can leave an account (or a
+# customer) within an hour and within a day, set per account type.
+# Velocity limits for SecureBank
+# Each worker keeps compact ring-buffer counters of recent outgoing amounts
+# per account and per user: 60 one-minute buckets for the hourly window and
+# 24 one-hour buckets for the daily one, each with a running total. They are
+# rebuilt from the last day of transactions on first use. The check runs
+# inside the ledger's write transaction: it first reads the rows committed
+# since its last look (a rowid seek, so commits from other workers count too)
+# and then compares four running totals, so its cost does not depend on how
+# much history there is.
+import threading
+import time
+from array import array
+import database
+from ledger import LedgerError
+
+HOUR = 3600
+DAY = 86400
+
+# Columns of account_types; NULL means no limit
+LIMITS = (
+    ('hourly_limit', 'account', 'hour', 'Hourly limit for this account'),
+    ('daily_limit', 'account', 'day', 'Daily limit for this account'),
+    ('user_hourly_limit', 'user', 'hour', 'Hourly limit for your accounts'),
+    ('user_daily_limit', 'user', 'day', 'Daily limit for your accounts'),
+)
+
+class VelocityLimitExceeded(LedgerError):
+    """The outgoing amount would go over an hourly or daily limit"""
+
+class Ring:
+    """Sum of amounts over the last `slots` buckets of `width` seconds"""
+
+    __slots__ = ('width', 'amounts', 'head', 'total')
+
+    def __init__(self, slots, width):
+        self.width = width
+        self.amounts = array('d', bytes(8 * slots))
+        self.head = 0
+        self.total = 0.0
+
+    def _advance(self, bucket):
+        # At most `slots` buckets are cleared, however long it was idle
+        slots = len(self.amounts)
+        if bucket - self.head >= slots:
+            self.amounts = array('d', bytes(8 * slots))
+            self.total = 0.0
+        else:
+            for b in range(self.head + 1, bucket + 1):
+                self.total -= self.amounts[b % slots]
+                self.amounts[b % slots] = 0.0
+        self.head = bucket
+
+    def add(self, when, amount):
+        bucket = int(when // self.width)
+        if bucket > self.head:
+            self._advance(bucket)
+        elif bucket <= self.head - len(self.amounts):
+            return
+        self.amounts[bucket % len(self.amounts)] += amount
+        self.total += amount
+
+    def sum(self, now):
+        bucket = int(now // self.width)
+        if bucket > self.head:
+            self._advance(bucket)
+        return max(self.total, 0.0)
+
+class Counter:
+    """Outgoing amounts of one account or user over the last hour and day"""
+
+    __slots__ = ('hour', 'day')
+
+    def __init__(self):
+        self.hour = Ring(60, HOUR / 60)
+        self.day = Ring(24, DAY / 24)
+
+    def add(self, when, amount):
+        self.hour.add(when, amount)
+        self.day.add(when, amount)
+
+class VelocityLimiter:
+    """Per-worker counters, kept in step with one database's transactions table"""
+
+    def __init__(self, path):
+        self.database = path
+        self.counters = {}
+        self.last_row = None
+        self.rebuilds = 0
+        self._pruned_at = time.time()
+        self._lock = threading.Lock()
+
+    def _apply(self, rows):
+        for row in rows:
+            counter = self.counters.get(('account', row['from_account_id']))
+            if counter is None:
+                counter = self.counters[('account', row['from_account_id'])] = Counter()
+            counter.add(row['at'], row['amount'])
+            # Moving money between one's own accounts is not money leaving the user
+            if row['to_user_id'] != row['user_id']:
+                counter = self.counters.get(('user', row['user_id']))
+                if counter is None:
+                    counter = self.counters[('user', row['user_id'])] = Counter()
+                counter.add(row['at'], row['amount'])
+            self.last_row = tuple(row)
+
+    def _outgoing(self, conn, where, params):
+        return conn.execute(f'''
+            SELECT t.id, t.from_account_id, t.amount,
+                   CAST(strftime('%s', t.created_at) AS INTEGER) AS at,
+                   a.user_id, b.user_id AS to_user_id
+            FROM transactions t
+            JOIN accounts a ON a.id = t.from_account_id
+            LEFT JOIN accounts b ON b.id = t.to_account_id
+            WHERE {where} AND t.from_account_id IS NOT NULL
+            ORDER BY t.id
+        ''', params).fetchall()
+
+    def rebuild(self, conn):
+        """Reload the counters from the last day of outgoing transactions"""
+        self.counters = {}
+        self.last_row = None
+        self.rebuilds += 1
+        self._apply(self._outgoing(conn, "t.created_at >= datetime('now', '-1 day')", ()))
+        if self.last_row is None:
+            row = conn.execute('SELECT MAX(id) FROM transactions').fetchone()
+            self.last_row = (row[0] or 0,)
+
+    def prune(self, now):
+        """Drop the counters of accounts and users with nothing in the last day"""
+        self.counters = {key: counter for key, counter in self.counters.items() if counter.day.sum(now) > 0}
+        self._pruned_at = now
+
+    def sync(self, conn):
+        """Count the transactions written since the last sync
+
+        The last row seen is read again; if it is gone or changed (its
+        transaction was rolled back), the counters are rebuilt.
+        """
+        if self.last_row is None:
+            self.rebuild(conn)
+            return
+        rows = self._outgoing(conn, 't.id >= ?', (self.last_row[0],))
+        if len(self.last_row) > 1:
+            if not rows or tuple(rows[0]) != self.last_row:
+                self.rebuild(conn)
+                return
+            rows = rows[1:]
+        self._apply(rows)
+
+    def check(self, conn, account_id, user_id, amount, limits, external, pending=None, now=None):
+        """Raise VelocityLimitExceeded if amount would go over a limit
+
+        Must run inside the write transaction that moves the money. pending
+        holds amounts already accepted earlier in the same transaction but not
+        yet written (batch transfers); it is updated when the check passes.
+        """
+        now = time.time() if now is None else now
+        pending = {} if pending is None else pending
+        with self._lock:
+            self.sync(conn)
+            if now - self._pruned_at > HOUR:
+                self.prune(now)
+            keys = {'account': ('account', account_id), 'user': ('user', user_id)}
+            for column, scope, window, label in LIMITS:
+                limit = limits.get(column)
+                if limit is None or (scope == 'user' and not external):
+                    continue
+                counter = self.counters.get(keys[scope])
+                used = getattr(counter, window).sum(now) if counter else 0.0
+                if used + pending.get((keys[scope], window), 0.0) + amount > limit:
+                    raise VelocityLimitExceeded(f'{label} of ${limit:.2f} would be exceeded')
+            for scope in ('account', 'user') if external else ('account',):
+                for window in ('hour', 'day'):
+                    pending[(keys[scope], window)] = pending.get((keys[scope], window), 0.0) + amount
+
+    def stats(self):
+        return {'counters': len(self.counters), 'rebuilds': self.rebuilds}
+
+_limiters = {}
+_limiter_lock = threading.Lock()
+
+def get_limiter(shard=0):
+    """This process's limiter for a shard's database (rebuilt on first use)"""
+    path = database.shard_path(shard)
+    limiter = _limiters.get(path)
+    if limiter is None:
+        with _limiter_lock:
+            limiter = _limiters.get(path)
+            if limiter is None:
+                limiter = _limiters[path] = VelocityLimiter(path)
+    return limiter
+
+def guard(account, account_type, external):
+    """A ledger check for money leaving `account`, or None without limits
+
+    account is the accounts row; account_type the catalog entry of its type.
+    external says whether the money leaves the user (withdrawals and
+    transfers to someone else), which is what the per-user limits count.
+    The returned callable takes (conn, amount, pending=None).
+    """
+    limits = {column: account_type.get(column) for column, _, _, _ in LIMITS}
+    if all(limit is None for limit in limits.values()):
+        return None
+
+    def check(conn, amount, pending=None):
+        get_limiter(conn.shard).check(conn, account['id'], account['user_id'], amount, limits, external, pending)
+    return check